@@ -1,16 +1,27 @@
-from bs4 import BeautifulSoup as bs
 from bs4 import element
 
+from crosswalk import addSumoDbIds
 from typing import Tuple, Union
 
 import helpers
 import pandas as pd
 import re
+import sys
 
 
 AWARD_URL = r'https://sumo.or.jp/EnHonbashoMain/champions/'
 SAVE_LOCATION = r'C:\Users\blarg\Documents\SQL Server Management Studio\SumoScripts\{}'
 
+EXPECTED_KEYWORDS = [
+    None
+]
+
+EXPECTED_OPTIONS = {
+    None: None
+}
+
+COMMAND_LINE_USAGE_MSG = "Usage :: python awardsUpdater.py [--profile] [--tracemalloc]"
+
 def scrapeAwardCell(cell_src: element.Tag) -> Tuple[Union[int, None], Union[str, None]]:
     """***************************************************************************
 
@@ -100,7 +111,7 @@ def downloadAwards(page_src: str) -> pd.DataFrame:
     * A formatted dataframe
     ***************************************************************************"""
 
-    soup = bs(page_src, 'html.parser')
+    soup = helpers.makeSoup(page_src)
     winners = soup.select_one("div.mdSection1:nth-child(1)")
     awards = soup.select_one("#sansho")
 
@@ -121,10 +132,16 @@ def downloadAwards(page_src: str) -> pd.DataFrame:
 
 
 def main():
+    kywrd_args, optns = helpers.parseSysArgs(sys.argv)
+    helpers.validateSysArgs(kywrd_args, optns, EXPECTED_KEYWORDS,
+                            EXPECTED_OPTIONS, COMMAND_LINE_USAGE_MSG)
+
     with helpers.getHeadlessDriver(AWARD_URL) as driver:
         page_src = driver.page_source
 
     win_data, awrd_data = downloadAwards(page_src)
+    win_data = addSumoDbIds(win_data, {"jsa_id": "id"})
+    awrd_data = addSumoDbIds(awrd_data, {"jsa_id": "id"})
     win_data.to_csv(SAVE_LOCATION.format("winners.csv"), index=False)
     awrd_data.to_csv(SAVE_LOCATION.format("awards.csv"), index=False)
 
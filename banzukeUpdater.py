@@ -5,18 +5,31 @@ import sys
 
 import helpers
 
+from crosswalk import Crosswalk
+from functools import partial
+from urllib.parse import urlparse
+from jobJournal import MAX_ATTEMPTS, JobJournal, runJob
 from pathlib import Path
+from profileCache import DEFAULT_MAX_AGE, ProfileCache
+from rateControl import RateController
+from responseCache import ResponseCache
+from runMetrics import METRICS
 from selenium import webdriver
 from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, NoSuchElementException
 from selenium.webdriver.support.select import Select
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as ec
+from typing import Union
 
-from bs4 import BeautifulSoup as bs, Tag
+from bs4 import Tag
 
 
 BANZUKE_URL = "https://sumo.or.jp/EnHonbashoBanzuke/index/"
+# A page of a division's banzuke addressed directly, by division number and
+# page, as the links of the page selector do
+BANZUKE_PAGE_URL = "https://sumo.or.jp/EnHonbashoBanzuke/index/{}/{}/"
 PROFILE_URL = "https://sumo.or.jp/EnSumoDataRikishi/profile/{}/"
+SUMODB_BANZUKE_URL = "http://sumodb.sumogames.de/Banzuke.aspx"
 SAVE_DEST = r"C:\Users\blarg\Documents\SQL Server Management Studio\SumoScripts\newBasho.csv"
 DIV_MAP = {"M": 1, "J": 2, "Ms": 3, "Sd": 4, "Jd": 5, "Jk": 6}
 
@@ -42,68 +55,151 @@ PROFILE_HDRS = list(PROFILE_DICT.keys())
 
 SYS_ARGS = {
     "write_option": 'w',
-    "retry": False
+    "retry": False,
+    "workers": 1,
+    "banzuke_workers": 4,
+    "recycle": 50,
+    "click": False,
+    "profile_age": DEFAULT_MAX_AGE,
+    "cache": False,
+    "keep": False,
+    "metrics": None
 }
 
 EXPECTED_KEYWORDS = [
     None,
     "append",
     "a",
-    "retry"
+    "retry",
+    "cache",
+    "keep",
+    "click"
 ]
 
 EXPECTED_OPTIONS = {
-    None
+    None: None,
+    "workers": any,
+    "banzuke_workers": any,
+    "recycle": any,
+    "profile_age": any,
+    "metrics": any,
+    "parser": helpers.PARSER_BACKENDS
 }
 
-COMMAND_LINE_USAGE_MSG = "Usage :: python banzukeUpdater.py [[--retry] [--append | --a]]"
+COMMAND_LINE_USAGE_MSG = "Usage :: python banzukeUpdater.py [[--retry] [--append | --a] [--cache] [--keep] [--click]]\
+ [-workers <n>] [-banzuke_workers <n>] [-recycle <pages>] [-profile_age <days>]\
+ [-metrics <path>] [-parser <html.parser | lxml>]"
 
 TEMP_BANZUKE = r".\temp\tempBanzData.csv"
 TEMP_PROFILE = r".\temp\tempProfileData.csv"
 
 
-def downloadBanzuke(write_option: str = 'w') -> pd.DataFrame:
+def startJob(job: str, keys: set, write_option: str, path: str, columns: list,
+             retry: bool = False) -> JobJournal:
     """***************************************************************************
 
-    Download the banzuke ranks and rikishi from teh official sumo website.
+    Open the journal of {job}. Writing ('w') starts the job over with {keys}
+    and a {path} holding only the header row; appending ('a') carries on with
+    the keys the last run did not finish, the keys it failed on, plus any of
+    {keys} it never had.
 
     ### Parameters ###
-    *
+    * job : name of the job in the journal
+    * keys : keys of the job, divisions or jsa ids
+    * write_option : 'w' or 'a'
+    * path : temporary file the job appends its rows to
+    * columns : header of {path}
+    * retry : retry failed keys up to jobJournal.MAX_ATTEMPTS times, otherwise
+              every key gets a single attempt
 
     ### Return ###
-    *
+    * JobJournal of the job
     ***************************************************************************"""
-    filtered_div_map = DIV_MAP.copy()
+    journal = JobJournal(job, max_attempts=MAX_ATTEMPTS if retry else 1)
     if write_option == 'a':
-        append_df = pd.read_csv(TEMP_BANZUKE)
-        parsed_divisions = append_df['division'].unique()
-        for key, val in DIV_MAP.items():
-            if val in parsed_divisions:
-                filtered_div_map.pop(key)
+        journal.retryFailed()
+        journal.extend(keys)
+    else:
+        journal.clear()
+        journal.add(keys)
+        pd.DataFrame(columns=columns).to_csv(path, index=False)
+    return journal
+# END OF startJob
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def downloadBanzuke(write_option: str = 'w', retry: bool = False, workers: int = 1,
+                    recycle_after: int = 50, click: bool = False) -> pd.DataFrame:
+    """***************************************************************************
+
+    Download the banzuke ranks and rikishi from teh official sumo website.
+
+    The pages of every division are loaded directly and at once by {workers}
+    drivers, see scrapeBanzukeDirect. Divisions whose pages cannot be
+    addressed that way, or every division with {click}, are read by selecting
+    the division and clicking through its pages in a single driver.
+
+    Each division's rows are appended to {TEMP_BANZUKE} as soon as it is
+    parsed and only then marked done in the "banzuke" job of the jobJournal,
+    so appending carries on with the divisions left to do.
+
+    ### Parameters ###
+    * write_option : 'w' to start over, 'a' to carry on with the last run
+    * retry : retry divisions that failed, see startJob
+    * workers : number of headless drivers to load pages with directly
+    * recycle_after : number of pages after which a driver is relaunched
+    * click : only use the select and click path
+
+    ### Return ###
+    * Dataframe of every division parsed so far
+    ***************************************************************************"""
+    columns = list(BANZUKE_DICT) + [x for x in PROFILE_HDRS if x not in BANZUKE_DICT]
+    journal = startJob("banzuke", set(DIV_MAP), write_option, TEMP_BANZUKE,
+                       columns, retry)
+
+    def write(key: str, data: list) -> None:
+        with METRICS.stage("write"):
+            df = pd.DataFrame(data=data, columns=columns).drop_duplicates()
+            df.to_csv(TEMP_BANZUKE, index=False, mode='a', header=False)
+        METRICS.count("pages")
+        journal.done(key)
+
+    def runPass(divisions: list) -> bool:
+        # the journal hands out keys in no particular order, the file is kept
+        # in banzuke order
+        divisions = [key for key in DIV_MAP if key in divisions]
+        direct = dict()
+        if not click:
+            with helpers.DriverPool(workers, recycle_after) as pool:
+                direct = scrapeBanzukeDirect(pool, divisions)
+
+        remaining = [key for key in divisions if direct.get(key) is None]
+        for key in divisions:
+            if direct.get(key) is not None:
+                write(key, direct[key])
+        if not remaining:
+            return True
 
-    data = list()
-    try:
         with helpers.getHeadlessDriver(BANZUKE_URL) as banzuke_driver:
-            for key in filtered_div_map.keys():
+            for key in remaining:
                 print(f"Parsing the {key} page")
-                data.extend(scrapeBanzuke(banzuke_driver, key))
+                try:
+                    data = scrapeBanzuke(banzuke_driver, key)
+                except Exception as e:
+                    print(e)
+                    journal.fail(key, str(e))
+                    continue
+                write(key, data)
+        return True
+
+    try:
+        runJob(journal, runPass)
     except Exception as e:
         print(e)
     finally:
-        if len(data) == 0 and os.path.exists(TEMP_BANZUKE):
-            return pd.read_csv(TEMP_BANZUKE)
-
-        df = pd.DataFrame(data=data)
-        df.drop_duplicates(inplace=True)
-
-        df[ [x for x in PROFILE_HDRS if x not in df.columns]  ] = None
-        df.to_csv(TEMP_BANZUKE, index=False,
-                    mode=write_option, header=(write_option != 'a'))
-
+        journal.close()
 
-    if write_option == 'a':
-        df = pd.concat([append_df, df])
-    return df
+    return pd.read_csv(TEMP_BANZUKE, dtype={"jsa_id": str})
 # END OF downloadBanzuke
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -183,7 +279,7 @@ def scrapeBanzuke(driver: webdriver, division: str) -> list:
     except StaleElementReferenceException:
         pass
 
-    soup = bs(driver.page_source, "html.parser")
+    soup = helpers.makeSoup(driver.page_source)
     rikishi_rows = soup.select(".bTnone")
     try:
         next_page = None
@@ -207,7 +303,7 @@ def scrapeBanzuke(driver: webdriver, division: str) -> list:
                 ec.staleness_of(next_page_link)
             )
 
-            soup = bs(driver.page_source, "html.parser")
+            soup = helpers.makeSoup(driver.page_source)
             rikishi_rows.extend(soup.select(".bTnone"))
             next_page = driver_waiter.until(
                 lambda x: x.find_element("css selector", ".page_next")
@@ -215,6 +311,158 @@ def scrapeBanzuke(driver: webdriver, division: str) -> list:
     except NoSuchElementException:
         pass
 
+    return parseBanzukeRows(rikishi_rows, division)
+# END OF parseBanzuke
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def loadBanzukePage(driver: webdriver.Firefox, division: str, page: int) -> Union[str, None]:
+    """***************************************************************************
+
+    Load page {page} of the banzuke of {division} directly by its url
+
+    ### Return ###
+    * Page source, None if it did not load or shows another division
+    ***************************************************************************"""
+    driver_waiter = WebDriverWait(driver, timeout=30)
+    with METRICS.stage("navigate"):
+        driver.get(BANZUKE_PAGE_URL.format(DIV_MAP[division], page))
+    try:
+        with METRICS.stage("wait"):
+            selector = driver_waiter.until(
+                lambda x: Select(x.find_element("id", "kaku_select")))
+            driver_waiter.until(
+                ec.presence_of_element_located(("css selector", ".bTnone")))
+    except TimeoutException:
+        return None
+
+    if selector.first_selected_option.get_attribute("value") != str(DIV_MAP[division]):
+        return None
+    return driver.page_source
+# END OF loadBanzukePage
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def banzukePageCount(soup) -> Union[int, None]:
+    """***************************************************************************
+
+    Read the number of pages of a division from the page selector of its
+    first page
+
+    ### Return ###
+    * Number of pages, 1 without a page selector, None if the selector has a
+      next link but no page numbers to tell how many there are
+    ***************************************************************************"""
+    next_page = soup.select_one(".page_next")
+    if next_page is None:
+        return 1
+    numbers = [int(a.text.strip()) for a in next_page.parent.find_all("a")
+               if a.text.strip().isdigit()]
+    if numbers:
+        return max(numbers)
+    return None if next_page.find("a", string=">") else 1
+# END OF banzukePageCount
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def scrapeBanzukeDirect(pool: helpers.DriverPool, divisions: list) -> dict:
+    """***************************************************************************
+
+    Download the banzuke of {divisions} by loading their pages directly by
+    url, all of them at once across {pool}. The first page of every division
+    is queued first, and tells how many more pages there are; every page is
+    parsed once.
+
+    ### Parameters ###
+    * pool : drivers to load the pages with
+    * divisions : Character strings of the divisions
+
+    ### Return ###
+    * Map of division to its rows, see parseBanzukeRows. None for divisions
+      whose pages could not be loaded or addressed directly, which are left to
+      the select and click path
+    ***************************************************************************"""
+    load = lambda driver, page: loadBanzukePage(driver, *page)
+    first = dict([(div, pool.submit(load, (div, 1))) for div in divisions])
+
+    soups = dict()
+    rest = dict()
+    for div in divisions:
+        try:
+            page_src = first[div].result()
+        except Exception as e:
+            print(f"Could not load the {div} banzuke directly: {e}")
+            page_src = None
+        count = None
+        if page_src is not None:
+            soups[div] = [helpers.makeSoup(page_src)]
+            count = banzukePageCount(soups[div][0])
+        if count is None:
+            print(f"Cannot address the {div} banzuke pages directly")
+            soups.pop(div, None)
+            continue
+        rest[div] = [pool.submit(load, (div, page)) for page in range(2, count + 1)]
+
+    results = dict([(div, None) for div in divisions])
+    for div, futures in rest.items():
+        for page, fut in enumerate(futures, 2):
+            try:
+                page_src = fut.result()
+            except Exception as e:
+                print(f"Could not load page {page} of the {div} banzuke: {e}")
+                page_src = None
+            if page_src is None:
+                soups.pop(div, None)
+                break
+            soups[div].append(helpers.makeSoup(page_src))
+        if div not in soups:
+            continue
+
+        pages = [soup.select(".bTnone") for soup in soups[div]]
+        # a url that ignores the page shows the first page again
+        if len(pages) > 1 and str(pages[1]) == str(pages[0]):
+            print(f"The {div} banzuke pages cannot be addressed directly")
+            continue
+        results[div] = parseBanzukeRows([row for rows in pages for row in rows], div)
+        print(f"Parsed the {div} banzuke, {len(pages)} pages")
+    return results
+# END OF scrapeBanzukeDirect
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def parseBanzukePage(page_src: str, division: str) -> list:
+    """***************************************************************************
+
+    Parse the page source of a single banzuke page of a division
+
+    ### Parameters ###
+    * page_src : page source of a loaded banzuke page
+    * division : Character string for division
+
+    ### Return ###
+    * List of rikishi rows, see parseBanzukeRows
+    ***************************************************************************"""
+    soup = helpers.makeSoup(page_src)
+    return parseBanzukeRows(soup.select(".bTnone"), division)
+# END OF parseBanzukePage
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+@METRICS.timed("parse")
+def parseBanzukeRows(rikishi_rows: list, division: str) -> list:
+    """***************************************************************************
+
+    Turn the rank rows of a division's banzuke into a list of dictionaries, one
+    per rikishi on the east or west side of each row. Positions count up within
+    a repeated rank, and repeated rank/position/side entries are marked "TD"
+
+    ### Parameters ###
+    * rikishi_rows : ".bTnone" row tags of every page of the division
+    * division : Character string for division
+
+    ### Return ###
+    * List of dicts keyed by BANZUKE_DICT
+    ***************************************************************************"""
     page_data = list()
     rank_map = set()
     prev_rank = ""
@@ -256,52 +504,71 @@ def scrapeBanzuke(driver: webdriver, division: str) -> list:
             print(f"error {e}")
             continue
     return page_data
-# END OF parseBanzuke
+# END OF parseBanzukeRows
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
-def downloadProfiles(write_option: str, toDo_ids: set, retry:bool = False) -> pd.DataFrame:
+def downloadProfiles(write_option: str, toDo_ids: set, retry:bool = False,
+                     workers: int = 1, recycle_after: int = 50,
+                     cache: ResponseCache = None) -> pd.DataFrame:
     """***************************************************************************
 
+    Download the JSA profile of every id in {toDo_ids} into {TEMP_PROFILE}
 
+    The ids are tracked in the "jsa_profiles" job of the jobJournal. Each pass
+    appends the profiles it loaded to {TEMP_PROFILE} and only then marks them
+    done, so a profile is written once however often the download is resumed.
 
     ### Parameters ###
-    *
+    * write_option : 'w' to start over, 'a' to carry on with the last run
+    * toDo_ids : jsa ids to download
+    * retry : retry ids that failed, up to jobJournal.MAX_ATTEMPTS times each
+    * workers : number of headless drivers to load profiles with
+    * recycle_after : number of pages after which a driver is relaunched
+    * cache : ResponseCache of previously loaded profile pages
 
     ### Return ###
-    *
+    * Dataframe of profile data
     ***************************************************************************"""
-    finished_ids = []
-    if write_option == 'a':
-        append_df = pd.read_csv(TEMP_PROFILE)
-        finished_ids = append_df.dropna(subset='full_shikona')['jsa_id'].unique()
-
-    toDo_ids.difference_update(set(finished_ids))
+    toDo_ids = set([str(id_) for id_ in toDo_ids])
+    journal = startJob("jsa_profiles", toDo_ids, write_option, TEMP_PROFILE,
+                       PROFILE_HDRS, retry)
+    # the drivers start gently and open up to {workers} loads at once
+    rate = RateController(max_concurrency=workers, start=1)
+
+    def runPass(ids: list) -> bool:
+        profile_data = list()
+        try:
+            if workers > 1:
+                profile_data = parseProfilesPooled(ids, workers, recycle_after, cache, rate)
+            else:
+                with helpers.getHeadlessDriver() as driver:
+                    profile_data = parseProfiles(driver, ids, cache, rate)
+        except Exception as e:
+            print(e)
+        finally:
+            # profiles without a shikona were not loaded properly, retried
+            profile_data = [d for d in profile_data if d["full_shikona"]]
+            with METRICS.stage("write"):
+                prof_df = pd.DataFrame(data=profile_data, columns=PROFILE_HDRS)
+                prof_df.to_csv(TEMP_PROFILE, index=False, mode='a', header=False)
+            METRICS.count("pages", len(profile_data))
+            for d in profile_data:
+                journal.done(d["jsa_id"])
+        return True
 
     try:
-        with helpers.getHeadlessDriver() as driver:
-            profile_data = parseProfiles(driver, toDo_ids)
-    except Exception as e:
-        print(e)
+        runJob(journal, runPass)
     finally:
-        prof_df = pd.DataFrame(data=profile_data)
-        prof_df.to_csv(TEMP_PROFILE, index=False,
-                       mode=write_option, header=(write_option != 'a'))
-
-    if write_option == 'a':
-        prof_df = pd.concat([append_df, prof_df])
+        journal.close()
+        rate.report()
 
-    toDo_ids.difference_update(set(prof_df['jsa_id'].unique()))
-
-    if (len(toDo_ids) == 0 or not retry):
-        return prof_df
-    else:
-        print("Retrying profile download")
-        return downloadProfiles(write_option, toDo_ids, retry)
+    return pd.read_csv(TEMP_PROFILE, dtype={"jsa_id": str})
 # END OF sca
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+@METRICS.timed("parse")
 def getProfileData(page_source: str, jsa_id: int) -> dict:
     """***************************************************************************
     __summary__:
@@ -315,7 +582,7 @@ def getProfileData(page_source: str, jsa_id: int) -> dict:
     * dict { "height": {@code height}, "weight": {@code weight} }
     ***************************************************************************"""
     try:
-        soup = bs(page_source, "html.parser")
+        soup = helpers.makeSoup(page_source)
         profile_tbl = soup.find("table", class_="mdTable2")
     except AttributeError:
         print(f"Couldn't find table for {jsa_id}")
@@ -401,7 +668,61 @@ def getProfileData(page_source: str, jsa_id: int) -> dict:
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
-def parseProfiles(driver: webdriver.Firefox, jsa_ids: list) -> list:
+def parseProfile(driver: webdriver.Firefox, jsa_id: int, cache: ResponseCache = None,
+                 rate: RateController = None) -> dict:
+    """***************************************************************************
+
+    Load and parse the profile page of a single rikishi, retrying the page load
+    up to MAX_ERROR times if the driver lands on the wrong url. A fresh copy in
+    {cache} is used without loading the page at all.
+
+    ### Parameters ###
+    * driver : Firefox Webdriver used to parse pages
+    * jsa_id : jsa Id number used to format url and download data
+    * cache : ResponseCache of previously loaded pages
+    * rate : RateController shared by every driver loading from the JSA site,
+             pacing the page loads and setting the wait timeout
+
+    ### Return ###
+    * Profile data, or None if the page could not be loaded
+    ***************************************************************************"""
+    url = PROFILE_URL.format(jsa_id)
+    if cache:
+        page_src = cache.get(url)
+        if page_src is not None:
+            return getProfileData(page_src, jsa_id)
+
+    rate = rate or RateController(max_concurrency=1, start=1)
+    MAX_ERROR = 3
+    error_cnt = 0
+    with rate.slot(url) as outcome:
+        with METRICS.stage("navigate"):
+            driver.get(url)
+            for _ in range(MAX_ERROR):
+                if (ec.url_matches(url)(driver)):
+                    break
+                else:
+                    print(f"{driver.current_url} for {jsa_id}, retrying")
+                    driver.get(url)
+                    error_cnt += 1
+
+        if error_cnt >= MAX_ERROR:
+            outcome.failed()
+            return None
+
+        with METRICS.stage("wait"):
+            WebDriverWait(driver, timeout=rate.timeout(urlparse(url).netloc, 30)).until(
+                ec.presence_of_element_located(("css selector", ".mdTable2")))
+        page_src = driver.page_source
+    if cache:
+        cache.put(url, page_src)
+    return getProfileData(page_src, jsa_id)
+# END OF parseProfile
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def parseProfiles(driver: webdriver.Firefox, jsa_ids: list, cache: ResponseCache = None,
+                  rate: RateController = None) -> list:
     """***************************************************************************
 
     Uses a given driver to parse all the profile pages listed in the jsa_ids list.
@@ -410,6 +731,8 @@ def parseProfiles(driver: webdriver.Firefox, jsa_ids: list) -> list:
     ### Parameters ###
     * driver : Firefox Webdriver used to parse pages
     * jsa_id : jsa Id number used to format url and download data
+    * cache : ResponseCache of previously loaded pages
+    * rate : RateController pacing the page loads
 
     ### Return ###
     * List of all the profile data
@@ -419,24 +742,10 @@ def parseProfiles(driver: webdriver.Firefox, jsa_ids: list) -> list:
     try:
         for idx, id in enumerate(jsa_ids):
             print(f"{id}: Parsing Profile {idx+1}/{len(jsa_ids)}")
-
-            MAX_ERROR = 3
-            error_cnt = 0
-            driver.get(PROFILE_URL.format(id))
-            for _ in range(MAX_ERROR):
-                if (ec.url_matches(PROFILE_URL.format(id))(driver)):
-                    break
-                else:
-                    print(f"{driver.current_url} for {id}, retrying")
-                    driver.get(PROFILE_URL.format(id))
-                    error_cnt += 1
-
-            if error_cnt >= MAX_ERROR:
+            d = parseProfile(driver, id, cache, rate)
+            if d is None:
                 errors.append(f"{id}\n")
             else:
-                WebDriverWait(driver, timeout=30).until(
-                    ec.presence_of_element_located(("css selector", ".mdTable2")))
-                d = getProfileData(driver.page_source, id)
                 data.append(d)
 
     except Exception as e:
@@ -449,43 +758,110 @@ def parseProfiles(driver: webdriver.Firefox, jsa_ids: list) -> list:
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+def parseProfilesPooled(jsa_ids: list, workers: int, recycle_after: int,
+                        cache: ResponseCache = None, rate: RateController = None) -> list:
+    """***************************************************************************
+
+    Parse all the profile pages listed in the jsa_ids list across a pool of
+    {workers} headless drivers. Ids that could not be loaded are written into
+    the error_log.txt
+
+    ### Parameters ###
+    * jsa_ids : jsa Id numbers used to format url and download data
+    * workers : number of drivers to run at once
+    * recycle_after : number of pages after which a driver is relaunched
+    * cache : ResponseCache of previously loaded pages
+    * rate : RateController shared by the drivers of the pool
+
+    ### Return ###
+    * List of all the profile data
+    ***************************************************************************"""
+    jsa_ids = list(jsa_ids)
+    with helpers.DriverPool(workers, recycle_after) as pool:
+        results = pool.map(partial(parseProfile, cache=cache, rate=rate), jsa_ids)
+
+    errors = [f"{id}\n" for id, d in zip(jsa_ids, results) if d is None]
+    with open("error_log.txt", 'w') as f:
+        f.writelines(errors)
+    return [d for d in results if d is not None]
+# END OF parseProfilesPooled
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def sumoDbRankIndex(page_src: str) -> pd.DataFrame:
+    """***************************************************************************
+
+    Index the SumoDB banzuke page by rank, read in a single pass over its
+    short_rank cells. Each cell is flanked by the east rikishi before it and
+    the west rikishi after it.
+
+    ### Parameters ###
+    * page_src : page source of {SUMODB_BANZUKE_URL}
+
+    ### Return ###
+    * Dataframe of short_rank (e.g. "Y", "M3"), occurrence (how many cells
+      with the same rank came before, which tells the Yokozuna, Ozeki,
+      Sekiwake and Komusubi apart), side ('e' or 'w') and the SumoDB id
+    ***************************************************************************"""
+    soup = helpers.makeSoup(page_src)
+    rows = list()
+    occurrences = dict()
+    for cell in soup.find_all("td", class_="short_rank"):
+        if cell.string is None:
+            continue
+        rank = cell.string.strip()
+        occurrence = occurrences.get(rank, 0)
+        occurrences[rank] = occurrence + 1
+
+        for side, wrestler in [('e', cell.find_previous_sibling('td')),
+                               ('w', cell.find_next_sibling('td'))]:
+            link = wrestler.find('a') if wrestler else None
+            if link is None:
+                continue
+            id_ = link['href']
+            rows.append((rank, occurrence, side, id_[id_.find("r=") + 2:]))
+    return pd.DataFrame(rows, columns=["short_rank", "occurrence", "side", "id"])
+# END OF sumoDbRankIndex
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
 def consolidateWithSumoDB(df: pd.DataFrame) ->  pd.DataFrame:
     """***************************************************************************
 
     Consolidate profiles pulled from the Sumo website with the sumodb. In
-    particular pulling down the db ids. Uses ranks to find
+    particular pulling down the db ids. Uses ranks to find them, joining
+    {df} against the index of sumoDbRankIndex in one merge
 
     ### Parameters ###
     * df : Dataframe containing jsa website data
 
     ### Return ###
-    * Dataframe with ID column
+    * Dataframe with ID column, None where SumoDB has no rikishi at the rank
     ***************************************************************************"""
-    soup = None
-    with helpers.getHeadlessDriver(r"http://sumodb.sumogames.de/Banzuke.aspx") as driver:
-        WebDriverWait(driver, timeout=30).until(
-            ec.url_matches(r"http://sumodb.sumogames.de/Banzuke.aspx"))
-        soup = bs(driver.page_source, 'html.parser')
-
-    df['id'] = None
-    for i in range(len(df)):
-        rank = df.loc[i]['rank_name']
-        pos = 0
-        if rank not in ['Y', 'O', 'S', 'K']:
-            rank += str(df.loc[i]['pos'])
-        else:
-            pos = df.loc[i]['pos'] - 1
-
-        elem = soup.find_all("td", string=rank, class_='short_rank')[pos]
-        wrestler = None
-        if df.loc[i]['side'] == 'e':
-            wrestler = elem.find_previous_sibling('td')
-        else:
-            wrestler = elem.find_next_sibling('td')
-
-        id_ = wrestler.find('a')['href']
-        id_ = id_[id_.find("r=") + 2:]
-        df.loc[i, 'id'] = id_
+    with helpers.HttpFetcher(timeout=30) as fetcher:
+        page_src = fetcher.get(SUMODB_BANZUKE_URL)
+    if page_src is None:
+        raise ConnectionError(f"Could not download {SUMODB_BANZUKE_URL}")
+
+    with METRICS.stage("parse"):
+        index = sumoDbRankIndex(page_src)
+
+    # Sanyaku ranks have no number on SumoDB, their position is the how manyth
+    # cell of that rank it is; every other rank is numbered, e.g. "M3"
+    sanyaku = df['rank_name'].isin(['Y', 'O', 'S', 'K'])
+    pos = pd.to_numeric(df['pos'], errors='coerce').astype("Int64")
+    keys = pd.DataFrame({
+        "short_rank": df['rank_name'].where(sanyaku, df['rank_name'] + pos.astype(str)),
+        "occurrence": (pos - 1).where(sanyaku, 0),
+        "side": df['side']
+    })
+    ids = keys.merge(index, how='left', on=["short_rank", "occurrence", "side"])['id']
+
+    df['id'] = ids.where(ids.notna(), None).to_numpy()
+    missing = keys[ids.isna().to_numpy()]
+    if len(missing):
+        print(f"No SumoDB rikishi at {len(missing)} ranks: "
+              + ", ".join(missing['short_rank'] + missing['side']))
     return df
 # END OF consolidateWithSumoDB
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -516,23 +892,77 @@ def handleSysArgs():
 
         if "retry" in kywrd_args:
             SYS_ARGS["retry"] = True
+
+        if "cache" in kywrd_args:
+            SYS_ARGS["cache"] = True
+
+        if "keep" in kywrd_args:
+            SYS_ARGS["keep"] = True
+
+        if "click" in kywrd_args:
+            SYS_ARGS["click"] = True
+
+    if optns:
+        if "parser" in optns:
+            helpers.setParser(optns["parser"])
+
+        if "metrics" in optns:
+            SYS_ARGS["metrics"] = optns["metrics"]
+
+        if "profile_age" in optns:
+            try:
+                SYS_ARGS["profile_age"] = float(optns["profile_age"])
+                assert SYS_ARGS["profile_age"] >= 0
+            except (ValueError, AssertionError):
+                raise ValueError(
+                    f"profile_age must be a number of days. {COMMAND_LINE_USAGE_MSG}")
+
+        for key in ["workers", "banzuke_workers", "recycle"]:
+            if key in optns:
+                try:
+                    SYS_ARGS[key] = int(optns[key])
+                    assert SYS_ARGS[key] > 0
+                except (ValueError, AssertionError):
+                    raise ValueError(
+                        f"{key} must be a positive integer. {COMMAND_LINE_USAGE_MSG}")
 # END OF handleSysArgs
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-def main():
-    handleSysArgs()
+def updateBanzuke():
+    """***************************************************************************
 
-    banz_df = downloadBanzuke(SYS_ARGS['write_option'])
+    Download the banzuke and profiles of the coming basho, match them to their
+    SumoDB ids and write them to {SAVE_DEST}
+    ***************************************************************************"""
+    banz_df = downloadBanzuke(SYS_ARGS['write_option'], SYS_ARGS["retry"],
+                              SYS_ARGS["banzuke_workers"], SYS_ARGS["recycle"], SYS_ARGS["click"])
     print("PARSING PROFILE DATA")
-    prof_df = downloadProfiles(
-        SYS_ARGS['write_option'],
-        set(banz_df['jsa_id'].unique()),
-        SYS_ARGS["retry"]
-    )
+    jsa_ids = set(banz_df['jsa_id'].unique())
+    cache = ResponseCache() if SYS_ARGS["cache"] else None
+    profile_cache = ProfileCache()
+    try:
+        # only new rikishi and profiles gone stale are fetched, the rest are
+        # read from the profile cache
+        stale = profile_cache.stale(jsa_ids, PROFILE_HDRS[1:], SYS_ARGS["profile_age"])
+        print(f"{len(jsa_ids) - len(stale)} profiles are fresh, fetching {len(stale)}")
+        profile_cache.put(downloadProfiles(
+            SYS_ARGS['write_option'],
+            stale,
+            SYS_ARGS["retry"],
+            SYS_ARGS["workers"],
+            SYS_ARGS["recycle"],
+            cache
+        ))
+        prof_df = profile_cache.read(jsa_ids, PROFILE_HDRS)
+    finally:
+        profile_cache.close()
+        if cache:
+            cache.report()
+            cache.close()
 
-    mstrdf = banz_df.set_index('jsa_id')\
-                .update(prof_df.set_index('jsa_id'))\
-                .reset_index()
+    # the banzuke file carries empty profile columns, filled from prof_df
+    mstrdf = banz_df.drop(columns=[x for x in PROFILE_HDRS if x != 'jsa_id'], errors='ignore')\
+        .merge(prof_df, on='jsa_id', how='left')
 
     mstrdf["birth_date"] = pd.to_datetime(mstrdf["birth_date"])
     now = dt.datetime.now()
@@ -544,20 +974,38 @@ def main():
     mstrdf['basho_num'] = month
     mstrdf['basho'] = f"{now.year}.{str(month).zfill(2)}"
 
-    consolidateWithSumoDB(mstrdf)
+    # SumoDB ids never change, so only rikishi the crosswalk does not know yet
+    # are matched by rank against the SumoDB banzuke
+    with Crosswalk() as crosswalk:
+        crosswalk.attach(mstrdf)
+        unmapped = mstrdf['id'].isna()
+        if unmapped.any():
+            print(f"Matching {unmapped.sum()} rikishi without a SumoDB id")
+            matched = consolidateWithSumoDB(mstrdf[unmapped].reset_index(drop=True))
+            mstrdf.loc[unmapped, 'id'] = matched['id'].to_numpy()
+            crosswalk.record(matched)
 
     mstrdf.convert_dtypes()\
         .to_csv( SAVE_DEST, index=False )
 
-    user_res = ""
-    while (not user_res in ['Y', 'N']):
-        user_res = input("Remove Temporary files? Y/N : ").upper()
-        if user_res == 'Y':
-            os.remove(TEMP_BANZUKE)
-            os.remove(TEMP_PROFILE)
-        elif user_res == 'N':
-            break
+    # The run is complete, so the temporary files are only needed to inspect
+    # it with --keep
+    if not SYS_ARGS["keep"]:
+        os.remove(TEMP_BANZUKE)
+        os.remove(TEMP_PROFILE)
     return 0
+# END OF updateBanzuke
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def main():
+    handleSysArgs()
+    METRICS.reset("banzukeUpdater")
+    try:
+        return updateBanzuke()
+    finally:
+        METRICS.finish(SYS_ARGS["metrics"])
+
 
 if __name__ == "__main__":
     main()
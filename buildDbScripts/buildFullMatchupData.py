@@ -1,4 +1,10 @@
+import hashlib
+import headToHead
+import json
+import os
 import pandas   as pd
+import parquetStore
+import sys
 
 from pathlib import Path
 
@@ -15,48 +21,333 @@ DIV_MAP = {
         ,'Jk':6
     }
 
-directory = r'.\matchupData'
-data = Path(directory)
-mstrdf = pd.DataFrame()
-if not Path(r".\fullMatchups.csv").exists():
-    for idx, file in enumerate(data.iterdir()):
+DIRECTORY = r'.\matchupData'
+SAVE_DEST = r".\fullMatchups.csv"
+RESULTS_PATH = r".\fullResults.csv"
+MANIFEST_PATH = r".\fullMatchups.manifest.json"
+METRICS_PATH = r".\fullMatchups.metrics.json"
+
+# The scrapers' sqliteStore and runMetrics live in the project folder, one
+# level up
+ROOT_DIR = str(Path(__file__).resolve().parent.parent)
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+import helpers
+
+from runMetrics import METRICS
+
+SYS_ARGS = {
+    "full": False,
+    "sqlite": False,
+    "parquet": False,
+    "metrics": False
+}
+
+EXPECTED_KEYWORDS = [
+    None,
+    "full",
+    "sqlite",
+    "parquet",
+    "metrics"
+]
+
+EXPECTED_OPTIONS = {
+    None: None
+}
+
+COMMAND_LINE_USAGE_MSG = "Usage :: python buildFullMatchupData.py [--full] [--sqlite] [--parquet]\
+ [--metrics] [--profile] [--tracemalloc]"
+
+MU_DTYPES = {'BASHO':str,
+             'DAY':int,
+             'OPP':int,
+             'RESULT':str,
+             'KIMARITE':str}
+
+# dtypes of the written fullMatchups.csv when it is read back for splicing
+OUT_DTYPES = dict(MU_DTYPES, ID=str, MU_ID=str, RESULT_ID=str, OPP_RESULT_ID=str)
+
+
+def fileSignature(path:Path, old:dict = None) -> dict:
+    """***************************************************************************
+
+    Size, mtime and sha256 of a matchup file. The file is only hashed when its
+    size or mtime differ from {old}, so unchanged files cost a stat call.
+
+    ### Parameters ###
+    * path : file to describe
+    * old : the file's previous manifest entry, if any
+
+    ### Return ###
+    * dict of size, mtime and sha256
+    ***************************************************************************"""
+    stat = path.stat()
+    sig = {"size": stat.st_size, "mtime": stat.st_mtime}
+    if old and old["size"] == sig["size"] and old["mtime"] == sig["mtime"]:
+        sig["sha256"] = old["sha256"]
+    else:
+        sig["sha256"] = hashlib.sha256(path.read_bytes()).hexdigest()
+    return sig
+# END OF fileSignature
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def resultsSignature(path:str = RESULTS_PATH) -> list:
+    """Size and mtime of fullResults.csv, which the division columns come from"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def loadManifest(path:str = MANIFEST_PATH) -> dict:
+    """***************************************************************************
+
+    Read the manifest of the last build, an empty one if there is none
+
+    ### Return ###
+    * dict with the "files" entries and the "results" signature
+    ***************************************************************************"""
+    if not os.path.isfile(path):
+        return {"files": dict(), "results": None}
+    with open(path, 'r') as f:
+        return json.load(f)
+# END OF loadManifest
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+@METRICS.timed("read")
+def readMatchupFiles(files:list) -> pd.DataFrame:
+    """***************************************************************************
+
+    Read matchup files written by matchupScraper into one dataframe with the ID
+    and MU_ID columns added
+
+    ### Parameters ###
+    * files : paths of the files to read
+
+    ### Return ###
+    * Dataframe of every bout in {files}
+    ***************************************************************************"""
+    frames = [pd.DataFrame(columns=list(MU_DTYPES) + ['ID']).astype(MU_DTYPES)]
+    for idx, file in enumerate(files):
         print(f"{idx}: {file.name}")
-        curr_mu = pd.read_csv(file, dtype = {'BASHO':str,
-                                            'DAY':int,
-                                            'OPP':int,
-                                            'RESULT':str,
-                                            'KIMARITE':str})
+        curr_mu = pd.read_csv(file, dtype = MU_DTYPES)
         curr_mu['ID'] = file.name.split(".csv")[0]
-        mstrdf = pd.concat([curr_mu, mstrdf])
+        frames.append(curr_mu)
+    mstrdf = pd.concat(frames[1:] or frames, ignore_index=True)
+    METRICS.count("files", len(files))
+
+    return addMatchupId(mstrdf)
+# END OF readMatchupFiles
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
 
+def addMatchupId(mstrdf:pd.DataFrame) -> pd.DataFrame:
     mstrdf['MU_ID'] = mstrdf['ID'].astype(str) + '.' \
         + mstrdf['OPP'].astype(str)+ '.' \
         + mstrdf['BASHO']+ '.' \
         + mstrdf['DAY'].astype(str)
-else:
-    mstrdf = pd.read_csv(r".\fullMatchups.csv")
+    return mstrdf
+
+
+def buildFromStore(path:str = None) -> pd.DataFrame:
+    """***************************************************************************
+
+    Build fullMatchups.csv from the bouts written by matchupScraper -store
+    sqlite. Reading the store is a single query, so this is always a full
+    build and the file manifest is dropped.
 
-iddf = pd.read_csv(r".\fullResults.csv")
+    ### Parameters ###
+    * path : store to read, sqliteStore.STORE_PATH if not provided
 
-def foo(df:pd.DataFrame, iddf:pd.DataFrame, id_col:str, rank_col:str):
-    """Using a {id_col} key, join dataframes on the key column and
-    the pull the RANK_NAME column from the {iddf}. Apply the DIV_MAP
-    to the rank_name column and store it in the {rank_col} column"""
+    ### Return ###
+    * The full matchup dataframe, sorted by ID, BASHO, DAY and OPP
+    ***************************************************************************"""
+    import sqliteStore
 
-    df[id_col] = df['ID'].astype(str) + '.' + df['BASHO'].astype(str)
-    df = df.set_index(id_col)
-    iddf = iddf.set_index(id_col)
+    with METRICS.stage("read"):
+        mstrdf = sqliteStore.readBouts(path or sqliteStore.STORE_PATH)
+    mstrdf['ID'] = mstrdf['ID'].astype(str)
+    mstrdf = addDivisions(addMatchupId(mstrdf), pd.read_csv(RESULTS_PATH).set_index('RESULT_ID'))
+    mstrdf.sort_values(by=['ID','BASHO','DAY','OPP'], inplace=True)
 
-    df = df.join(iddf['RANK_NAME'])
-    df[rank_col] = df['RANK_NAME'].apply(lambda x : DIV_MAP.get(x, 7))
+    with METRICS.stage("write"):
+        mstrdf.to_csv(SAVE_DEST, index=False)
+    if os.path.isfile(MANIFEST_PATH):
+        os.remove(MANIFEST_PATH)
+    with METRICS.stage("index"):
+        headToHead.HeadToHead.fromBouts(mstrdf).save()
+    return mstrdf
+# END OF buildFromStore
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def foo(df:pd.DataFrame, iddf:pd.DataFrame, key_col:str, id_col:str, rank_col:str):
+    """Using a {id_col} key built from the {key_col} rikishi and the basho, join
+    dataframes on the key column and the pull the RANK_NAME column from the
+    {iddf}. Apply the DIV_MAP to the rank_name column and store it in the
+    {rank_col} column"""
+
+    df[id_col] = df[key_col].astype(str) + '.' + df['BASHO'].astype(str)
+    df = df.join(iddf['RANK_NAME'], on=id_col)
+    df[rank_col] = df['RANK_NAME'].map(DIV_MAP).fillna(7).astype(int)
     df.drop(columns=['RANK_NAME'],inplace=True)
-    df.reset_index(drop=True, inplace=True)
+    return df
+
+
+@METRICS.timed("transform")
+def addDivisions(mstrdf:pd.DataFrame, iddf:pd.DataFrame) -> pd.DataFrame:
+    """***************************************************************************
+
+    Set the DIVISION of each bout to the lower of the two rikishi's divisions
+    at that basho, per fullResults.csv
+
+    ### Parameters ###
+    * mstrdf : bouts, with or without a previous DIVISION column
+    * iddf : fullResults.csv indexed by RESULT_ID
+
+    ### Return ###
+    * {mstrdf} with the RESULT_ID, OPP_RESULT_ID and DIVISION columns set
+    ***************************************************************************"""
+    mstrdf = mstrdf.drop(columns=['DIVISION'], errors='ignore')
+    mstrdf = foo(mstrdf, iddf, 'ID', 'RESULT_ID', 'DIVID')
+    mstrdf = foo(mstrdf, iddf, 'OPP', 'OPP_RESULT_ID', 'DIVOPP')
+
+    mstrdf['DIVISION'] = mstrdf[['DIVID', 'DIVOPP']].max(axis=1)
+    mstrdf.drop(columns=['DIVID', 'DIVOPP'],inplace=True)
+    return mstrdf
+# END OF addDivisions
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def buildMatchups(directory:str = DIRECTORY, full:bool = False) -> pd.DataFrame:
+    """***************************************************************************
+
+    Build fullMatchups.csv from the files in {directory}, reusing the previous
+    output wherever its manifest shows the input file is unchanged. Only new
+    and changed files are read and joined against fullResults.csv; their rows,
+    and the rows of deleted files, are spliced out of the previous output. If
+    fullResults.csv itself changed, the divisions of every bout are joined
+    again without rereading any matchup file.
+
+    The head-to-head index, see headToHead, is updated the same way: the pairs
+    of the ids of new, changed and removed files are counted again from their
+    new rows only. It is built from every bout when there is none yet.
+
+    ### Parameters ###
+    * directory : folder of matchup files written by matchupScraper
+    * full : ignore the manifest and rebuild from every file
+
+    ### Return ###
+    * The full matchup dataframe, sorted by ID, BASHO, DAY and OPP
+    ***************************************************************************"""
+    manifest = {"files": dict(), "results": None}
+    if not full and os.path.isfile(SAVE_DEST):
+        manifest = loadManifest()
+    old_files = manifest["files"]
+
+    files = dict()
+    changed = list()
+    for file in Path(directory).iterdir():
+        sig = fileSignature(file, old_files.get(file.name))
+        files[file.name] = sig
+        old = old_files.get(file.name)
+        if old is None or old["sha256"] != sig["sha256"]:
+            changed.append(file)
+    removed = set(old_files).difference(files)
+    print(f"{len(changed)} new or changed files, {len(removed)} removed,"
+          f" {len(files) - len(changed)} unchanged")
+
+    iddf = pd.read_csv(RESULTS_PATH).set_index('RESULT_ID')
+    results_sig = resultsSignature()
+
+    kept = pd.DataFrame()
+    stale = set()
+    if old_files:
+        stale = set([f.name.split(".csv")[0] for f in changed])
+        stale.update([name.split(".csv")[0] for name in removed])
+        try:
+            kept = pd.read_csv(SAVE_DEST, dtype=OUT_DTYPES)
+            kept = kept[~kept['ID'].isin(stale)]
+        except ValueError:
+            kept = None
+
+        expected = sum([sig["rows"] for name, sig in old_files.items()
+                        if name.split(".csv")[0] not in stale])
+        if kept is None or len(kept) != expected:
+            print(f"{SAVE_DEST} does not match its manifest, rebuilding")
+            return buildMatchups(directory, full=True)
+
+        if manifest["results"] != results_sig:
+            print(f"{RESULTS_PATH} changed, joining divisions again")
+            kept = addDivisions(kept, iddf)
+
+    delta = addDivisions(readMatchupFiles(changed), iddf)
+    rows = delta.groupby('ID').size()
+    for file in changed:
+        files[file.name]["rows"] = int(rows.get(file.name.split(".csv")[0], 0))
+    for name, sig in files.items():
+        sig.setdefault("rows", old_files.get(name, {}).get("rows", 0))
+
+    parts = [df for df in [kept, delta] if len(df)]
+    mstrdf = pd.concat(parts, ignore_index=True) if parts else delta
+    mstrdf.sort_values(by=['ID','BASHO','DAY','OPP'], inplace=True)
+
+    with METRICS.stage("write"):
+        mstrdf.to_csv(SAVE_DEST, index=False)
+    with METRICS.stage("index"):
+        if old_files and os.path.isfile(headToHead.H2H_PATH):
+            h2h = headToHead.HeadToHead.load().update(delta, stale)
+        else:
+            h2h = headToHead.HeadToHead.fromBouts(mstrdf)
+        h2h.save()
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump({"files": files, "results": results_sig}, f)
+    return mstrdf
+# END OF buildMatchups
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def handleSysArgs():
+    """***************************************************************************
+
+    Parse and validate the system arguments with the helpers lib, storing the
+    results in {SYS_ARGS}
+    ***************************************************************************"""
+    kywrd_args, optns = helpers.parseSysArgs(sys.argv)
+    helpers.validateSysArgs(kywrd_args, optns, EXPECTED_KEYWORDS,
+                            EXPECTED_OPTIONS, COMMAND_LINE_USAGE_MSG)
+
+    if kywrd_args:
+        for key in SYS_ARGS:
+            SYS_ARGS[key] = key in kywrd_args
+# END OF handleSysArgs
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def main():
+    """***************************************************************************
+
+    Usage :: python buildFullMatchupData.py [--full] [--sqlite] [--parquet] [--metrics]
+            [--profile] [--tracemalloc]
 
-foo(mstrdf, iddf, 'RESULT_ID', 'DIVID')
-foo(mstrdf, iddf, 'OPP_RESULT_ID', 'DIVOPP')
+    --sqlite reads the bouts from the scrapers' sqliteStore instead of
+    {DIRECTORY}. --parquet also writes the table as a parquet dataset
+    partitioned by BASHO, see parquetStore. --metrics writes the stage timings
+    printed at the end to {METRICS_PATH}. --profile and --tracemalloc profile
+    each stage, see runProfiler
+    ***************************************************************************"""
+    handleSysArgs()
+    METRICS.reset("buildFullMatchupData")
+    if SYS_ARGS["sqlite"]:
+        mstrdf = buildFromStore()
+    else:
+        mstrdf = buildMatchups(DIRECTORY, full=SYS_ARGS["full"])
+    if SYS_ARGS["parquet"]:
+        with METRICS.stage("write"):
+            parquetStore.writeMatchups(mstrdf)
+    METRICS.finish(METRICS_PATH if SYS_ARGS["metrics"] else None)
 
-mstrdf['DIVISION'] = mstrdf[['DIVID', 'DIVOPP']].max(axis=1)
-mstrdf.drop(columns=['DIVID', 'DIVOPP'],inplace=True)
-mstrdf.sort_values(by=['ID','BASHO','DAY'], inplace=True)
 
-mstrdf.to_csv(r".\fullMatchups.csv", index=False)
+if __name__ == "__main__":
+    main()
@@ -1,85 +1,265 @@
+import numpy    as np
 import pandas   as pd
-import re
+import parquetStore
+import recordCodec
 import sys
 
 from pathlib import Path
 
 FOLDER = 'wrestlerData'
+SAVE_DEST = "fullResults.csv"
+METRICS_PATH = "fullResults.metrics.json"
 
-def splitRank(s:str) -> list:
-    if type(s) != type(str()):
-        return [None, None, None, None]
-
-    result = re.match(r"(\D*)(\d*)([e|w]*)(\D*)", s)
-    groups = [x if len(x) > 0 else ' ' for x in result.groups()]
-    while len(groups) < 4:
-        groups.append(' ')
-    return tuple(groups)
-
-def toInt(s:str):
-    if not s:
-        return None
-    elif s == ' ':
-        return 0
+# The scrapers' sqliteStore and runMetrics live in the project folder, one
+# level up
+ROOT_DIR = str(Path(__file__).resolve().parent.parent)
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+import helpers
+
+from runMetrics import METRICS
+
+SYS_ARGS = {
+    "sqlite": False,
+    "parquet": False,
+    "metrics": False
+}
+
+EXPECTED_KEYWORDS = [
+    None,
+    "sqlite",
+    "parquet",
+    "metrics"
+]
+
+EXPECTED_OPTIONS = {
+    None: None
+}
+
+COMMAND_LINE_USAGE_MSG = "Usage :: python buildFullResultsData.py [--sqlite] [--parquet] [--metrics]\
+ [--profile] [--tracemalloc]"
+
+# Number of rikishi files read and filled per batch
+BATCH_SIZE = 500
+
+RANK_PATT = r"(\D*)(\d*)([e|w]*)(\D*)"
+RANK_COLS = ['RANK_NAME', 'POS', 'SIDE', 'OTHER']
+
+DIVISIONS = {
+    'Y':1
+    ,'S':1
+    ,'O':1
+    ,'K':1
+    ,'M':1
+    ,'J':2
+    ,'Ms':3
+    ,'Sd':4
+    ,'Jd':5
+    ,'Jk':6
+}
+
+DAYS = 15
+
+
+@METRICS.timed("read")
+def readBatch(files:list) -> pd.DataFrame:
+    """***************************************************************************
+
+    Read a batch of rikishi result files into one dataframe, tagging each row
+    with the id from its file name, and fill in the heights and weights
+
+    ### Parameters ###
+    * files : paths of csv files written by resultsScraper
+
+    ### Return ###
+    * Dataframe of the batch, rows in the order of {files}
+    ***************************************************************************"""
+    frames = list()
+    for file in files:
+        temp_df = pd.read_csv(file, dtype={'BASHO':str}, na_values='DNE')
+        temp_df['ID'] = int( file.name.split(".csv")[0] )
+        frames.append(temp_df)
+    METRICS.count("files", len(files))
+    return fillBio(pd.concat(frames))
+# END OF readBatch
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def fillBio(batch:pd.DataFrame) -> pd.DataFrame:
+    """Fill missing heights and weights forward, then backward, within each
+    rikishi's own rows"""
+    bio = ["HEIGHT", "WEIGHT"]
+    batch[bio] = batch.groupby('ID', sort=False)[bio].ffill()
+    batch[bio] = batch.groupby('ID', sort=False)[bio].bfill()
+    return batch
+
+
+def readStore(path:str = None) -> pd.DataFrame:
+    """***************************************************************************
+
+    Read the result rows written by resultsScraper -store sqlite instead of
+    the files in {FOLDER}
+
+    ### Parameters ###
+    * path : store to read, sqliteStore.STORE_PATH if not provided
+
+    ### Return ###
+    * Dataframe of every result row, in id order
+    ***************************************************************************"""
+    import sqliteStore
+
+    with METRICS.stage("read"):
+        mstrdf = sqliteStore.readResults(path or sqliteStore.STORE_PATH)
+    return fillBio(mstrdf)
+# END OF readStore
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def readResults(folder:str = FOLDER, batch_size:int = BATCH_SIZE) -> pd.DataFrame:
+    """***************************************************************************
+
+    Read every file in {folder} in batches of {batch_size}, concatenating once
+    at the end instead of growing a dataframe file by file
+
+    ### Return ###
+    * Dataframe of every result row, in directory order
+    ***************************************************************************"""
+    files = list(Path(folder).iterdir())
+    batches = list()
+    progress_bar = [" " for _ in range(100)]
+    for strt in range(0, len(files), batch_size):
+        batches.append(readBatch(files[strt:strt + batch_size]))
+        progress = int(strt / len(files) * 100)
+        progress_bar[progress] = ':'
+        sys.stdout.write("\r" + "[" + "".join(progress_bar) + "]")
+        sys.stdout.flush()
+    return pd.concat(batches).reset_index(drop=True)
+# END OF readResults
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def splitDays(record_str:pd.Series) -> pd.DataFrame:
+    """***************************************************************************
+
+    Expand the 15 character record strings into a column per day. Each string
+    is laid out in a fixed width numpy unicode array and viewed as single
+    characters, so the split happens in one pass instead of a pass per day.
+    Days past the end of a short or missing record are NaN.
+
+    ### Return ###
+    * Dataframe of DAY1..DAY15 on the index of {record_str}
+    ***************************************************************************"""
+    chars = record_str.fillna('').to_numpy(dtype=f"U{DAYS}")
+    chars = chars.view("U1").reshape(-1, DAYS).astype(object)
+    chars[chars == ''] = np.nan
+    return pd.DataFrame(chars, index=record_str.index,
+                        columns=[f"DAY{i+1}" for i in range(DAYS)])
+# END OF splitDays
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def splitRanks(rank:pd.Series) -> pd.DataFrame:
+    """***************************************************************************
+
+    Split ranks such as 'Ms12eTd' into name, position, side and anything after.
+    Empty parts become ' ', positions are integers with ' ' read as 0, and
+    missing ranks stay missing.
+
+    ### Return ###
+    * Dataframe of {RANK_COLS} on the index of {rank}
+    ***************************************************************************"""
+    elems = rank.str.extract(RANK_PATT)
+    elems.columns = RANK_COLS
+    elems = elems.mask(elems == '', ' ')
+    elems.loc[rank.map(type) != str] = None
+
+    pos = elems['POS'].where(elems['POS'] != ' ', '0')
+    elems['POS'] = pd.to_numeric(pos)
+    return elems
+# END OF splitRanks
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def stripHash(col:pd.Series) -> pd.Series:
+    """Remove '#' from the strings of {col}, leaving other values untouched"""
+    return col.str.replace('#', '', regex=False).fillna(col)
+
+
+@METRICS.timed("transform")
+def buildResults(mstrdf:pd.DataFrame) -> pd.DataFrame:
+    """***************************************************************************
+
+    Derive the columns of fullResults.csv from the raw result rows
+
+    ### Return ###
+    * Dataframe sorted by ID, ready to be written
+    ***************************************************************************"""
+    mstrdf = mstrdf.join(splitDays(mstrdf['RECORD_STR']))
+
+    basho = mstrdf['BASHO'].astype(str).str.split('.')
+    mstrdf['BASHO'] = basho.str[0] + '.' + basho.str[1].str.zfill(2)
+    mstrdf["RESULT_ID"] = mstrdf["ID"].astype(str) + "." + mstrdf["BASHO"].astype(str)
+
+    mstrdf = mstrdf.join(splitRanks(mstrdf['RANK']))
+
+    mstrdf['DIVISION'] = mstrdf['RANK_NAME'].map(DIVISIONS).fillna(7).astype(int)
+    mstrdf['SHIKONA'] = stripHash(mstrdf['SHIKONA'])
+    mstrdf['NAME'] = stripHash(mstrdf['NAME'])
+
+    mstrdf["YEAR"] = mstrdf["BASHO"].astype(str).str.split('.').str[0]
+    mstrdf["BASHO_NUM"] = mstrdf["BASHO"].astype(str).str.split('.').str[1].astype(int)
+    mstrdf.drop(columns=["RANK", "RECORD_STR"], inplace=True)
+    mstrdf = mstrdf.convert_dtypes()
+    mstrdf.sort_values(by='ID', inplace=True)
+    return mstrdf
+# END OF buildResults
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def handleSysArgs():
+    """***************************************************************************
+
+    Parse and validate the system arguments with the helpers lib, storing the
+    results in {SYS_ARGS}
+    ***************************************************************************"""
+    kywrd_args, optns = helpers.parseSysArgs(sys.argv)
+    helpers.validateSysArgs(kywrd_args, optns, EXPECTED_KEYWORDS,
+                            EXPECTED_OPTIONS, COMMAND_LINE_USAGE_MSG)
+
+    if kywrd_args:
+        for key in SYS_ARGS:
+            SYS_ARGS[key] = key in kywrd_args
+# END OF handleSysArgs
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def main():
+    """***************************************************************************
+
+    Usage :: python buildFullResultsData.py [--sqlite] [--parquet] [--metrics]
+            [--profile] [--tracemalloc]
+
+    Besides {SAVE_DEST}, the day results are written encoded to
+    recordCodec.RECORDS_PATH. --sqlite reads the results from the scrapers'
+    sqliteStore instead of {FOLDER}. --parquet also writes the table as a
+    parquet dataset partitioned by YEAR and BASHO, see parquetStore. --metrics
+    writes the stage timings printed at the end to {METRICS_PATH}. --profile
+    and --tracemalloc profile each stage, see runProfiler
+    ***************************************************************************"""
+    handleSysArgs()
+    METRICS.reset("buildFullResultsData")
+    if SYS_ARGS["sqlite"]:
+        mstrdf = buildResults(readStore())
     else:
-        return int(s)
-
-def division(rank_name:str):
-    d = {
-        'Y':1
-        ,'S':1
-        ,'O':1
-        ,'K':1
-        ,'M':1
-        ,'J':2
-        ,'Ms':3
-        ,'Sd':4
-        ,'Jd':5
-        ,'Jk':6
-    }
-    return d.get(rank_name, 7)
-
-def basho_config(basho:str):
-    x = basho.split('.')
-    return f"{x[0]}.{x[1].zfill(2)}"
-
-data = Path(FOLDER)
-mstrdf = pd.DataFrame()
-progress_bar = [" " for _ in range(100)]
-total_size = len(list(data.iterdir()))
-for idx, file in enumerate(data.iterdir()):
-    progress = int(idx / total_size * 100)
-    progress_bar[progress] = ':'
-    sys.stdout.write("\r" + "[" + "".join(progress_bar) + "]")
-    sys.stdout.flush()
-    temp_df = pd.read_csv(file, dtype={'BASHO':str}, na_values='DNE')
-    id_ = int( file.name.split(".csv")[0] )
-    temp_df['ID'] = id_
-    temp_df["HEIGHT"].fillna(method="ffill", inplace=True)
-    temp_df["WEIGHT"].fillna(method="ffill", inplace=True)
-    temp_df["HEIGHT"].fillna(method="bfill", inplace=True)
-    temp_df["WEIGHT"].fillna(method="bfill", inplace=True)
-    mstrdf = pd.concat([mstrdf, temp_df])
-
-for i in range(15):
-    val = mstrdf['RECORD_STR'].str[i]
-    mstrdf[f"DAY{i+1}"] = val
-mstrdf = mstrdf.reset_index(drop=True)
-mstrdf['BASHO'] = mstrdf['BASHO'].astype(str).apply(basho_config)
-mstrdf["RESULT_ID"] = mstrdf["ID"].astype(str) + "." + mstrdf["BASHO"].astype(str)
-
-elems = mstrdf['RANK'].apply(splitRank)
-elems = pd.DataFrame(elems.to_list(), columns=['RANK_NAME','POS', 'SIDE', 'OTHER'])
-mstrdf = mstrdf.join(elems)
-
-mstrdf['DIVISION'] = mstrdf['RANK_NAME'].apply(division)
-mstrdf['SHIKONA'] = mstrdf['SHIKONA'].apply(lambda x : x.replace('#', '') if type(x) == type(str()) else x)
-mstrdf['NAME'] = mstrdf['NAME'].apply(lambda x : x.replace('#', '') if type(x) == type(str()) else x)
-
-mstrdf['POS'] = mstrdf['POS'].apply(toInt)
-mstrdf["YEAR"] = mstrdf["BASHO"].astype(str).str.split('.').str[0]
-mstrdf["BASHO_NUM"] = mstrdf["BASHO"].astype(str).str.split('.').str[1].astype(int)
-mstrdf.drop(columns=["RANK", "RECORD_STR"], inplace=True)
-mstrdf = mstrdf.convert_dtypes()
-mstrdf.sort_values(by='ID', inplace=True)
-mstrdf.to_csv("fullResults.csv", index=False)
+        mstrdf = buildResults(readResults(FOLDER))
+    with METRICS.stage("write"):
+        mstrdf.to_csv(SAVE_DEST, index=False)
+        recordCodec.writeRecords(mstrdf)
+        if SYS_ARGS["parquet"]:
+            parquetStore.writeResults(mstrdf)
+    METRICS.finish(METRICS_PATH if SYS_ARGS["metrics"] else None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import numpy    as np
+import pandas   as pd
+import sys
+
+from typing import Iterable, Union
+
+H2H_PATH = r".\fullMatchups.h2h.npz"
+MATCHUPS_PATH = r".\fullMatchups.csv"
+
+# Count column of each RESULT of fullMatchups, from the ID's side
+RESULT_COLS = {
+    'O': "WINS",
+    'X': "LOSSES",
+    'Z': "FUSEN_WINS",
+    'A': "FUSEN_LOSSES",
+    'D': "DRAWS"
+}
+COUNT_COLS = list(RESULT_COLS.values())
+PAIR_COLS = ["ID", "OPP"] + COUNT_COLS + ["FIRST", "LAST"]
+KIMARITE_COLS = ["ID", "OPP", "KIMARITE", "WINS", "LOSSES"]
+
+# Orders rivals by, see HeadToHead.rivals
+RIVAL_ORDERS = ["bouts", "wins", "losses"]
+
+
+def pairKey(id_:Union[int, np.ndarray], opp:Union[int, np.ndarray]):
+    """One int64 key per (ID, OPP) pair"""
+    return (np.asarray(id_, dtype=np.int64) << 32) | np.asarray(opp, dtype=np.int64)
+
+
+def bashoNum(basho:pd.Series) -> pd.Series:
+    """'YYYY.MM' basho as the int YYYYMM, which aggregates far faster than text.
+    Only the distinct basho are converted"""
+    codes, uniques = pd.factorize(basho.astype(str))
+    nums = np.array([int(b.replace('.', '')) for b in uniques], dtype=np.int64)
+    return pd.Series(nums[codes], index=basho.index)
+
+
+def bashoStr(num:np.ndarray) -> np.ndarray:
+    """YYYYMM ints back to 'YYYY.MM' basho"""
+    num = np.asarray(num, dtype=np.int64)
+    return np.char.add(np.char.add((num // 100).astype(str), '.'),
+                       np.char.zfill((num % 100).astype(str), 2)).astype(object)
+
+
+def concatRows(frames:list) -> pd.DataFrame:
+    """Concatenate the rows of {frames}, leaving out empty ones"""
+    parts = [df for df in frames if len(df)]
+    return pd.concat(parts, ignore_index=True) if parts else frames[0].iloc[0:0]
+
+
+def countBouts(bouts:pd.DataFrame) -> tuple:
+    """***************************************************************************
+
+    Aggregate bouts into head-to-head counts per (ID, OPP) pair, from the ID's
+    side. Every result is counted; bouts without a result count toward the
+    first and last meeting only.
+
+    ### Parameters ###
+    * bouts : rows of fullMatchups with ID, OPP, BASHO, RESULT and KIMARITE
+
+    ### Return ###
+    * (pairs dataframe of {PAIR_COLS}, FIRST and LAST as YYYYMM ints, and
+      kimarite dataframe of {KIMARITE_COLS} with the wins and losses of the ID
+      by each kimarite)
+    ***************************************************************************"""
+    b = pd.DataFrame({
+        "ID": bouts["ID"].astype(np.int64),
+        "OPP": bouts["OPP"].astype(np.int64),
+        "BASHO": bashoNum(bouts["BASHO"])
+    })
+    codes, uniques = pd.factorize(bouts["RESULT"])
+    uniques = list(uniques)
+    for res, col in RESULT_COLS.items():
+        code = uniques.index(res) if res in uniques else -2
+        b[col] = (codes == code).astype(np.int64)
+
+    agg = dict([(col, (col, "sum")) for col in COUNT_COLS])
+    pairs = b.groupby(["ID", "OPP"], sort=False).agg(
+        FIRST=("BASHO", "min"), LAST=("BASHO", "max"), **agg).reset_index()
+
+    b["KIMARITE"] = bouts["KIMARITE"].astype(object)
+    b["WINS"] = b["WINS"] + b["FUSEN_WINS"]
+    b["LOSSES"] = b["LOSSES"] + b["FUSEN_LOSSES"]
+    decided = b[b["KIMARITE"].notna() & ((b["WINS"] + b["LOSSES"]) > 0)]
+    kimarite = decided.groupby(["ID", "OPP", "KIMARITE"], sort=False)\
+        [["WINS", "LOSSES"]].sum().reset_index()
+    return pairs[PAIR_COLS], kimarite[KIMARITE_COLS]
+# END OF countBouts
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+class HeadToHead:
+    """***************************************************************************
+
+    Head-to-head index over fullMatchups: for every (ID, OPP) pair that met,
+    the ID's wins, losses, fusen wins and losses and draws against OPP, the
+    first and last basho they met in, and the ID's wins and losses by each
+    kimarite. Only pairs that met are kept. The basho are kept as YYYYMM ints
+    in pairs, and given as 'YYYY.MM' by record and rivals.
+
+    Pairs are sorted by ID and OPP, so the opponents of a rikishi are one
+    contiguous block, and a pair is looked up in a dict of its key.
+
+    Build it with fromBouts, keep it current with update, and save it to and
+    load it from {H2H_PATH}, e.g.
+    HeadToHead.load().record(1123, 1235)
+    ***************************************************************************"""
+
+    def __init__(self, pairs:pd.DataFrame, kimarite:pd.DataFrame):
+        # sorted on the int64 pair keys, already in order when loaded
+        keys = pairKey(pairs["ID"].to_numpy(), pairs["OPP"].to_numpy())
+        order = keys.argsort(kind="stable")
+        self.pairs = pairs.iloc[order].reset_index(drop=True)
+        self.keys = keys[order]
+
+        kim_keys = pairKey(kimarite["ID"].to_numpy(), kimarite["OPP"].to_numpy())
+        order = kim_keys.argsort(kind="stable")
+        self.kimarite = kimarite.iloc[order].reset_index(drop=True)
+        kim_keys = kim_keys[order]
+
+        self.ids = self.pairs["ID"].to_numpy(dtype=np.int64)
+        self.counts = self.pairs[COUNT_COLS].to_numpy(dtype=np.int64)
+        self.first = self.pairs["FIRST"].to_numpy(dtype=np.int64)
+        self.last = self.pairs["LAST"].to_numpy(dtype=np.int64)
+        self.rows = dict(zip(self.keys.tolist(), range(len(self.keys))))
+
+        # the kimarite rows of pair i are kim_start[i]:kim_start[i + 1]
+        self.kim_start = np.searchsorted(
+            kim_keys, np.append(self.keys, np.iinfo(np.int64).max))
+
+    @classmethod
+    def fromBouts(cls, bouts:pd.DataFrame):
+        """Build the index from every bout of fullMatchups"""
+        return cls(*countBouts(bouts))
+
+    def update(self, bouts:pd.DataFrame, replace_ids:Iterable = ()):
+        """***********************************************************************
+
+        Update the index with {bouts} without reading the rest of fullMatchups.
+        The pairs of {replace_ids} are dropped first, so a rikishi whose
+        matchup file was rewritten is counted again from its new rows only;
+        the counts of any other bouts are added to the pairs already known.
+
+        ### Parameters ###
+        * bouts : new rows of fullMatchups
+        * replace_ids : ids whose pairs {bouts} hold all of
+
+        ### Return ###
+        * The updated HeadToHead
+        ***********************************************************************"""
+        replace_ids = np.array([int(i) for i in replace_ids], dtype=np.int64)
+        new_pairs, new_kimarite = countBouts(bouts)
+        new_keys = pairKey(new_pairs["ID"].to_numpy(), new_pairs["OPP"].to_numpy())
+
+        # only the pairs {bouts} touch are aggregated again, the rest are kept
+        dropped = np.isin(self.ids, replace_ids)
+        touched = ~dropped & np.isin(self.keys, new_keys)
+        kept = ~(dropped | touched)
+
+        agg = dict([(col, (col, "sum")) for col in COUNT_COLS])
+        merged = concatRows([self.pairs[touched], new_pairs])\
+            .groupby(["ID", "OPP"], sort=False)\
+            .agg(FIRST=("FIRST", "min"), LAST=("LAST", "max"), **agg).reset_index()
+        pairs = concatRows([self.pairs[kept], merged[PAIR_COLS]])
+
+        kim_ids = self.kimarite["ID"].to_numpy(dtype=np.int64)
+        kim_keys = pairKey(kim_ids, self.kimarite["OPP"].to_numpy())
+        kim_dropped = np.isin(kim_ids, replace_ids)
+        kim_touched = ~kim_dropped & np.isin(kim_keys, new_keys)
+        merged = concatRows([self.kimarite[kim_touched], new_kimarite])\
+            .groupby(["ID", "OPP", "KIMARITE"], sort=False, observed=True)[["WINS", "LOSSES"]]\
+            .sum().reset_index()
+        kimarite = concatRows([self.kimarite[~(kim_dropped | kim_touched)],
+                               merged[KIMARITE_COLS]])
+        return HeadToHead(pairs, kimarite)
+
+    def record(self, id_:int, opp:int) -> Union[dict, None]:
+        """***********************************************************************
+
+        Head-to-head record of {id_} against {opp}
+
+        ### Return ###
+        * dict of {PAIR_COLS}, None if they never met
+        ***********************************************************************"""
+        row = self.rows.get(int(pairKey(id_, opp)))
+        if row is None:
+            return None
+        record = {"ID": int(id_), "OPP": int(opp)}
+        record.update(zip(COUNT_COLS, self.counts[row].tolist()))
+        record.update(FIRST=f"{self.first[row] // 100}.{self.first[row] % 100:02d}",
+                      LAST=f"{self.last[row] // 100}.{self.last[row] % 100:02d}")
+        return record
+
+    def kimariteOf(self, id_:int, opp:int) -> pd.DataFrame:
+        """The wins and losses of {id_} against {opp} by kimarite, most used
+        first; empty if they never met"""
+        row = self.rows.get(int(pairKey(id_, opp)))
+        if row is None:
+            return self.kimarite.iloc[0:0, 2:]
+        kim = self.kimarite.iloc[self.kim_start[row]:self.kim_start[row + 1], 2:]
+        order = (-(kim["WINS"] + kim["LOSSES"]).to_numpy()).argsort(kind="stable")
+        return kim.iloc[order].reset_index(drop=True)
+
+    def rivals(self, id_:int, n:int = 10, by:str = "bouts") -> pd.DataFrame:
+        """***********************************************************************
+
+        The top {n} opponents of {id_}
+
+        ### Parameters ###
+        * id_ : rikishi to find the rivals of
+        * n : number of rivals
+        * by : "bouts" for the most meetings, "wins" for the most beaten and
+               "losses" for the most lost to
+
+        ### Return ###
+        * Dataframe of {PAIR_COLS} plus BOUTS, a row per rival
+        ***********************************************************************"""
+        assert by in RIVAL_ORDERS, f"by must be one of {RIVAL_ORDERS}"
+        strt, end = np.searchsorted(self.ids, [id_, id_ + 1])
+        block = self.pairs.iloc[strt:end].copy()
+        block["BOUTS"] = block[COUNT_COLS].sum(axis=1)
+        score = {
+            "bouts": block["BOUTS"],
+            "wins": block["WINS"] + block["FUSEN_WINS"],
+            "losses": block["LOSSES"] + block["FUSEN_LOSSES"]
+        }[by].to_numpy()
+        order = (-score).argsort(kind="stable")[:n]
+        block = block.iloc[order].reset_index(drop=True)
+        for col in ["FIRST", "LAST"]:
+            block[col] = bashoStr(block[col])
+        return block
+
+    def save(self, path:str = H2H_PATH) -> None:
+        """Write the index as a compressed npz of its columns; the kimarite are
+        stored once in KIM_NAMES and referenced by code"""
+        codes, names = pd.factorize(self.kimarite["KIMARITE"])
+        arrays = {
+            "ID": self.pairs["ID"].to_numpy(dtype=np.int32),
+            "OPP": self.pairs["OPP"].to_numpy(dtype=np.int32),
+            "FIRST": self.first.astype(np.int32),
+            "LAST": self.last.astype(np.int32),
+            "KIM_ID": self.kimarite["ID"].to_numpy(dtype=np.int32),
+            "KIM_OPP": self.kimarite["OPP"].to_numpy(dtype=np.int32),
+            "KIM_NAMES": np.asarray(names, dtype=str),
+            "KIM_CODE": codes.astype(np.uint16),
+            "KIM_WINS": self.kimarite["WINS"].to_numpy(dtype=np.uint16),
+            "KIM_LOSSES": self.kimarite["LOSSES"].to_numpy(dtype=np.uint16)
+        }
+        for col in COUNT_COLS:
+            arrays[col] = self.pairs[col].to_numpy(dtype=np.uint16)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path:str = H2H_PATH):
+        """Load an index written by save"""
+        with np.load(path) as npz:
+            pairs = pd.DataFrame(dict(
+                [(col, npz[col].astype(np.int64)) for col in PAIR_COLS]))
+            kimarite = pd.DataFrame({
+                "ID": npz["KIM_ID"].astype(np.int64),
+                "OPP": npz["KIM_OPP"].astype(np.int64),
+                "KIMARITE": pd.Categorical.from_codes(npz["KIM_CODE"], npz["KIM_NAMES"]),
+                "WINS": npz["KIM_WINS"].astype(np.int64),
+                "LOSSES": npz["KIM_LOSSES"].astype(np.int64)
+            })
+        return cls(pairs[PAIR_COLS], kimarite[KIMARITE_COLS])
+# END OF HeadToHead
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def main():
+    """***************************************************************************
+
+    Usage :: python headToHead.py <id> [<opp>]
+
+    Print the record of <id> against <opp> with its kimarite, or the top
+    rivals of <id>, from {H2H_PATH}. The index is built from {MATCHUPS_PATH}
+    first if it does not exist; buildFullMatchupData.py keeps it current
+    ***************************************************************************"""
+    import os
+
+    if not os.path.isfile(H2H_PATH):
+        print(f"Building {H2H_PATH} from {MATCHUPS_PATH}")
+        HeadToHead.fromBouts(pd.read_csv(MATCHUPS_PATH, dtype={'BASHO': str})).save()
+    h2h = HeadToHead.load()
+
+    id_ = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        opp = int(sys.argv[2])
+        record = h2h.record(id_, opp)
+        if record is None:
+            print(f"{id_} and {opp} never met")
+            return
+        print(record)
+        print(h2h.kimariteOf(id_, opp).to_string(index=False))
+    else:
+        print(h2h.rivals(id_).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
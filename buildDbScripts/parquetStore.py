@@ -0,0 +1,138 @@
+import pandas   as pd
+
+from typing import List, Union
+
+RESULTS_PARQUET = r".\fullResults.parquet"
+MATCHUPS_PARQUET = r".\fullMatchups.parquet"
+
+RESULTS_PARTITIONS = ["YEAR", "BASHO"]
+MATCHUPS_PARTITIONS = ["BASHO"]
+
+# Low cardinality text columns, stored dictionary encoded and read back as
+# pandas categoricals
+RESULTS_DICT_COLS = ["RANK_NAME", "SIDE", "OTHER", "AWARD"] \
+    + [f"DAY{i+1}" for i in range(15)]
+MATCHUPS_DICT_COLS = ["RESULT", "KIMARITE"]
+
+
+def requirePyarrow():
+    """***************************************************************************
+
+    Import pyarrow, which the parquet output is optional on
+
+    ### Return ###
+    * The pyarrow module
+    ***************************************************************************"""
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Parquet output requires pyarrow to be installed")
+    return pyarrow
+# END OF requirePyarrow
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def partitioning(partition_cols:List[str]):
+    """***************************************************************************
+
+    Hive partitioning with every partition key typed as a string, so a basho
+    such as '2009.10' is not inferred as the float 2009.1 when read back
+    ***************************************************************************"""
+    pa = requirePyarrow()
+    return pa.dataset.partitioning(
+        pa.schema([(col, pa.string()) for col in partition_cols]), flavor="hive")
+
+
+def writeDataset(df:pd.DataFrame, root:str, partition_cols:List[str],
+                 dict_cols:List[str] = ()) -> None:
+    """***************************************************************************
+
+    Write {df} as a parquet dataset under {root}, one directory per value of
+    {partition_cols}. Partitions present in {df} replace the ones on disk, the
+    others are left alone.
+
+    ### Parameters ###
+    * df : table to write, dtypes already converted
+    * root : dataset directory
+    * partition_cols : columns to partition on, outermost first
+    * dict_cols : columns to store dictionary encoded as categoricals
+    ***************************************************************************"""
+    pa = requirePyarrow()
+    df = df.copy()
+    for col in partition_cols:
+        df[col] = df[col].astype(str)
+    for col in dict_cols:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pa.parquet.write_to_dataset(
+        table, root, partition_cols=partition_cols,
+        existing_data_behavior="delete_matching")
+# END OF writeDataset
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def readDataset(root:str, partition_cols:List[str], basho:Union[str, List[str]] = None,
+                columns:List[str] = None) -> pd.DataFrame:
+    """***************************************************************************
+
+    Load a dataset written by writeDataset. Filtering on basho only opens the
+    matching partition directories, and only {columns} are read from the files.
+
+    ### Parameters ###
+    * root : dataset directory
+    * partition_cols : columns the dataset is partitioned on
+    * basho : a basho such as '2023.01', or a list of them, to load
+    * columns : columns to load, every column if not provided
+
+    ### Return ###
+    * Dataframe of the selected rows and columns
+    ***************************************************************************"""
+    pa = requirePyarrow()
+    dataset = pa.dataset.dataset(root, format="parquet",
+                                 partitioning=partitioning(partition_cols))
+    filt = None
+    if basho is not None:
+        bashos = [basho] if isinstance(basho, str) else list(basho)
+        filt = pa.dataset.field("BASHO").isin(bashos)
+        if "YEAR" in partition_cols:
+            years = list(set([b.split('.')[0] for b in bashos]))
+            filt = filt & pa.dataset.field("YEAR").isin(years)
+
+    table = dataset.to_table(columns=columns, filter=filt)
+    return table.to_pandas()
+# END OF readDataset
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def writeResults(df:pd.DataFrame, root:str = RESULTS_PARQUET) -> None:
+    """Write fullResults partitioned by YEAR and BASHO"""
+    writeDataset(df, root, RESULTS_PARTITIONS, RESULTS_DICT_COLS)
+
+
+def writeMatchups(df:pd.DataFrame, root:str = MATCHUPS_PARQUET) -> None:
+    """Write fullMatchups partitioned by BASHO"""
+    writeDataset(df.convert_dtypes(), root, MATCHUPS_PARTITIONS, MATCHUPS_DICT_COLS)
+
+
+def readResults(basho:Union[str, List[str]] = None, columns:List[str] = None,
+                root:str = RESULTS_PARQUET) -> pd.DataFrame:
+    """***************************************************************************
+
+    Load fullResults from its parquet dataset, e.g. the ranks of one basho with
+    readResults('2023.01', ['ID', 'RANK_NAME', 'POS'])
+    ***************************************************************************"""
+    return readDataset(root, RESULTS_PARTITIONS, basho, columns)
+
+
+def readMatchups(basho:Union[str, List[str]] = None, columns:List[str] = None,
+                 root:str = MATCHUPS_PARQUET) -> pd.DataFrame:
+    """***************************************************************************
+
+    Load fullMatchups from its parquet dataset, e.g. the bouts of one basho with
+    readMatchups('2023.01')
+    ***************************************************************************"""
+    return readDataset(root, MATCHUPS_PARTITIONS, basho, columns)
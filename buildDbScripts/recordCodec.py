@@ -0,0 +1,276 @@
+import numpy    as np
+import pandas   as pd
+import sys
+import time
+
+RECORDS_PATH = "fullResults.records.npz"
+
+DAYS = 15
+DAY_COLS = [f"DAY{i+1}" for i in range(DAYS)]
+
+# One uint8 per day. EMPTY is a day without a bout, or past the end of a short
+# or missing record
+EMPTY = 0
+WIN = 1
+LOSS = 2
+ABSENT = 3
+FUSEN_WIN = 4
+FUSEN_LOSS = 5
+DRAW = 6
+
+# Record string characters as written by resultsScraper.MAPPING
+CODES = {' ': EMPTY, 'O': WIN, 'X': LOSS, '-': ABSENT, 'Z': FUSEN_WIN,
+         'A': FUSEN_LOSS, 'D': DRAW}
+
+# Byte to code lookup, unknown bytes and the padding of short records are EMPTY
+ENCODE_LUT = np.zeros(256, dtype=np.uint8)
+for char, code in CODES.items():
+    ENCODE_LUT[ord(char)] = code
+
+DECODE_LUT = np.full(max(CODES.values()) + 1, ord(' '), dtype=np.uint8)
+for char, code in CODES.items():
+    DECODE_LUT[code] = ord(char)
+
+WINS = [WIN, FUSEN_WIN]
+LOSSES = [LOSS, FUSEN_LOSS]
+
+
+def encodeRecords(record_str:pd.Series) -> np.ndarray:
+    """***************************************************************************
+
+    Encode 15 character record strings as a fixed width uint8 array. The
+    strings are laid out as fixed width bytes and mapped through a lookup
+    table in one pass; missing records encode as all EMPTY.
+
+    ### Parameters ###
+    * record_str : RECORD_STR column written by resultsScraper
+
+    ### Return ###
+    * uint8 array of shape (len(record_str), 15)
+    ***************************************************************************"""
+    chars = record_str.fillna('').to_numpy(dtype=f"S{DAYS}")
+    return ENCODE_LUT[chars.view(np.uint8).reshape(-1, DAYS)]
+# END OF encodeRecords
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def encodeDays(days:pd.DataFrame) -> np.ndarray:
+    """Encode the DAY1..DAY15 columns of fullResults, see encodeRecords"""
+    chars = days[DAY_COLS].astype(object).fillna(' ').to_numpy(dtype="S1")
+    return ENCODE_LUT[chars.view(np.uint8).reshape(-1, DAYS)]
+
+
+def decodeRecords(codes:np.ndarray) -> np.ndarray:
+    """***************************************************************************
+
+    Turn encoded records back into record strings. EMPTY days decode as ' ',
+    so a record shorter than 15 days comes back padded with spaces.
+
+    ### Return ###
+    * Array of 15 character strings, one per row of {codes}
+    ***************************************************************************"""
+    chars = np.ascontiguousarray(DECODE_LUT[codes])
+    return chars.view(f"S{DAYS}").ravel().astype(f"U{DAYS}")
+# END OF decodeRecords
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def hits(codes:np.ndarray, results:list) -> np.ndarray:
+    """Mask of the days of {codes} with one of {results}. A comparison per
+    result is several times faster than np.isin on uint8 codes"""
+    mask = codes == results[0]
+    for result in results[1:]:
+        mask |= codes == result
+    return mask
+
+
+def dayMajor(codes:np.ndarray) -> np.ndarray:
+    """{codes} laid out day by day (Fortran order), so aggregating a day reads
+    one contiguous block. Free for the DAYS loaded with loadRecords"""
+    return np.asfortranarray(codes)
+
+
+def countOf(codes:np.ndarray, results:list) -> np.ndarray:
+    """Number of days of each row of {codes} with one of {results}"""
+    return np.count_nonzero(hits(codes, results), axis=1)
+
+
+def wins(codes:np.ndarray, fusen:bool = True) -> np.ndarray:
+    """Wins of each record, with fusen wins unless {fusen} is False"""
+    return countOf(codes, WINS if fusen else [WIN])
+
+
+def losses(codes:np.ndarray, fusen:bool = True) -> np.ndarray:
+    """Losses of each record, with fusen losses unless {fusen} is False"""
+    return countOf(codes, LOSSES if fusen else [LOSS])
+
+
+def absences(codes:np.ndarray) -> np.ndarray:
+    """Days absent of each record"""
+    return countOf(codes, [ABSENT])
+
+
+def longestStreak(codes:np.ndarray, results:list = WINS) -> np.ndarray:
+    """***************************************************************************
+
+    Longest run of consecutive days with one of {results} in each record,
+    e.g. the longest losing streak with longestStreak(codes, LOSSES). EMPTY
+    days between the bouts of a lower division record do not break a run.
+
+    ### Return ###
+    * int array with a streak per row of {codes}
+    ***************************************************************************"""
+    codes = dayMajor(codes)
+    hit = hits(codes, results)
+    skip = codes == EMPTY
+    run = np.zeros(len(codes), dtype=np.int16)
+    best = np.zeros(len(codes), dtype=np.int16)
+    # a step per day, each vectorized over every record
+    for day in range(codes.shape[1]):
+        run = np.where(hit[:, day], run + 1, np.where(skip[:, day], run, 0))
+        np.maximum(best, run, out=best)
+    return best
+# END OF longestStreak
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def kachiKoshiDay(codes:np.ndarray) -> np.ndarray:
+    """***************************************************************************
+
+    Day on which each record secured kachi-koshi, a majority of wins over its
+    scheduled bouts: the 8th win of a 15 day record, the 4th of a 7 bout
+    lower division record. Absences count as scheduled bouts.
+
+    ### Return ###
+    * int array of days, 1..15, with 0 for records that never got there
+    ***************************************************************************"""
+    scheduled = np.count_nonzero(codes != EMPTY, axis=1)
+    needed = scheduled // 2 + 1
+    won = hits(codes, WINS).cumsum(axis=1, dtype=np.int8)
+    reached = won >= needed[:, None]
+    return np.where(reached.any(axis=1) & (scheduled > 0), reached.argmax(axis=1) + 1, 0)
+# END OF kachiKoshiDay
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def dayCounts(codes:np.ndarray) -> pd.DataFrame:
+    """***************************************************************************
+
+    Count every result on every day across the records of {codes}
+
+    ### Return ###
+    * Dataframe indexed by DAY1..DAY15 with a column per result character
+    ***************************************************************************"""
+    codes = dayMajor(codes)
+    counts = np.stack([np.count_nonzero(codes == code, axis=0)
+                       for code in CODES.values()], axis=1)
+    return pd.DataFrame(counts, index=DAY_COLS[:codes.shape[1]], columns=list(CODES))
+# END OF dayCounts
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def winRateByDay(codes:np.ndarray, fusen:bool = False) -> np.ndarray:
+    """***************************************************************************
+
+    Share of the bouts fought on each day that were won, across the records
+    of {codes}. Fusen are left out unless {fusen}, as no bout was fought.
+
+    ### Return ###
+    * float array of 15 win rates, NaN for a day without bouts
+    ***************************************************************************"""
+    codes = dayMajor(codes)
+    won = np.count_nonzero(hits(codes, WINS if fusen else [WIN]), axis=0)
+    lost = np.count_nonzero(hits(codes, LOSSES if fusen else [LOSS]), axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return won / (won + lost)
+# END OF winRateByDay
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def writeRecords(df:pd.DataFrame, path:str = RECORDS_PATH) -> None:
+    """***************************************************************************
+
+    Write the encoded records of fullResults next to it, as the ID, BASHO and
+    DIVISION of every row and its (n, 15) uint8 DAYS, in the row order of {df}.
+    DAYS is stored day-major, see dayMajor.
+
+    ### Parameters ###
+    * df : fullResults, with DAY1..DAY15 or RECORD_STR
+    * path : npz file to write
+    ***************************************************************************"""
+    if "RECORD_STR" in df.columns:
+        codes = encodeRecords(df["RECORD_STR"])
+    else:
+        codes = encodeDays(df)
+    np.savez_compressed(
+        path,
+        ID=df["ID"].to_numpy(dtype=np.int32),
+        BASHO=df["BASHO"].astype(str).to_numpy(dtype="U7"),
+        DIVISION=df["DIVISION"].to_numpy(dtype=np.uint8),
+        DAYS=dayMajor(codes))
+# END OF writeRecords
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def loadRecords(path:str = RECORDS_PATH) -> dict:
+    """***************************************************************************
+
+    Load the records written by writeRecords, e.g. the win rate by day of
+    makuuchi with
+    recs = loadRecords(); winRateByDay(recs["DAYS"][recs["DIVISION"] == 1])
+
+    ### Return ###
+    * dict of the ID, BASHO, DIVISION and DAYS arrays
+    ***************************************************************************"""
+    with np.load(path) as npz:
+        return dict([(key, npz[key]) for key in npz.files])
+# END OF loadRecords
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def recordSummary(records:dict) -> pd.DataFrame:
+    """***************************************************************************
+
+    Wins, losses, absences, longest winning streak and kachi-koshi day of
+    every record loaded with loadRecords
+
+    ### Return ###
+    * Dataframe of ID, BASHO, W, L, A, STREAK and KK_DAY, a row per record
+    ***************************************************************************"""
+    codes = records["DAYS"]
+    return pd.DataFrame({
+        "ID": records["ID"],
+        "BASHO": records["BASHO"],
+        "W": wins(codes),
+        "L": losses(codes),
+        "A": absences(codes),
+        "STREAK": longestStreak(codes),
+        "KK_DAY": kachiKoshiDay(codes)
+    })
+# END OF recordSummary
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def main():
+    """***************************************************************************
+
+    Usage :: python recordCodec.py [division]
+
+    Print the win rate on every day of the full history, of one division if
+    given, from {RECORDS_PATH} written by buildFullResultsData.py
+    ***************************************************************************"""
+    records = loadRecords()
+    codes = records["DAYS"]
+    if len(sys.argv) > 1:
+        codes = codes[records["DIVISION"] == int(sys.argv[1])]
+
+    strt = time.perf_counter()
+    rates = winRateByDay(codes)
+    elapsed = time.perf_counter() - strt
+    print(f"{len(codes)} records, {elapsed * 1000:.1f}ms")
+    for col, rate in zip(DAY_COLS, rates):
+        print(f"{col:>6} {rate:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Tuple
+from urllib.parse import urlparse
+
+ENGINES = ["serial", "async", "pipeline"]
+
+
+async def _crawl(keys: list, url_fmt: str, handle: Callable, fetcher,
+                 concurrency: int, host_limit: int, ready_selector: str,
+                 max_failures: int) -> Tuple[int, int]:
+    """***************************************************************************
+
+    Coroutine behind crawl. Fetches are run on a thread pool through the
+    (blocking) fetcher while the event loop keeps up to {concurrency} of them in
+    flight, and no more than {host_limit} per host. Finished pages are handed
+    to {handle} strictly in the order of {keys} by a single writer thread, so
+    parsing and writing never hold up the event loop. At most {concurrency} * 4
+    pages are fetched ahead of the writer, so a slow page cannot let memory
+    grow without limit. A fetch that raises counts as a page that did not
+    download.
+
+    ### Return ###
+    * Tuple of (succeeded, failed) counts
+    ***************************************************************************"""
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    writer = ThreadPoolExecutor(max_workers=1)
+    in_flight = asyncio.Semaphore(concurrency)
+    window = asyncio.Semaphore(concurrency * 4)
+    host_sems = dict()
+
+    # page source of every key, resolved once its fetch ends, None if it failed
+    pages = [loop.create_future() for _ in keys]
+    counts = {"succ": 0, "fail": 0, "consecutive": 0}
+    stop = asyncio.Event()
+
+    async def fetchOne(idx: int, key):
+        url = url_fmt.format(key)
+        host = urlparse(url).netloc
+        host_sem = host_sems.setdefault(host, asyncio.Semaphore(host_limit))
+        page_src = None
+        try:
+            async with in_flight, host_sem:
+                if not stop.is_set():
+                    page_src = await loop.run_in_executor(
+                        executor, fetcher.get, url, ready_selector)
+        except Exception as e:
+            print(f"Could not fetch {key}: {e}")
+        finally:
+            pages[idx].set_result(page_src)
+
+    async def writeInOrder():
+        """Hand every page to {handle} in the order of {keys}, until done or
+        {handle} failed {max_failures} times in a row"""
+        for idx, key in enumerate(keys):
+            page_src = await pages[idx]
+            pages[idx] = None
+
+            print(f"{idx+1}/{len(keys)}")
+            if page_src is None:
+                # the fetcher's rate controller backs off and pauses the host,
+                # so download failures do not stop the crawl
+                print(f"Timed Out {key}")
+                counts["fail"] += 1
+            else:
+                try:
+                    ok = await loop.run_in_executor(writer, handle, key, page_src)
+                except Exception as e:
+                    print(f"Could not handle {key}: {e}")
+                    ok = False
+
+                if ok:
+                    counts["succ"] += 1
+                    counts["consecutive"] = 0
+                else:
+                    counts["fail"] += 1
+                    counts["consecutive"] += 1
+                    if counts["consecutive"] >= max_failures:
+                        print(f"too much failure, quitting")
+                        stop.set()
+                        window.release()
+                        return
+            window.release()
+
+    tasks = [asyncio.ensure_future(writeInOrder())]
+    try:
+        for idx, key in enumerate(keys):
+            await window.acquire()
+            if stop.is_set():
+                break
+            tasks.append(asyncio.ensure_future(fetchOne(idx, key)))
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                raise result
+    finally:
+        executor.shutdown(wait=True)
+        writer.shutdown(wait=True)
+
+    return counts["succ"], counts["fail"]
+# END OF _crawl
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def crawl(keys: Iterable, url_fmt: str, handle: Callable, fetcher,
+          concurrency: int = 16, host_limit: int = 8, ready_selector: str = None,
+          max_failures: int = 10) -> Tuple[int, int]:
+    """***************************************************************************
+
+    Crawl every page in {keys} with bounded concurrency, passing each downloaded
+    page source to {handle} in the same order as {keys}, so existing writers can
+    be reused unchanged. Failed downloads are paced by the fetcher's
+    rateControl.RateController, which holds requests back while a host
+    recovers; {concurrency} and {host_limit} are upper bounds on top of its
+    per-host window. Stops scheduling new pages after {handle} fails on
+    {max_failures} pages in a row, which means the pages changed shape.
+
+    ### Parameters ###
+    * keys : ids to crawl, formatted into {url_fmt}
+    * url_fmt : url with a single {} placeholder for the key
+    * handle : function(key, page_src) -> bool, called in key order from a
+               single writer thread
+    * fetcher : fetch backend with a thread safe get(url, ready_selector)
+    * concurrency : maximum number of requests in flight
+    * host_limit : maximum number of requests in flight to a single host
+
+    ### Return ###
+    * Tuple of (succeeded, failed) counts
+    ***************************************************************************"""
+    return asyncio.run(_crawl(
+        list(keys), url_fmt, handle, fetcher, concurrency,
+        min(host_limit, concurrency), ready_selector, max_failures))
+# END OF crawl
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
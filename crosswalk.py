@@ -0,0 +1,214 @@
+import os
+import pandas as pd
+import sqlite3
+import threading
+import time
+
+from helpers import readSysArgs, validateArgs
+from typing import Iterable
+
+CROSSWALK_PATH = r".\cache\crosswalk.db"
+
+# Columns of a crosswalk row as read back with readCrosswalk
+CROSSWALK_COLS = ["jsa_id", "id", "shikona", "heya", "first_seen", "updated_at"]
+
+
+class Crosswalk:
+    """***************************************************************************
+
+    Persistent map of JSA ids to SumoDB ids, with the shikona and heya last
+    seen for the rikishi and when the pair was first recorded. A rikishi's ids
+    never change, so once banzukeUpdater has matched a JSA id to its SumoDB id
+    by rank, later runs and the other JSA based updaters take it from here.
+
+    Both ids are kept as text, the way they appear in urls.
+
+    Safe to share between threads.
+    ***************************************************************************"""
+
+    def __init__(self, path: str = CROSSWALK_PATH):
+        dir_ = os.path.dirname(path)
+        if dir_:
+            os.makedirs(dir_, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS crosswalk ("
+            " jsa_id TEXT PRIMARY KEY,"
+            " id TEXT NOT NULL,"
+            " shikona TEXT,"
+            " heya TEXT,"
+            " first_seen REAL NOT NULL,"
+            " updated_at REAL NOT NULL)")
+        self.conn.commit()
+
+    def lookup(self, jsa_ids: Iterable) -> dict:
+        """***********************************************************************
+
+        Look up the SumoDB ids of {jsa_ids}
+
+        ### Return ###
+        * Map of jsa id to SumoDB id, for the jsa ids that are mapped
+        ***********************************************************************"""
+        keys = list(set([_toId(j) for j in jsa_ids if _toId(j) is not None]))
+        found = dict()
+        with self.lock:
+            # chunked to stay under sqlite's limit on bound parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                found.update(self.conn.execute(
+                    "SELECT jsa_id, id FROM crosswalk WHERE jsa_id IN"
+                    f" ({','.join('?' * len(chunk))})", chunk).fetchall())
+        return found
+
+    def unmapped(self, jsa_ids: Iterable) -> set:
+        """The jsa ids of {jsa_ids} without a SumoDB id yet"""
+        keys = set([_toId(j) for j in jsa_ids if _toId(j) is not None])
+        return keys.difference(self.lookup(keys))
+
+    def record(self, df: pd.DataFrame) -> int:
+        """***********************************************************************
+
+        Write the matched pairs of {df} back, keeping the first seen time of
+        pairs already known and refreshing their shikona and heya
+
+        ### Parameters ###
+        * df : Dataframe with jsa_id and id columns, and optionally shikona
+               and heya. Rows without an id are skipped
+
+        ### Return ###
+        * Number of pairs written
+        ***********************************************************************"""
+        now = time.time()
+        rows = list()
+        for row in df.to_dict("records"):
+            jsa_id, id_ = _toId(row.get("jsa_id")), _toId(row.get("id"))
+            if jsa_id is None or id_ is None:
+                continue
+            rows.append((jsa_id, id_, _toText(row.get("shikona")),
+                         _toText(row.get("heya")), now, now))
+
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO crosswalk VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (jsa_id) DO UPDATE SET id = excluded.id,"
+                " shikona = coalesce(excluded.shikona, shikona),"
+                " heya = coalesce(excluded.heya, heya),"
+                " updated_at = excluded.updated_at", rows)
+            self.conn.commit()
+        return len(rows)
+
+    def attach(self, df: pd.DataFrame, jsa_col: str = "jsa_id",
+               id_col: str = "id") -> pd.DataFrame:
+        """***********************************************************************
+
+        Fill {id_col} of {df} with the SumoDB id of its {jsa_col}, keeping ids
+        already in {id_col}
+
+        ### Return ###
+        * {df}, with {id_col} None where the jsa id is not mapped
+        ***********************************************************************"""
+        found = self.lookup(df[jsa_col])
+        ids = df[jsa_col].map(lambda j: found.get(_toId(j)))
+        if id_col in df.columns:
+            ids = df[id_col].where(df[id_col].notna(), ids)
+        df[id_col] = ids.astype(object).where(ids.notna(), None)
+        return df
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+# END OF Crosswalk
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def _toId(value):
+    """Normalize an id read from a url, a csv or a numpy column to text"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def _toText(value):
+    return value if isinstance(value, str) and value else None
+
+
+def addSumoDbIds(df: pd.DataFrame, columns: dict, path: str = CROSSWALK_PATH) -> pd.DataFrame:
+    """***************************************************************************
+
+    Add the SumoDB ids of the JSA id columns of {df}, for updaters that only
+    know JSA ids. Unmapped ids are left empty and counted; running
+    banzukeUpdater maps the rikishi of the current banzuke.
+
+    ### Parameters ###
+    * df : Dataframe with JSA id columns
+    * columns : map of each JSA id column to the SumoDB id column to add, e.g.
+                {"jsa_id": "id", "jsa_opp_id": "opp_id"}
+    * path : crosswalk to read
+
+    ### Return ###
+    * {df} with the SumoDB id columns added
+    ***************************************************************************"""
+    with Crosswalk(path) as cw:
+        for jsa_col, id_col in columns.items():
+            cw.attach(df, jsa_col, id_col)
+            missing = df.loc[df[id_col].isna() & df[jsa_col].notna(), jsa_col]
+            if len(missing):
+                print(f"{missing.nunique()} jsa ids in {jsa_col} have no SumoDB id"
+                      " in the crosswalk")
+    return df
+# END OF addSumoDbIds
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def readCrosswalk(path: str = CROSSWALK_PATH) -> pd.DataFrame:
+    """Read the whole crosswalk as a dataframe of {CROSSWALK_COLS}"""
+    with Crosswalk(path) as cw:
+        return pd.read_sql_query(
+            f"SELECT {', '.join(CROSSWALK_COLS)} FROM crosswalk ORDER BY jsa_id",
+            cw.conn, dtype={"jsa_id": str, "id": str})
+# END OF readCrosswalk
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+SYS_DEFAULTS = {
+    "csv": "",
+    "path": CROSSWALK_PATH
+}
+
+
+def argValidation(sys_args: dict, usage: str):
+    assert not sys_args["csv"] or os.path.isfile(sys_args["csv"])\
+        , f"{sys_args['csv']} does not exist"
+
+
+def main():
+    """***************************************************************************
+
+    Seed the crosswalk from a csv with jsa_id and id columns, such as a
+    newBasho.csv written by banzukeUpdater, or export it without one
+
+    Usage :: python crosswalk.py <csv> <path>
+    ***************************************************************************"""
+    args = readSysArgs(SYS_DEFAULTS.keys())
+    validateArgs(args, SYS_DEFAULTS, argValidation)
+    if args["csv"]:
+        df = pd.read_csv(args["csv"], dtype={"jsa_id": str, "id": str})
+        with Crosswalk(args["path"]) as cw:
+            print(f"Recorded {cw.record(df)} pairs into {args['path']}")
+    else:
+        readCrosswalk(args["path"]).to_csv("crosswalk.csv", index=False)
+        print("Wrote crosswalk.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import pandas as pd
+import sys
+import time
+
+from helpers import *
+
+RIKISHI_URL = 'http://sumodb.sumogames.de/Rikishi.aspx?r={}'
+
+SYS_DEFAULTS = {
+    "pages": 25,
+    "id_file": "id.csv"
+}
+
+
+def timeBackend(backend: str, urls: list, ready_selector: str = None) -> dict:
+    """***************************************************************************
+
+    Download every url in {urls} with the given fetch backend and time it.
+    Backend startup (e.g. launching firefox) is timed separately from the pages.
+
+    ### Parameters ###
+    * backend : key of helpers.FETCH_BACKENDS
+    * urls : list of urls to download
+    * ready_selector : css selector to wait for, passed on to the backend
+
+    ### Return ###
+    * dict of the backend, startup seconds, page seconds, pages and pages/sec
+    ***************************************************************************"""
+    strt = time.perf_counter()
+    with getFetcher(backend) as fetcher:
+        startup = time.perf_counter() - strt
+        loaded = 0
+        strt = time.perf_counter()
+        for url in urls:
+            if fetcher.get(url, ready_selector) is not None:
+                loaded += 1
+        elapsed = time.perf_counter() - strt
+
+    return {
+        "backend": backend,
+        "startup_s": round(startup, 3),
+        "pages_s": round(elapsed, 3),
+        "pages": loaded,
+        "pages_per_sec": round(loaded / elapsed, 2) if elapsed > 0 else None
+    }
+# END OF timeBackend
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def argValidation(sys_args: dict, usage: str):
+    sys_args["pages"] = int(sys_args["pages"])
+    assert sys_args["pages"] > 0, "Number of pages must be positive"
+
+
+def main():
+    """***************************************************************************
+
+    Compare pages/sec of every fetch backend on the first {pages} rikishi pages
+    listed in {id_file}
+
+    Usage :: python fetchBenchmark.py <pages=25> <id_file=id.csv>
+    ***************************************************************************"""
+    args = readSysArgs(SYS_DEFAULTS.keys())
+    validateArgs(args, SYS_DEFAULTS, argValidation)
+
+    ids = pd.read_csv(args["id_file"])['id'].unique()[:args["pages"]]
+    urls = [RIKISHI_URL.format(id_) for id_ in ids]
+
+    results = [timeBackend(backend, urls, ".rikishi")
+               for backend in FETCH_BACKENDS]
+    print(pd.DataFrame(data=results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
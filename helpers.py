@@ -1,6 +1,12 @@
 from typing import Dict, Iterable, List, Tuple, Union
+from bs4 import BeautifulSoup, SoupStrainer
 from selenium import webdriver
 from selenium.common.exceptions import InvalidArgumentException
+from rateControl import THROTTLE_STATUSES, RateController, parseRetryAfter
+from runMetrics import METRICS
+from runProfiler import PROFILE_KEYWORDS, profileFromArgs
+from urllib.parse import urlparse
+import configparser
 import sys
 import os
 
@@ -8,6 +14,59 @@ DIV_MAP = {
     "makuuchi": 1, "juryo": 2, "makushita": 3, "sandanme": 4, "jonidan": 5, "jonokuchi": 6
 }
 
+SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.ini")
+
+SETTINGS = configparser.ConfigParser()
+SETTINGS.read(SETTINGS_PATH)
+
+PARSER_BACKENDS = ["html.parser", "lxml"]
+
+HTML_PARSER = SETTINGS.get("parsing", "parser", fallback="html.parser")
+
+
+def setParser(parser: str) -> None:
+    """***************************************************************************
+
+    Select the BeautifulSoup tree builder used by makeSoup for every scrape
+    function. 'lxml' is several times faster than the default 'html.parser' but
+    is an optional dependency.
+
+    ### Parameters ###
+    * parser : one of {PARSER_BACKENDS}
+    ***************************************************************************"""
+    global HTML_PARSER
+    if parser not in PARSER_BACKENDS:
+        raise ValueError(
+            f"{parser} is not a parser backend, expected one of {PARSER_BACKENDS}")
+    if parser == "lxml":
+        try:
+            import lxml
+        except ImportError:
+            raise ValueError("The lxml parser backend requires lxml to be installed")
+    HTML_PARSER = parser
+# END OF setParser
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def makeSoup(page_src: str, only_class: str = None) -> BeautifulSoup:
+    """***************************************************************************
+
+    Parse {page_src} with the selected parser backend ({HTML_PARSER}).
+
+    ### Parameters ###
+    * page_src : html to parse
+    * only_class : if provided, only elements with this class (and everything
+                inside them) are built into the tree, which skips the rest of
+                the page entirely
+
+    ### Return ###
+    * BeautifulSoup of the page
+    ***************************************************************************"""
+    parse_only = SoupStrainer(class_=only_class) if only_class else None
+    return BeautifulSoup(page_src, HTML_PARSER, parse_only=parse_only)
+# END OF makeSoup
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
 
 def getHeadlessDriver(url: str = None) -> webdriver.Firefox:
     """***************************************************************************
@@ -23,8 +82,9 @@ def getHeadlessDriver(url: str = None) -> webdriver.Firefox:
     options = webdriver.FirefoxOptions()
     options.add_argument("-headless")
     try:
-        driver = webdriver.Firefox(
-            options=options, service_log_path=os.path.devnull)
+        with METRICS.stage("driver_start"):
+            driver = webdriver.Firefox(
+                options=options, service_log_path=os.path.devnull)
         if url == None:
             print(f"Opening Browser")
         else:
@@ -41,6 +101,279 @@ def getHeadlessDriver(url: str = None) -> webdriver.Firefox:
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~END OF getPageSource~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+class HttpFetcher:
+    """***************************************************************************
+
+    Plain HTTP fetch backend for server rendered pages (SumoDB). Holds a single
+    requests session so connections are kept alive and reused across pages, and
+    asks for gzip encoded bodies. Requests go through a rateControl
+    RateController, which sets how many are in flight per host, backs off
+    after failures and pauses a host that keeps failing; {timeout} is the
+    longest a request may take.
+
+    Usable as a context manager in the same way as the selenium driver.
+    ***************************************************************************"""
+
+    def __init__(self, timeout: int = 20, pool_size: int = 10, retries: int = 2,
+                 rate: RateController = None):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.timeout = timeout
+        self.rate = rate or RateController(max_concurrency=pool_size)
+        self.session = requests.Session()
+        self.session.headers.update(FETCH_HEADERS)
+        from urllib3.util.retry import Retry
+
+        # connection errors are retried at once; throttling responses are
+        # handed back so the rate controller sees them and backs off
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, respect_retry_after_header=False))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, url: str, ready_selector: str = None) -> Union[str, None]:
+        """***********************************************************************
+
+        Download the page source of {url}. The {ready_selector} is accepted for
+        parity with the selenium backend; server rendered pages are complete as
+        soon as the response is read, so it is not waited on.
+
+        ### Return ###
+        * Page source, or None if the request failed
+        ***********************************************************************"""
+        import requests
+
+        with self.rate.slot(url) as outcome:
+            try:
+                with METRICS.stage("fetch"):
+                    resp = self.session.get(
+                        url, timeout=self.rate.timeout(urlparse(url).netloc, self.timeout))
+            except requests.RequestException as e:
+                print(f"Request for {url} failed: {e}")
+                outcome.failed()
+                return None
+
+            if resp.status_code >= 400:
+                print(f"Request for {url} failed: {resp.status_code}")
+                # a missing page is not the host's fault
+                if resp.status_code >= 500 or resp.status_code in THROTTLE_STATUSES:
+                    outcome.failed(resp.status_code,
+                                   parseRetryAfter(resp.headers.get("Retry-After")))
+                return None
+
+        if resp.encoding is None or resp.encoding.lower() == "iso-8859-1":
+            resp.encoding = resp.apparent_encoding
+        return resp.text
+
+    def close(self) -> None:
+        self.rate.report()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+# END OF HttpFetcher
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+class DriverFetcher:
+    """***************************************************************************
+
+    Selenium fetch backend. Wraps a headless firefox from getHeadlessDriver and
+    waits for the url and, optionally, a css selector before handing back the
+    page source. Only needed for pages that are rendered with javascript.
+    Page loads are paced by a rateControl RateController like HttpFetcher.
+    ***************************************************************************"""
+
+    def __init__(self, timeout: int = 20, rate: RateController = None):
+        self.driver = getHeadlessDriver()
+        self.timeout = timeout
+        self.rate = rate or RateController(max_concurrency=1, start=1)
+
+    def get(self, url: str, ready_selector: str = None) -> Union[str, None]:
+        """***********************************************************************
+
+        Navigate to {url} and wait until it is loaded and {ready_selector}, if
+        provided, is present.
+
+        ### Return ###
+        * Page source, or None if the page timed out
+        ***********************************************************************"""
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.support.wait import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as ec
+
+        conditions = [ec.url_to_be(url)]
+        if ready_selector:
+            conditions.append(ec.presence_of_element_located(
+                ("css selector", ready_selector)))
+
+        with self.rate.slot(url) as outcome:
+            with METRICS.stage("navigate"):
+                self.driver.get(url)
+            timeout = self.rate.timeout(urlparse(url).netloc, self.timeout)
+            try:
+                with METRICS.stage("wait"):
+                    WebDriverWait(self.driver, timeout=timeout).until(
+                        ec.all_of(*conditions))
+            except TimeoutException:
+                print(f"Timed out loading {url}, got {self.driver.current_url}")
+                outcome.failed()
+                return None
+            return self.driver.page_source
+
+    def close(self) -> None:
+        self.rate.report()
+        self.driver.quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+# END OF DriverFetcher
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+FETCH_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+FETCH_BACKENDS = {
+    "http": HttpFetcher,
+    "selenium": DriverFetcher
+}
+
+
+def getFetcher(backend: str = "http", **kwargs) -> Union[HttpFetcher, DriverFetcher]:
+    """***************************************************************************
+
+    Create a fetch backend by name. 'http' is a pooled keep-alive HTTP client for
+    server rendered pages, 'selenium' a headless firefox for javascript pages.
+
+    ### Parameters ###
+    * backend : key of {FETCH_BACKENDS}
+    * kwargs : passed on to the backend constructor
+
+    ### Return ###
+    * Fetcher with a get(url, ready_selector) method
+    ***************************************************************************"""
+    try:
+        return FETCH_BACKENDS[backend](**kwargs)
+    except KeyError:
+        raise ValueError(
+            f"{backend} is not a fetch backend, expected one of {list(FETCH_BACKENDS)}")
+# END OF getFetcher
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+class DriverPool:
+    """***************************************************************************
+
+    Pool of headless firefox drivers for javascript rendered (JSA) pages. Each
+    worker thread owns one driver and pulls tasks off a shared queue, so pages
+    are loaded by {workers} browsers at once. A worker quits and relaunches its
+    browser after {recycle_after} pages, or after a task raises, to keep long
+    running firefox processes from growing in memory.
+
+    Usable as a context manager; the browsers are closed on exit.
+    ***************************************************************************"""
+
+    def __init__(self, workers: int = 4, recycle_after: int = 50):
+        import queue
+        import threading
+
+        self.recycle_after = recycle_after
+        self.tasks = queue.Queue()
+        self.threads = [threading.Thread(target=self._work, daemon=True)
+                        for _ in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def _work(self) -> None:
+        driver = None
+        pages = 0
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            fut, func, item = task
+            if not fut.set_running_or_notify_cancel():
+                continue
+
+            if driver is not None and pages >= self.recycle_after:
+                print(f"Recycling driver")
+                driver.quit()
+                driver = None
+            if driver is None:
+                driver = getHeadlessDriver()
+                pages = 0
+
+            try:
+                if driver is None:
+                    raise RuntimeError("Could not start a headless driver")
+                fut.set_result(func(driver, item))
+                pages += 1
+            except Exception as e:
+                fut.set_exception(e)
+                pages = self.recycle_after
+
+        if driver is not None:
+            driver.quit()
+
+    def submit(self, func, item):
+        """***********************************************************************
+
+        Queue func(driver, item) to run on the next free driver
+
+        ### Return ###
+        * concurrent.futures.Future of the result
+        ***********************************************************************"""
+        from concurrent.futures import Future
+
+        fut = Future()
+        self.tasks.put((fut, func, item))
+        return fut
+
+    def map(self, func, items: Iterable) -> list:
+        """***********************************************************************
+
+        Run func(driver, item) for every item across the pool
+
+        ### Return ###
+        * List of results in the order of {items}. Tasks that raised are None
+        ***********************************************************************"""
+        futures = [(item, self.submit(func, item)) for item in items]
+        results = list()
+        for item, fut in futures:
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                print(f"Task for {item} failed: {e}")
+                results.append(None)
+        return results
+
+    def close(self) -> None:
+        for _ in self.threads:
+            self.tasks.put(None)
+        for t in self.threads:
+            t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+# END OF DriverPool
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
 def validateArgs(sys_args: dict, defaults: dict, assertions) -> None:
     """***************************************************************************
 
@@ -94,6 +427,9 @@ def readSysArgs(arg_names: list) -> dict:
     Allows the possibility of using kwargs in the system arguments in the format
     <arg>=<option>
 
+    --profile and --tracemalloc may be given anywhere and start profiling the
+    run, see runProfiler
+
     ### Parameters ###
     *
 
@@ -101,15 +437,18 @@ def readSysArgs(arg_names: list) -> dict:
     * mapping of system arguments to the names
     ***************************************************************************"""
     import sys
+    profileFromArgs(sys.argv)
+    argv = [sys.argv[0]] + [a for a in sys.argv[1:]
+                            if a.strip().lower() not in [f"--{k}" for k in PROFILE_KEYWORDS]]
     norm_args = list()
     kwargs = list()
-    for i in range(1, len(sys.argv)):
-        if sys.argv[i].find("=") > -1:
-            norm_args = sys.argv[1:i]
-            kwargs = sys.argv[i:]
+    for i in range(1, len(argv)):
+        if argv[i].find("=") > -1:
+            norm_args = argv[1:i]
+            kwargs = argv[i:]
             break
-        if i < len(sys.argv):
-            norm_args = sys.argv[1:]
+        if i < len(argv):
+            norm_args = argv[1:]
 
     mapped_args = dict(zip(arg_names, norm_args))
     for kwarg in kwargs:
@@ -131,6 +470,9 @@ def validateSysArgs(kywrds: Union[List[str], None], optns: Union[None, Dict[str,
     do not match, and prints out the expected usage of the file and expected
     arguments
 
+    The keywords --profile and --tracemalloc are accepted by every entry point
+    and start profiling the run, see runProfiler
+
     ### Parameters ###
     * kywrds:   Union[List[str], None] - List of keyword arguments
     * optns:    Union[None, Dict[str, str]] - Map of options and their correlated string
@@ -141,7 +483,7 @@ def validateSysArgs(kywrds: Union[List[str], None], optns: Union[None, Dict[str,
     """
     if kywrds:
         for k in kywrds:
-            if k not in expected_kywrds:
+            if k not in expected_kywrds and k not in PROFILE_KEYWORDS:
                 raise ValueError(
                     "{} is not an appropriate keyword argument. {}"
                         .format(k, usage_msg)
@@ -161,7 +503,7 @@ def validateSysArgs(kywrds: Union[List[str], None], optns: Union[None, Dict[str,
                         .format(o, usage_msg)
                 )
 
-            if optns[o] not in expected_optns[o] and expected_optns[o] != any:
+            if expected_optns[o] != any and optns[o] not in expected_optns[o]:
                 raise ValueError(
                     "{} is not an appropriate option foroption {}. {}"
                         .format(optns[o], o, usage_msg)
@@ -173,6 +515,9 @@ def validateSysArgs(kywrds: Union[List[str], None], optns: Union[None, Dict[str,
                     .format(usage_msg)
             )
 
+    if kywrds and set(kywrds).intersection(PROFILE_KEYWORDS):
+        profileFromArgs(sys.argv)
+
 # END OF validateSysArgs
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -0,0 +1,291 @@
+import os
+import sqlite3
+import threading
+import time
+
+from typing import Callable, Iterable, List
+
+JOURNAL_PATH = r".\cache\jobs.db"
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+MAX_ATTEMPTS = 3
+
+
+class JobJournal:
+    """***************************************************************************
+
+    Durable record of the work items (ids) of one job, e.g. "results" for
+    resultsScraper, so a run can resume exactly where the last one stopped
+    and retry only what failed. Every key is in one of the states
+
+    * pending : still to do
+    * in_flight : claimed by the current pass
+    * done : output written
+    * failed : the last attempt failed, retried while attempts < max_attempts
+
+    with its attempt count, the time it was added and last updated, and the
+    last error. Keys left in flight by a run that crashed count as failed
+    attempts when the journal is opened again.
+
+    A key is only marked done after its output is written, and callers skip
+    keys that are done, so each key's output is written once.
+
+    Safe to share between the threads of the async and pipeline engines.
+    ***************************************************************************"""
+
+    def __init__(self, job: str, path: str = JOURNAL_PATH,
+                 max_attempts: int = MAX_ATTEMPTS):
+        dir_ = os.path.dirname(path)
+        if dir_:
+            os.makedirs(dir_, exist_ok=True)
+
+        self.job = job
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job TEXT NOT NULL,"
+            " key NOT NULL,"
+            " state TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " added_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " error TEXT,"
+            " PRIMARY KEY (job, key))")
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, error = 'interrupted', updated_at = ?"
+                " WHERE job = ? AND state = ?",
+                (FAILED, time.time(), job, IN_FLIGHT))
+
+    def _keys(self, where: str, params: tuple = ()) -> list:
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                f"SELECT key FROM jobs WHERE job = ? AND {where} ORDER BY added_at, key",
+                (self.job, *params))]
+
+    def add(self, keys: Iterable) -> None:
+        """***********************************************************************
+
+        Queue {keys} as pending. Keys the journal already has are queued again
+        with a fresh attempt count, so pass only keys whose output is missing.
+        ***********************************************************************"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO jobs (job, key, state, attempts, added_at, updated_at)"
+                " VALUES (?, ?, ?, 0, ?, ?)"
+                " ON CONFLICT (job, key) DO UPDATE SET"
+                " state = excluded.state, attempts = 0, updated_at = excluded.updated_at",
+                [(self.job, _toKey(key), PENDING, now, now) for key in keys])
+
+    def extend(self, keys: Iterable) -> None:
+        """Queue the keys of {keys} the journal does not know yet, leaving the
+        known ones as they are"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO jobs (job, key, state, attempts, added_at, updated_at)"
+                " VALUES (?, ?, ?, 0, ?, ?)",
+                [(self.job, _toKey(key), PENDING, now, now) for key in keys])
+
+    def retryFailed(self) -> None:
+        """Queue the failed keys of the job again with a fresh attempt count,
+        for a run that carries on after one that gave up on them"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, attempts = 0, updated_at = ?"
+                " WHERE job = ? AND state = ?",
+                (PENDING, time.time(), self.job, FAILED))
+
+    def resume(self, keys: Iterable) -> bool:
+        """***********************************************************************
+
+        Start the job over with {keys}, unless the last run left keys that are
+        unfinished, in which case those are kept and {keys} is ignored
+
+        ### Return ###
+        * True if an unfinished run is being resumed
+        ***********************************************************************"""
+        if self.unfinished():
+            print(f"Resuming {self.job}: {self.counts()}")
+            return True
+        self.clear()
+        self.add(keys)
+        return False
+
+    def sync(self, keys: Iterable) -> None:
+        """***********************************************************************
+
+        For jobs whose output shows what is done, such as a file per id: queue
+        {keys}, the ids whose output is missing, and mark every other key of
+        the job done
+        ***********************************************************************"""
+        keys = set([_toKey(key) for key in keys])
+        for key in self._keys("state != ?", (DONE,)):
+            if key not in keys:
+                self.done(key)
+        self.add(keys)
+
+    def unfinished(self) -> list:
+        """Keys that are pending, or failed with attempts left"""
+        return self._keys("(state = ? OR (state = ? AND attempts < ?))",
+                          (PENDING, FAILED, self.max_attempts))
+
+    def doneKeys(self) -> set:
+        return set(self._keys("state = ?", (DONE,)))
+
+    def claim(self) -> list:
+        """***********************************************************************
+
+        Start a pass: every unfinished key is marked in flight and its attempt
+        count raised
+
+        ### Return ###
+        * Keys to work on in this pass, empty when the job is finished
+        ***********************************************************************"""
+        keys = self.unfinished()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ?"
+                " WHERE job = ? AND key = ?",
+                [(IN_FLIGHT, time.time(), self.job, key) for key in keys])
+        return keys
+
+    def done(self, key) -> None:
+        """Mark {key} done; call only once its output is written"""
+        self._set(key, DONE, None)
+
+    def fail(self, key, error: str = None) -> None:
+        self._set(key, FAILED, error)
+
+    def _set(self, key, state: str, error: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated_at = ?"
+                " WHERE job = ? AND key = ?",
+                (state, error, time.time(), self.job, _toKey(key)))
+
+    def endPass(self) -> None:
+        """End a pass: keys still in flight did not produce output and failed"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, error = coalesce(error, 'no output'),"
+                " updated_at = ? WHERE job = ? AND state = ?",
+                (FAILED, time.time(), self.job, IN_FLIGHT))
+
+    def release(self) -> None:
+        """Put keys still in flight back as pending, for a pass that stopped
+        before getting to them"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts - 1, updated_at = ?"
+                " WHERE job = ? AND state = ?",
+                (PENDING, time.time(), self.job, IN_FLIGHT))
+
+    def reconcile(self, written: Iterable) -> None:
+        """***********************************************************************
+
+        Mark keys whose output is already present done, for outputs that were
+        written just before a crash could record it. Call before claiming.
+        ***********************************************************************"""
+        written = set([_toKey(key) for key in written])
+        todo = [key for key in self._keys("state != ?", (DONE,)) if key in written]
+        for key in todo:
+            self.done(key)
+
+    def track(self, handle: Callable) -> Callable:
+        """***********************************************************************
+
+        Wrap a handle(key, ...) -> bool, such as the write function given to
+        crawlEngine.crawl or pipeline.runPipeline, so keys it succeeds on are
+        marked done
+        ***********************************************************************"""
+        def tracked(key, *args):
+            ok = handle(key, *args)
+            if ok:
+                self.done(key)
+            return ok
+        return tracked
+
+    def counts(self) -> dict:
+        with self.lock:
+            counts = dict(self.conn.execute(
+                "SELECT state, count(*) FROM jobs WHERE job = ? GROUP BY state",
+                (self.job,)).fetchall())
+        return {state: counts.get(state, 0) for state in [PENDING, IN_FLIGHT, DONE, FAILED]}
+
+    def failed(self) -> List:
+        """Keys that used up every attempt"""
+        return self._keys("state = ? AND attempts >= ?", (FAILED, self.max_attempts))
+
+    def report(self) -> None:
+        """Print the state counts of the job and the keys that gave up"""
+        counts = self.counts()
+        print(f"Job {self.job}: {counts[DONE]} done, {counts[FAILED]} failed,"
+              f" {counts[PENDING]} pending")
+        failed = self.failed()
+        if failed:
+            print(f"Gave up after {self.max_attempts} attempts on: {failed}")
+
+    def clear(self) -> None:
+        """Forget every key of the job"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM jobs WHERE job = ?", (self.job,))
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+# END OF JobJournal
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def _toKey(key):
+    """Store numpy integers, which sqlite cannot bind, as plain ints"""
+    return int(key) if hasattr(key, "item") else key
+
+
+def runJob(journal: JobJournal, run_pass: Callable[[list], bool]) -> bool:
+    """***************************************************************************
+
+    Run passes over the unfinished keys of {journal} until every key is done
+    or has used up its attempts. Replaces prompting whether to retry.
+
+    ### Parameters ###
+    * journal : journal of the job, with its keys added
+    * run_pass : function(keys) doing the work of one pass, marking keys done
+                through the journal as their output is written. Returning
+                False stops the job, leaving the keys it did not get to pending
+
+    ### Return ###
+    * False if a pass stopped the job
+    ***************************************************************************"""
+    finished = True
+    while finished:
+        keys = journal.claim()
+        if not keys:
+            break
+        print(f"{journal.job}: {len(keys)} to do")
+        try:
+            finished = run_pass(keys) is not False
+        except BaseException:
+            journal.release()
+            raise
+        if finished:
+            journal.endPass()
+        else:
+            journal.release()
+    journal.report()
+    return finished
+# END OF runJob
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -1,10 +1,9 @@
 from helpers import *
-from bs4 import BeautifulSoup as bs
 import pandas as pd
 
 def main():
     with getHeadlessDriver("https://en.wikipedia.org/wiki/Kimarite#Yoritaoshi") as driver:
-        soup = bs(driver.page_source, 'html.parser')
+        soup = makeSoup(driver.page_source)
 
     headers = soup.select(".mw-headline")
     data = list()
@@ -1,11 +1,15 @@
 import  pandas  as  pd
+import sys
 
-from bs4 import BeautifulSoup as bs
+from crawlEngine import ENGINES, crawl
+from jobJournal import MAX_ATTEMPTS, JobJournal, runJob
+from pipeline import runPipeline
+from responseCache import CachedFetcher, ResponseCache, retiredRikishiUrls
+from runMetrics import METRICS
+from sqliteStore import STORES, SqliteStore
 from helpers import *
 from pathlib import Path
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.support import expected_conditions as ec
-from selenium.webdriver.support.wait import WebDriverWait
+from typing import Union
 
 MAPPING = {
     'img/hoshi_shiro.gif':'O',
@@ -20,13 +24,53 @@ MAPPING = {
 MASTER_URL = "http://sumodb.sumogames.de/Rikishi_opp.aspx?r={}"
 MU_HDRS = ["BASHO", "DAY", "OPP", "RESULT", "KIMARITE"]
 
-def getMatchup(pg_src:str, id:int, directory:str) -> bool:
-    p = Path(f"{directory}/{id}.csv")
-    if p.is_file():
-        print(f"{id} exists, continuing")
-        return False
+EXPECTED_KEYWORDS = [None, "cache"]
+
+SYS_ARGS = {
+    "backend": "http",
+    "engine": "serial",
+    "concurrency": 16,
+    "host_limit": 8,
+    "parsers": None,
+    "store": "csv",
+    "attempts": MAX_ATTEMPTS,
+    "metrics": None
+}
+
+EXPECTED_OPTIONS = {
+    None: None,
+    "backend": list(FETCH_BACKENDS),
+    "engine": ENGINES,
+    "concurrency": any,
+    "host_limit": any,
+    "parsers": any,
+    "store": STORES,
+    "attempts": any,
+    "metrics": any,
+    "parser": PARSER_BACKENDS
+}
+
+COMMAND_LINE_USAGE_MSG = "Usage :: python matchupScraper.py [--cache] [-backend <http | selenium>]\
+ [-engine <serial | async | pipeline>] [-concurrency <n>] [-host_limit <n>]\
+ [-parsers <n>] [-store <csv | sqlite>] [-attempts <n>] [-metrics <path>]\
+ [-parser <html.parser | lxml>]"
 
-    soup = bs( pg_src, "html.parser")
+@METRICS.timed("parse")
+def parseMatchup(pg_src:str, id:int) -> Union[pd.DataFrame, None]:
+    """***************************************************************************
+
+    Parse the bouts of a Rikishi_opp page into a dataframe sorted by basho,
+    day and opponent
+
+    ### Parameters ###
+    * pg_src : page source of the rikishi's SumoDB opponents page
+    * id : SumoDB id of the rikishi
+
+    ### Return ###
+    * Dataframe with {MU_HDRS} columns, or None if the page is improperly
+      formatted
+    ***************************************************************************"""
+    soup = makeSoup(pg_src, only_class="ro_torikumi")
 
     data = dict( zip (MU_HDRS, [ list() for _ in MU_HDRS ]) )
     seen_matchups = set()
@@ -63,28 +107,120 @@ def getMatchup(pg_src:str, id:int, directory:str) -> bool:
         df['DAY'] = df['DAY'].apply(int)
         df['OPP'] = df['OPP'].apply(int)
         df.sort_values(by=['BASHO', 'DAY','OPP'], inplace=True)
-        df.to_csv(f"{directory}/{id}.csv", index=False, mode='x')
-
-        return True
+        return df
 
     except AttributeError as e:
         print(f"Rikishi page {id} is improperly formatted or does not exist ")
         print(f"error: {e}")
+        return None
+# END OF parseMatchup
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def getMatchup(pg_src:str, id:int, directory:str, store:SqliteStore = None) -> bool:
+    p = Path(f"{directory}/{id}.csv")
+    if not store and p.is_file():
+        print(f"{id} exists, continuing")
         return False
 
-def main():
-    df = pd.read_csv("id.csv")
-    todo_ids = set(df['id'].unique())
-    finished_ids = Path(r".\matchupData")
-    for dir_ in finished_ids.iterdir():
-        x = int(dir_.name.replace(".csv",''))
-        try:
-            todo_ids.remove(x)
-        except KeyError:
-            pass
-
-    with getHeadlessDriver() as driver:
-        waiter = WebDriverWait(driver, timeout=10)
+    df = parseMatchup(pg_src, id)
+    if df is None:
+        return False
+    return writeMatchup(df, id, directory, store)
+# END OF getMatchup
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+@METRICS.timed("write", "pages")
+def writeMatchup(df:pd.DataFrame, id:int, directory:str, store:SqliteStore = None) -> bool:
+    """***************************************************************************
+
+    Write parsed matchups into {directory}, or {store} if provided, never
+    overwriting existing matchups. A rikishi without bouts gets a header-only
+    file (or an empty entry in the store) so it is not scraped again.
+
+    ### Return ###
+    * True if the matchups were written
+    ***************************************************************************"""
+    if store:
+        return store.putBouts(id, df)
+    try:
+        if df.empty:
+            with open(f"{directory}\\{id}.csv", 'x') as f: f.write(','.join(MU_HDRS))
+        else:
+            df.to_csv(f"{directory}/{id}.csv", index=False, mode='x')
+    except FileExistsError:
+        print(f"{id} exists, continuing")
+        return False
+    return True
+# END OF writeMatchup
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def handleMatchupPage(page_src:str, id_:int, directory:str,
+                      store:SqliteStore = None) -> bool:
+    """***************************************************************************
+
+    Write the matchups of a downloaded Rikishi_opp page into {directory}, or
+    {store} if provided. Pages without a bout table get a header-only file so
+    they are not scraped again.
+
+    ### Return ###
+    * True if the page was written
+    ***************************************************************************"""
+    if "ro_torikumi" not in page_src:
+        print(f"{id_} has no table page")
+        return writeMatchup(pd.DataFrame(columns=MU_HDRS), id_, directory, store)
+
+    if (not getMatchup(page_src, id_, directory, store)):
+        print(f"{id_} failed")
+        return False
+
+    print(f"done {id_}")
+    return True
+# END OF handleMatchupPage
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def scrapeMatchups(todo_ids:set, args:dict, cache:ResponseCache = None,
+                   store:SqliteStore = None, journal:JobJournal = None):
+    """***************************************************************************
+
+    Download and write the Rikishi_opp page of every id in {todo_ids} with the
+    engine and backend selected in {args}, answering from {cache} when a fresh
+    copy of the page is stored. Matchups are written into {store} if provided,
+    a file per rikishi in matchupData otherwise. Ids that are written are
+    marked done in {journal} if provided.
+
+    ### Return ###
+    * -1 if the serial engine gave up after too many failures in a row
+    ***************************************************************************"""
+    handle = lambda id_, page_src: handleMatchupPage(page_src, id_, "matchupData", store)
+    write = lambda id_, df: writeMatchup(df, id_, "matchupData", store)
+    if journal:
+        handle, write = journal.track(handle), journal.track(write)
+
+    if args["engine"] == "async":
+        make_fetcher = lambda: getFetcher("http", timeout=10, pool_size=args["concurrency"])
+        with (CachedFetcher(make_fetcher, cache) if cache else make_fetcher()) as fetcher:
+            succ_cnt, fail_cnt = crawl(
+                todo_ids, MASTER_URL, handle, fetcher,
+                args["concurrency"], args["host_limit"], "#aspnetForm")
+        print(f"Completed {succ_cnt}, {fail_cnt} failed")
+        return
+
+    if args["engine"] == "pipeline":
+        make_fetcher = lambda: getFetcher("http", timeout=10, pool_size=args["concurrency"])
+        with (CachedFetcher(make_fetcher, cache) if cache else make_fetcher()) as fetcher:
+            succ_cnt, fail_cnt = runPipeline(
+                todo_ids, MASTER_URL, parseMatchup, write, fetcher,
+                args["concurrency"], args["parsers"],
+                ready_selector="#aspnetForm")
+        print(f"Completed {succ_cnt}, {fail_cnt} failed")
+        return
+
+    make_fetcher = lambda: getFetcher(args["backend"], timeout=10)
+    with (CachedFetcher(make_fetcher, cache) if cache else make_fetcher()) as fetcher:
         fail_cnt = 0
         for idx, id_ in enumerate(todo_ids):
             if fail_cnt >= 10:
@@ -94,34 +230,74 @@ def main():
             print(f"scraping {id_}, {idx}/{len(todo_ids)}")
             url = MASTER_URL.format(id_)
 
-            driver.get(url)
-            try:
-                waiter.until(ec.url_to_be(url))
-            except TimeoutException:
-                print(driver.current_url)
-                print(f"Could not get to {url}")
-                fail_cnt += 1
-                continue
-
-            try:
-                waiter.until(ec.presence_of_all_elements_located(("css selector", "#aspnetForm")))
-            except TimeoutException:
+            page_src = fetcher.get(url, "#aspnetForm")
+            if page_src is None:
+                # paced by the fetcher's rate controller, not counted
                 print(f"{url} could not load")
-                fail_cnt += 1
                 continue
 
-            if len(driver.find_elements("css selector", ".ro_torikumi")) == 0:
-                print(f"{url} has no table page")
+            if handle(id_, page_src):
                 fail_cnt = 0
-                with open(f"matchupData\\{id_}.csv", 'x') as f: f.write(','.join(MU_HDRS))
-                continue
-
-            if (not getMatchup(driver.page_source, id_, "matchupData")):
-                print(f"{id_} failed")
-                fail_cnt += 1
             else:
-                print(f"done {id_}")
-                fail_cnt = 0
+                fail_cnt += 1
+# END OF scrapeMatchups
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def main():
+    kywrd_args, optns = parseSysArgs(sys.argv)
+    validateSysArgs(kywrd_args, optns, EXPECTED_KEYWORDS,
+                    EXPECTED_OPTIONS, COMMAND_LINE_USAGE_MSG)
+    args = dict(SYS_ARGS)
+    args.update(optns or {})
+    for key in ["concurrency", "host_limit", "attempts"]:
+        args[key] = int(args[key])
+    if args["parsers"] is not None:
+        args["parsers"] = int(args["parsers"])
+    if "parser" in args:
+        setParser(args["parser"])
+    if args["engine"] in ["async", "pipeline"] and args["backend"] != "http":
+        raise ValueError(
+            f"The {args['engine']} engine requires the http backend. {COMMAND_LINE_USAGE_MSG}")
+
+    store = None
+    if args["store"] == "sqlite":
+        store = SqliteStore()
+
+    df = pd.read_csv("id.csv")
+    todo_ids = set(df['id'].unique())
+    if store:
+        todo_ids = todo_ids.difference(store.doneIds("bouts"))
+    else:
+        finished_ids = Path(r".\matchupData")
+        for dir_ in finished_ids.iterdir():
+            x = int(dir_.name.replace(".csv",''))
+            try:
+                todo_ids.remove(x)
+            except KeyError:
+                pass
+
+    cache = None
+    if kywrd_args and "cache" in kywrd_args:
+        cache = ResponseCache(permanent=retiredRikishiUrls("id.csv"))
+
+    # Ids that fail are retried in further passes, up to {attempts} each, and
+    # a stopped run carries on with the ids it did not finish
+    journal = JobJournal("matchups", max_attempts=args["attempts"])
+    journal.sync(todo_ids)
+    runPass = lambda ids: scrapeMatchups(ids, args, cache, store, journal) != -1
+
+    METRICS.reset("matchupScraper")
+    try:
+        return 0 if runJob(journal, runPass) else -1
+    finally:
+        METRICS.finish(args["metrics"])
+        journal.close()
+        if cache:
+            cache.report()
+            cache.close()
+        if store:
+            store.close()
 
 if __name__ == "__main__":
     main()
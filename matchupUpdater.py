@@ -1,15 +1,19 @@
 
 import datetime as dt
 from typing import Tuple
+import hashlib
 import pandas as pd
 import re
+import time
 
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as ec
 from helpers import *
-from bs4 import BeautifulSoup as bs
 from bs4.element import Tag
+from crosswalk import addSumoDbIds
+from pathlib import Path
+from runMetrics import METRICS
 
 TORIKUMI_URL = "https://sumo.or.jp/EnHonbashoMain/torikumi/{}/{}/"
 SAVE_DEST =r"C:\Users\blarg\Documents\SQL Server Management Studio\SumoScripts\newMatchups.csv"
@@ -40,8 +44,19 @@ DAYS = range(1, 16)
 
 DIVISIONS = range(1, 7)
 
+# SumoDB id columns added from the crosswalk for the JSA id columns
+SUMODB_ID_COLS = {"jsa_id": "id", "jsa_opp_id": "opp_id"}
+
+# Times a torikumi page whose task raised, e.g. on a browser crash, is loaded
+# before the run stops, see pageResult
+PAGE_ATTEMPTS = 3
+
+# Identifies a bout row in watch mode, see watchDay
+BOUT_KEY = ["basho", "day", "division", "match_order", "jsa_id"]
+
 SYS_DEFAULTS = {
-    'days': None, 'days_end': None
+    'days': None, 'days_end': None, 'workers': 4, 'recycle': 50,
+    'parser': HTML_PARSER, 'metrics': '', 'watch': 'n', 'interval': 30
 }
 
 
@@ -69,6 +84,38 @@ def extractDateToBasho(s:str) -> dt.date:
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+def loadTorikumiPage(driver: webdriver.Firefox, division: int = 1, day: int = 1) -> bool:
+    """***************************************************************************
+
+    Load the torikumi page of a division and day in {driver} and wait until
+    its table is rendered
+
+    ### Return ###
+    * True if the page loaded, False if it timed out
+    ***************************************************************************"""
+    driver_waiter = WebDriverWait(driver, timeout=10)
+
+    url = TORIKUMI_URL.format(division, day)
+    with METRICS.stage("navigate"):
+        driver.get(url)
+    try:
+        with METRICS.stage("wait"):
+            driver_waiter.until(ec.all_of(
+                ec.url_matches(url)
+                ,ec.text_to_be_present_in_element(
+                    ("css selector", "#dayHead"), 'Day')
+                ,ec.presence_of_element_located(
+                    ("css selector", "#dayHead"))
+                ,ec.presence_of_element_located(
+                    ("css selector", "#torikumi_table > colgroup"))
+            ))
+    except TimeoutException as e:
+        return False
+    return True
+# END OF loadTorikumiPage
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
 def getDayMatchups(driver: webdriver.Firefox, division: int = 1, day: int = 1) -> list():
     """***************************************************************************
 
@@ -81,37 +128,51 @@ def getDayMatchups(driver: webdriver.Firefox, division: int = 1, day: int = 1) -
     * day : matchup day to parse
 
     ### Return ###
-    * None
+    * List of matchups, None if the page or table could not be loaded
     ***************************************************************************"""
-    driver_waiter = WebDriverWait(driver, timeout=10)
+    if not loadTorikumiPage(driver, division, day):
+        return None
 
-    url = TORIKUMI_URL.format(division, day)
-    driver.get(url)
-    try:
-        driver_waiter.until(ec.all_of(
-            ec.url_matches(url)
-            ,ec.text_to_be_present_in_element(
-                ("css selector", "#dayHead"), 'Day')
-            ,ec.presence_of_element_located(
-                ("css selector", "#dayHead"))
-            ,ec.presence_of_element_located(
-                ("css selector", "#torikumi_table > colgroup"))
-        ))
-    except TimeoutException as e:
+    matchups = parseDayMatchups(driver.page_source, division, day)
+    if matchups == [] \
+            and ec.invisibility_of_element(("css selector", "#torikumi_table"))(driver):
+        print(f"Cannont find Matchup Table for {division}, day {day}")
         return None
+    if matchups is not None:
+        METRICS.count("pages")
+    return matchups
+# END OF getDayMatchups
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+@METRICS.timed("parse")
+def parseDayMatchups(page_src: str, division: int = 1, day: int = 1) -> list:
+    """***************************************************************************
+
+    Parse the page source of a torikumi page for a specific day and division.
+    Turns rows into id and opp_id, putting winner on id. Gathers kimarite, and
+    counts match for day order.
+
+    ### Parameters ###
+    * page_src : page source of the loaded torikumi page
+    * division : division in enumerated form to parse
+    * day : matchup day to parse
 
-    soup = bs(driver.page_source, "html.parser")
+    ### Return ###
+    * List of matchups, both from the winner's and the loser's side. Empty if
+      the table has no rows, None if there is no table
+    ***************************************************************************"""
+    soup = makeSoup(page_src)
     try:
         mu_tbl = soup.find("table", id="torikumi_table").find_all("tr")[1:]
-        if len(mu_tbl) == 0 \
-                and ec.invisibility_of_element(("css selector", "#torikumi_table"))(driver):
-            print(f"Cannont find Matchup Table for {division}, day {day}")
-            return None
     except AttributeError as e:
         print(f"Cannont find Matchup Table for {division}, day {day}")
         print(e)
         return None
 
+    if len(mu_tbl) == 0:
+        return list()
+
     basho = extractDateToBasho(soup.select_one("#dayHead").text)
     matchups = list()
     for mu_cnt, row in enumerate(mu_tbl):
@@ -169,7 +230,7 @@ def getDayMatchups(driver: webdriver.Firefox, division: int = 1, day: int = 1) -
         matchups.append(flipMatchups(d))
 
     return matchups
-# END OF getDayMatchups
+# END OF parseDayMatchups
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
@@ -194,7 +255,8 @@ def flipMatchups(data: dict) -> dict:
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
-def matchupDriver(divisions_list:list=list(DIVISIONS), days_l:list=list(DAYS)) -> list:
+def matchupDriver(divisions_list:list=list(DIVISIONS), days_l:list=list(DAYS),
+                  workers:int=1, recycle_after:int=50) -> list:
     """***************************************************************************
 
     Driver for getting matchups. Parses each division and day provided in the
@@ -202,36 +264,225 @@ def matchupDriver(divisions_list:list=list(DIVISIONS), days_l:list=list(DAYS)) -
     the function exits, as it assumes no information further information is
     available
 
+    With more than one worker, every (division, day) page is queued at once on
+    a helpers.DriverPool, earliest day first, so the browsers never wait for a
+    day to finish before starting the next. Days are still read back in order,
+    and once a day comes back empty the pages of the later days that have not
+    started are cancelled. A page that raised is retried, see pageResult, and
+    raises if it keeps failing, so only a day whose pages loaded without
+    data ends the run
+
     ### Parameters ###
     * divisions_list : List of divisions represented as integers
     * days_l : List of days represented as integers
+    * workers : number of headless drivers to load pages with
+    * recycle_after : number of pages after which a driver is relaunched
 
     ### Return ###
-    * List of all matchups
+    * List of all matchups, ordered by day, division and match order
     ***************************************************************************"""
     total_data = list()
-    with getHeadlessDriver() as driver:
-        for day in days_l:
-            day_failure = True
-            for div in divisions_list:
-                print(f"Parsing Division {div} - Day {day}")
-                data = getDayMatchups(driver, div, day)
-                if data == None:
-                    print(f"No data for Division {div} - Day {day}")
-                    continue
-                day_failure = False
-                total_data.extend(data)
-
-            if day_failure:
-                print(f"No data found for entire Day {day}")
-                print(f"Returning Data and cleaning up")
-                break
+    if workers > 1:
+        runner = DriverPool(workers, recycle_after)
+    else:
+        runner = getHeadlessDriver()
+
+    with runner:
+        queued = dict()
+        if workers > 1:
+            for day in days_l:
+                queued[day] = [
+                    runner.submit(lambda driver, page: getDayMatchups(driver, *page), (div, day))
+                    for div in divisions_list]
+
+        try:
+            for day in days_l:
+                day_failure = True
+                print(f"Parsing Divisions {divisions_list} - Day {day}")
+                if workers > 1:
+                    day_data = [pageResult(runner, fut, div, day)
+                                for div, fut in zip(divisions_list, queued.pop(day))]
+                else:
+                    day_data = [getDayMatchups(runner, div, day) for div in divisions_list]
+
+                for div, data in zip(divisions_list, day_data):
+                    if data == None:
+                        print(f"No data for Division {div} - Day {day}")
+                        continue
+                    day_failure = False
+                    total_data.extend(data)
+
+                if day_failure:
+                    print(f"No data found for entire Day {day}")
+                    print(f"Returning Data and cleaning up")
+                    break
+        finally:
+            # pages of the days after an empty one, or of an interrupted run,
+            # that have not started yet are dropped
+            for futures in queued.values():
+                for fut in futures:
+                    fut.cancel()
 
     return total_data
 # END OF matchupDriver
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+def pageResult(pool: DriverPool, fut, division: int, day: int) -> list:
+    """***************************************************************************
+
+    Wait for the torikumi page of {division}, {day} queued on {pool}. A page
+    whose task raised is queued again, up to {PAGE_ATTEMPTS} times in all,
+    and the last error is raised, so a crash is never taken for a day
+    without data
+
+    ### Return ###
+    * List of matchups, None if the page or table could not be loaded
+    ***************************************************************************"""
+    for attempt in range(1, PAGE_ATTEMPTS + 1):
+        try:
+            return fut.result()
+        except Exception as e:
+            print(f"Division {division} - Day {day} failed, attempt {attempt}: {e}")
+            if attempt == PAGE_ATTEMPTS:
+                raise
+            fut = pool.submit(lambda driver, page: getDayMatchups(driver, *page),
+                              (division, day))
+# END OF pageResult
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def pollDivision(driver: webdriver.Firefox, division: int, day: int,
+                 last_hash: str = None) -> Tuple[str, list]:
+    """***************************************************************************
+
+    Reload the torikumi page of a division and day, and parse it only if its
+    table changed since the poll that saw {last_hash}
+
+    ### Return ###
+    * Tuple of the table's content hash and its matchups, None for the
+      matchups if the table did not change. None if the page did not load
+    ***************************************************************************"""
+    if not loadTorikumiPage(driver, division, day):
+        return None
+
+    table = driver.find_element("css selector", "#torikumi_table")
+    digest = hashlib.sha1(table.get_attribute("outerHTML").encode()).hexdigest()
+    if digest == last_hash:
+        return digest, None
+
+    METRICS.count("pages")
+    return digest, parseDayMatchups(driver.page_source, division, day) or list()
+# END OF pollDivision
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def boutKey(bout: dict) -> tuple:
+    return tuple([bout[k] for k in BOUT_KEY])
+
+
+def boutState(bout: dict) -> tuple:
+    """The result and kimarite of a bout, None while it has not been fought"""
+    return tuple([bout[k] if isinstance(bout[k], str) and bout[k] else None
+                  for k in ["result", "kimarite"]])
+
+
+def readWrittenBouts(dest: str, day: int) -> dict:
+    """***************************************************************************
+
+    Read the bouts of {day} already written to {dest}, so a restarted watch
+    does not append them again
+
+    ### Return ###
+    * Map of bout key to its last written result and kimarite
+    ***************************************************************************"""
+    if not Path(dest).is_file():
+        return dict()
+    df = pd.read_csv(dest, dtype={"basho": str, "jsa_id": str, "jsa_opp_id": str})
+    written = dict()
+    for bout in df[df["day"] == day].to_dict("records"):
+        written[boutKey(bout)] = boutState(bout)
+    return written
+# END OF readWrittenBouts
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def appendBouts(bouts: list, dest: str) -> None:
+    df = addSumoDbIds(pd.DataFrame(data=bouts, columns=list(MU_HEADERS)), SUMODB_ID_COLS)
+    with METRICS.stage("write"):
+        df.to_csv(dest, mode='a', index=False, header=not Path(dest).is_file())
+    METRICS.count("bouts", len(bouts))
+
+
+def watchDay(day: int, divisions_list: list = list(DIVISIONS), interval: float = 30,
+             workers: int = 1, recycle_after: int = 50, dest: str = SAVE_DEST) -> None:
+    """***************************************************************************
+
+    Watch the torikumi of {day} while it is being fought. Every {interval}
+    seconds the page of each division is reloaded; a division whose table
+    hashes the same as on the last poll is not parsed, and of the rest only
+    the bouts that gained a result or kimarite, or whose result changed, are
+    appended to {dest}. Settled days are never fetched.
+
+    Stops once every bout of the day has a kimarite, or on Ctrl+C.
+
+    ### Parameters ###
+    * day : day of the basho to watch
+    * divisions_list : List of divisions represented as integers
+    * interval : seconds between the starts of two polls
+    * workers : number of headless drivers to load pages with
+    * recycle_after : number of pages after which a driver is relaunched
+    * dest : csv the changed bouts are appended to
+    ***************************************************************************"""
+    written = readWrittenBouts(dest, day)
+    hashes = dict()
+    latest = dict()
+    if workers > 1:
+        runner = DriverPool(workers, recycle_after)
+        poll = lambda: runner.map(
+            lambda driver, div: pollDivision(driver, div, day, hashes.get(div)),
+            divisions_list)
+    else:
+        runner = getHeadlessDriver()
+        poll = lambda: [pollDivision(runner, div, day, hashes.get(div))
+                        for div in divisions_list]
+
+    print(f"Watching Divisions {divisions_list} - Day {day}, every {interval}s")
+    with runner:
+        try:
+            while True:
+                strt = time.monotonic()
+                changed = list()
+                for div, polled in zip(divisions_list, poll()):
+                    if polled is None:
+                        print(f"Division {div} - Day {day} did not load")
+                        continue
+                    hashes[div], bouts = polled
+                    if bouts is None:
+                        continue
+                    latest[div] = bouts
+                    for bout in bouts:
+                        state = boutState(bout)
+                        if state != (None, None) and written.get(boutKey(bout)) != state:
+                            written[boutKey(bout)] = state
+                            changed.append(bout)
+
+                if changed:
+                    appendBouts(changed, dest)
+                    print(f"{time.strftime('%H:%M:%S')} appended {len(changed)} bouts")
+
+                if len(latest) == len(divisions_list) and all(
+                        [boutState(b)[1] for bouts in latest.values() for b in bouts]):
+                    print(f"Every bout of Day {day} is settled")
+                    return
+
+                time.sleep(max(0.0, interval - (time.monotonic() - strt)))
+        except KeyboardInterrupt:
+            print(f"Stopped watching Day {day}")
+# END OF watchDay
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
 def parseTorikumiCell(cell:Tag) -> Tuple[str, str]:
     """***************************************************************************
 
@@ -254,6 +505,25 @@ def parseTorikumiCell(cell:Tag) -> Tuple[str, str]:
 
 
 def argValidation(sys_args: dict, usage: str):
+    try:
+        sys_args["workers"] = int(sys_args["workers"])
+        sys_args["recycle"] = int(sys_args["recycle"])
+        assert sys_args["workers"] > 0 and sys_args["recycle"] > 0
+    except (ValueError, AssertionError):
+        raise AssertionError("workers and recycle must be positive integers")
+
+    assert sys_args["parser"] in PARSER_BACKENDS\
+        , f"Parser must be one of {PARSER_BACKENDS}"
+
+    assert sys_args["watch"] in ['y', 'n'], "Watch option must be 'y' or 'n'"
+    try:
+        sys_args["interval"] = float(sys_args["interval"])
+        assert sys_args["interval"] > 0
+    except (ValueError, AssertionError):
+        raise AssertionError("interval must be a positive number of seconds")
+    assert not (sys_args["watch"] == 'y' and sys_args["days"] == None)\
+        , "Watch mode needs the day to watch, days=<day>"
+
     if sys_args['days'] == None:
         sys_args["days"] = 1
         sys_args["days_end"] = 16
@@ -293,15 +563,26 @@ def main():
     else:
         args = SYS_DEFAULTS
     validateArgs(args, SYS_DEFAULTS, argValidation)
+    setParser(args["parser"])
 
-    data = list()
-    data = matchupDriver(list(DIVISIONS), range(
-        args["days"], args["days_end"]))
-    df = pd.DataFrame(data=data)
-    df.to_csv(
-        SAVE_DEST
-        , index=False
-    )
+    METRICS.reset("matchupUpdater")
+    try:
+        if args["watch"] == 'y':
+            watchDay(args["days"], list(DIVISIONS), args["interval"],
+                     args["workers"], args["recycle"])
+            return
+
+        data = list()
+        data = matchupDriver(list(DIVISIONS), range(
+            args["days"], args["days_end"]), args["workers"], args["recycle"])
+        df = addSumoDbIds(pd.DataFrame(data=data, columns=list(MU_HEADERS)), SUMODB_ID_COLS)
+        with METRICS.stage("write"):
+            df.to_csv(
+                SAVE_DEST
+                , index=False
+            )
+    finally:
+        METRICS.finish(args["metrics"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,267 @@
+import contextlib
+import importlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import helpers
+import pandas as pd
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CORPUS_PATH = os.path.join(FIXTURE_DIR, "corpus.json")
+BASELINE_PATH = os.path.join(FIXTURE_DIR, "benchmark_baseline.json")
+
+SYS_ARGS = {
+    "update": False,
+    "repeat": 20,
+    "threshold": 25
+}
+
+EXPECTED_KEYWORDS = [
+    None,
+    "update"
+]
+
+EXPECTED_OPTIONS = {
+    None: None,
+    "repeat": any,
+    "threshold": any,
+    "parser": helpers.PARSER_BACKENDS
+}
+
+COMMAND_LINE_USAGE_MSG = "Usage :: python parseBenchmark.py [--update] [-repeat <n>]\
+ [-threshold <percent>] [-parser <html.parser | lxml>]"
+
+
+def loadCorpus(corpus_path: str = CORPUS_PATH) -> list:
+    """***************************************************************************
+
+    Load the fixture corpus. Each entry names a saved page, the parse function
+    it is fed to as "module.function", the kind of page (small, huge-career,
+    retired, malformed) and the arguments passed after the page source.
+
+    ### Return ###
+    * List of corpus entries, with the page source under "page_src"
+    ***************************************************************************"""
+    with open(corpus_path, 'r') as f:
+        corpus = json.load(f)
+
+    for entry in corpus:
+        path = os.path.join(os.path.dirname(corpus_path), entry["file"])
+        with open(path, 'r', encoding="utf-8") as f:
+            entry["page_src"] = f.read()
+        mod, func = entry["function"].split('.')
+        entry["func"] = getattr(importlib.import_module(mod), func)
+    return corpus
+# END OF loadCorpus
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def runEntry(entry: dict) -> bool:
+    """Run the parse function of a corpus entry quietly, False if it raised"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            entry["func"](entry["page_src"], *entry["args"])
+        except Exception:
+            return False
+    return True
+
+
+def benchmarkEntry(entry: dict, repeat: int) -> dict:
+    """***************************************************************************
+
+    Time the parse function of a corpus entry over {repeat} runs, after one
+    warm up run, taking the median so noise on the runner does not trip the
+    regression check. Peak memory is measured with tracemalloc on a separate
+    run so the tracing overhead does not skew the timings
+
+    ### Return ###
+    * dict of ms/page, peak KiB and whether the function raised
+    ***************************************************************************"""
+    ok = runEntry(entry)
+
+    times = list()
+    for _ in range(repeat):
+        strt = time.perf_counter()
+        runEntry(entry)
+        times.append(time.perf_counter() - strt)
+    ms = statistics.median(times) * 1000
+
+    tracemalloc.start()
+    runEntry(entry)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "function": entry["function"],
+        "file": entry["file"],
+        "kind": entry["kind"],
+        "ms_per_page": ms,
+        "peak_kib": peak / 1024,
+        "raised": not ok
+    }
+# END OF benchmarkEntry
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def calibrate(repeat: int) -> float:
+    """***************************************************************************
+
+    Time a fixed pure Python workload of string, dict and list operations, the
+    kind the parse functions spend their time on, so timings can be compared
+    across machines as multiples of it
+
+    ### Return ###
+    * Median ms of the workload over {repeat} runs
+    ***************************************************************************"""
+    def work():
+        counts = dict()
+        for i in range(20000):
+            word = f"<td class='r{i % 97}'>{i}</td>".strip("<>").split("'")[1]
+            counts[word] = counts.get(word, 0) + 1
+        return sorted(counts.items())
+
+    work()
+    times = list()
+    for _ in range(repeat):
+        strt = time.perf_counter()
+        work()
+        times.append(time.perf_counter() - strt)
+    return statistics.median(times) * 1000
+# END OF calibrate
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    """***************************************************************************
+
+    Collapse per page results into one row per parse function
+
+    ### Return ###
+    * Dataframe indexed by function with ms/page, pages/sec and peak KiB
+    ***************************************************************************"""
+    summary = results.groupby("function").agg(
+        pages=("file", "count"),
+        ms_per_page=("ms_per_page", "mean"),
+        peak_kib=("peak_kib", "max"),
+        raised=("raised", "sum"))
+    summary["pages_per_sec"] = 1000 / summary["ms_per_page"]
+    return summary[["pages", "ms_per_page", "pages_per_sec", "peak_kib", "raised"]]
+# END OF summarize
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def compareToBaseline(summary: pd.DataFrame, baseline: dict, threshold: float) -> list:
+    """***************************************************************************
+
+    Find parse functions whose cost grew more than {threshold} percent over
+    the baseline. Costs are ms/page as a multiple of the calibrate workload
+    timed in the same run, so a baseline recorded on one machine holds on
+    another
+
+    ### Parameters ###
+    * summary : output of summarize
+    * baseline : mapping of function to baseline cost
+    * threshold : allowed slowdown in percent
+
+    ### Return ###
+    * List of regression messages, empty if none
+    ***************************************************************************"""
+    regressions = list()
+    for func, row in summary.iterrows():
+        if func not in baseline:
+            continue
+        limit = baseline[func] * (1 + threshold / 100)
+        if row["cost"] > limit:
+            regressions.append(
+                f"{func}: cost {row['cost']:.3f}, baseline"
+                f" {baseline[func]:.3f} (+{threshold}% allowed)")
+    return regressions
+# END OF compareToBaseline
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def handleSysArgs():
+    """***************************************************************************
+
+    Parse and validate the system arguments with the helpers lib, storing the
+    results in {SYS_ARGS}
+
+    ***************************************************************************"""
+    kywrd_args, optns = helpers.parseSysArgs(sys.argv)
+    helpers.validateSysArgs(kywrd_args, optns, EXPECTED_KEYWORDS,
+                            EXPECTED_OPTIONS, COMMAND_LINE_USAGE_MSG)
+
+    if kywrd_args and "update" in kywrd_args:
+        SYS_ARGS["update"] = True
+
+    if optns:
+        if "parser" in optns:
+            helpers.setParser(optns["parser"])
+        try:
+            SYS_ARGS["repeat"] = int(optns.get("repeat", SYS_ARGS["repeat"]))
+            SYS_ARGS["threshold"] = float(optns.get("threshold", SYS_ARGS["threshold"]))
+        except ValueError:
+            raise ValueError(
+                f"repeat and threshold must be numbers. {COMMAND_LINE_USAGE_MSG}")
+# END OF handleSysArgs
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def main():
+    """***************************************************************************
+
+    Benchmark every parse function on the offline fixture corpus and fail if any
+    of them raised, regressed past the threshold against the stored baseline
+    for the selected parser, or if there is no baseline for it. With --update
+    the baseline is rewritten instead, unless a function raised.
+    ***************************************************************************"""
+    handleSysArgs()
+
+    results = pd.DataFrame(data=[benchmarkEntry(entry, SYS_ARGS["repeat"])
+                                 for entry in loadCorpus()])
+    print(results.drop(columns=["function"]).to_string(index=False))
+    summary = summarize(results)
+    calibration = calibrate(SYS_ARGS["repeat"])
+    summary["cost"] = summary["ms_per_page"] / calibration
+    print()
+    print(f"Parser: {helpers.HTML_PARSER}, calibration {calibration:.2f} ms")
+    print(summary.to_string(float_format=lambda x: f"{x:.2f}"))
+
+    # a function that raises skips its work, so it can only look faster
+    raised = summary.index[summary["raised"] > 0].tolist()
+    for func in raised:
+        print(f"RAISED {func} raised on {summary.loc[func, 'raised']} page(s)")
+    if raised:
+        return 1
+
+    baselines = dict()
+    if os.path.isfile(BASELINE_PATH):
+        with open(BASELINE_PATH, 'r') as f:
+            baselines = json.load(f)
+
+    if SYS_ARGS["update"]:
+        baselines[helpers.HTML_PARSER] = summary["cost"].round(4).to_dict()
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baselines, f, indent=4)
+        print(f"Baseline written to {BASELINE_PATH}")
+        return 0
+
+    if helpers.HTML_PARSER not in baselines:
+        print(f"No {helpers.HTML_PARSER} baseline in {BASELINE_PATH}, rerun with --update"
+              " on the reference machine to record one")
+        return 1
+
+    regressions = compareToBaseline(
+        summary, baselines[helpers.HTML_PARSER], SYS_ARGS["threshold"])
+    for r in regressions:
+        print(f"REGRESSION {r}")
+    return int(len(regressions) > 0)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,131 @@
+import contextlib
+import io
+import re
+import sqlite3
+import time
+import zlib
+
+import helpers
+import pandas as pd
+
+from banzukeUpdater import getProfileData
+from matchupScraper import parseMatchup
+from profileScraper import scrapeRikishiProfile
+from resultsScraper import parseRikishi
+from responseCache import CACHE_PATH
+
+SYS_DEFAULTS = {
+    "cache_path": CACHE_PATH,
+    "limit": 0
+}
+
+# (url pattern with the id in its first group, name, parse function(page_src, id))
+PAGE_PARSERS = [
+    (r"sumodb\.sumogames\.de/Rikishi\.aspx\?r=(\d+)", "parseRikishi", parseRikishi),
+    (r"sumodb\.sumogames\.de/Rikishi\.aspx\?r=(\d+)", "scrapeRikishiProfile", scrapeRikishiProfile),
+    (r"sumodb\.sumogames\.de/Rikishi_opp\.aspx\?r=(\d+)", "parseMatchup", parseMatchup),
+    (r"sumo\.or\.jp/EnSumoDataRikishi/profile/(\d+)", "getProfileData", getProfileData),
+]
+
+
+def sameResult(a, b) -> bool:
+    """Compare the outputs of a parse function, which are dataframes or dicts"""
+    if isinstance(a, pd.DataFrame) and isinstance(b, pd.DataFrame):
+        return a.reset_index(drop=True).equals(b.reset_index(drop=True))
+    return a == b
+
+
+def runParser(func, page_src: str, id_: int):
+    """Run a parse function with its progress prints silenced"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(page_src, id_)
+
+
+def checkParsers(pages: list) -> pd.DataFrame:
+    """***************************************************************************
+
+    Run every matching parse function over {pages} with each parser backend,
+    comparing the output of each backend against 'html.parser'
+
+    ### Parameters ###
+    * pages : list of (url, page source)
+
+    ### Return ###
+    * Dataframe of the pages, seconds taken and mismatches per function and
+      backend
+    ***************************************************************************"""
+    stats = dict()
+    for url, page_src in pages:
+        for patt, name, func in PAGE_PARSERS:
+            m = re.search(patt, url)
+            if not m:
+                continue
+            id_ = int(m.groups()[0])
+
+            expected = None
+            for backend in helpers.PARSER_BACKENDS:
+                helpers.setParser(backend)
+                strt = time.perf_counter()
+                result = runParser(func, page_src, id_)
+                elapsed = time.perf_counter() - strt
+
+                stat = stats.setdefault(
+                    (name, backend), {"pages": 0, "seconds": 0.0, "mismatches": 0})
+                stat["pages"] += 1
+                stat["seconds"] += elapsed
+                if backend == helpers.PARSER_BACKENDS[0]:
+                    expected = result
+                elif not sameResult(expected, result):
+                    stat["mismatches"] += 1
+                    print(f"{name} differs with {backend} for {url}")
+
+    rows = [dict(function=name, backend=backend, **stat)
+            for (name, backend), stat in stats.items()]
+    return pd.DataFrame(data=rows, columns=["function", "backend", "pages",
+                                            "seconds", "mismatches"])
+# END OF checkParsers
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def loadCachedPages(cache_path: str, limit: int = 0) -> list:
+    """***************************************************************************
+
+    Read archived pages out of a responseCache database
+
+    ### Return ###
+    * list of (url, page source)
+    ***************************************************************************"""
+    query = "SELECT url, body FROM responses"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    with contextlib.closing(sqlite3.connect(cache_path)) as conn:
+        return [(url, zlib.decompress(body).decode("utf-8"))
+                for url, body in conn.execute(query)]
+# END OF loadCachedPages
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def argValidation(sys_args: dict, usage: str):
+    sys_args["limit"] = int(sys_args["limit"])
+
+
+def main():
+    """***************************************************************************
+
+    Verify that every parser backend produces the same output as html.parser on
+    the pages archived in the response cache, and report how long each took
+
+    Usage :: python parserCheck.py <cache_path> <limit=0>
+    ***************************************************************************"""
+    args = helpers.readSysArgs(SYS_DEFAULTS.keys())
+    helpers.validateArgs(args, SYS_DEFAULTS, argValidation)
+
+    pages = loadCachedPages(args["cache_path"], args["limit"])
+    print(f"Checking {len(pages)} archived pages")
+    results = checkParsers(pages)
+    print(results.to_string(index=False))
+    return int(results["mismatches"].sum() > 0)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
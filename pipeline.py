@@ -0,0 +1,162 @@
+import os
+import queue
+import threading
+
+import helpers
+
+from concurrent.futures import ProcessPoolExecutor
+from runMetrics import METRICS, timedCall
+from typing import Callable, Iterable, Tuple
+
+# Marks the end of a stage's output on the queue to the next stage
+_DONE = object()
+
+# Error of a page the fetcher could not download
+_NOT_DOWNLOADED = object()
+
+
+def runPipeline(keys: Iterable, url_fmt: str, parse: Callable, write: Callable, fetcher,
+                fetchers: int = 8, parsers: int = None, queue_size: int = 64,
+                ready_selector: str = None, max_failures: int = 10) -> Tuple[int, int]:
+    """***************************************************************************
+
+    Crawl {keys} through a staged fetch -> parse -> write pipeline, so network
+    waits, parsing and writing overlap:
+
+    * {fetchers} threads download pages and push the raw html onto a bounded
+      queue
+    * a process pool of {parsers} workers runs parse(page_src, key) on them
+    * the calling thread is the single writer, calling write(key, result)
+
+    At most {queue_size} pages are waiting to be parsed and at most {queue_size}
+    are parsed or being parsed but not yet written. When the writer falls
+    behind the fetchers block, so memory stays flat regardless of crawl size.
+    Failed downloads are paced by the fetcher's rateControl.RateController;
+    a fetch that raises counts as a page that did not download.
+    Stops fetching new pages after {max_failures} pages in a row fail to parse
+    or write.
+
+    ### Parameters ###
+    * keys : ids to crawl, formatted into {url_fmt}
+    * url_fmt : url with a single {} placeholder for the key
+    * parse : picklable top level function(page_src, key) -> result, None on failure
+    * write : function(key, result) -> bool, called from this thread only
+    * fetcher : fetch backend with a thread safe get(url, ready_selector)
+    * fetchers : number of fetch threads
+    * parsers : number of parse processes, defaults to the cpu count
+    * queue_size : bound of the raw page and parsed result stages
+
+    ### Return ###
+    * Tuple of (succeeded, failed) counts
+    ***************************************************************************"""
+    parsers = parsers or os.cpu_count() or 1
+    key_q = queue.Queue(maxsize=fetchers * 2)
+    raw_q = queue.Queue(maxsize=queue_size)
+    out_q = queue.Queue()
+    unwritten = threading.Semaphore(queue_size)
+    stop = threading.Event()
+
+    def feed():
+        for key in keys:
+            if stop.is_set():
+                break
+            key_q.put(key)
+        for _ in range(fetchers):
+            key_q.put(_DONE)
+
+    def fetch():
+        # dispatch waits for a _DONE from every fetch thread, however it ends
+        try:
+            while True:
+                key = key_q.get()
+                if key is _DONE:
+                    return
+                page_src = None
+                if not stop.is_set():
+                    try:
+                        page_src = fetcher.get(url_fmt.format(key), ready_selector)
+                    except Exception as e:
+                        print(f"Could not fetch {key}: {e}")
+                raw_q.put((key, page_src))
+        finally:
+            raw_q.put(_DONE)
+
+    def dispatch(pool: ProcessPoolExecutor):
+        finished_fetchers = 0
+        pending = list()
+        while finished_fetchers < fetchers:
+            item = raw_q.get()
+            if item is _DONE:
+                finished_fetchers += 1
+                continue
+
+            key, page_src = item
+            unwritten.acquire()
+            if page_src is None:
+                out_q.put((key, None, _NOT_DOWNLOADED))
+                continue
+
+            # timed in the worker, whose METRICS this process cannot see
+            fut = pool.submit(timedCall, parse, page_src, key)
+            fut.add_done_callback(
+                lambda f, key=key: out_q.put(
+                    (key, None, f.exception()) if f.exception()
+                    else (key, f.result(), None)))
+            pending.append(fut)
+            pending = [f for f in pending if not f.done()]
+
+        for fut in pending:
+            fut.exception()
+        out_q.put(_DONE)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    threads += [threading.Thread(target=fetch, daemon=True) for _ in range(fetchers)]
+
+    succ_cnt = 0
+    fail_cnt = 0
+    consecutive = 0
+    with ProcessPoolExecutor(max_workers=parsers, initializer=helpers.setParser,
+                             initargs=(helpers.HTML_PARSER,)) as pool:
+        threads.append(threading.Thread(target=dispatch, args=(pool,), daemon=True))
+        for t in threads:
+            t.start()
+
+        while True:
+            item = out_q.get()
+            if item is _DONE:
+                break
+            key, result, error = item
+            unwritten.release()
+            if stop.is_set():
+                continue
+
+            ok = False
+            if error is _NOT_DOWNLOADED:
+                # paced by the fetcher's rate controller, not counted below
+                print(f"{key} could not be downloaded")
+                fail_cnt += 1
+                continue
+            if error is not None:
+                print(f"{key} failed: {error}")
+            else:
+                result, seconds = result
+                METRICS.record("parse", seconds)
+                if result is not None:
+                    ok = write(key, result)
+
+            if ok:
+                succ_cnt += 1
+                consecutive = 0
+            else:
+                fail_cnt += 1
+                consecutive += 1
+                if consecutive >= max_failures:
+                    print(f"too much failure, quitting")
+                    stop.set()
+            print(f"{succ_cnt + fail_cnt} processed, {succ_cnt} written")
+
+    for t in threads:
+        t.join()
+    return succ_cnt, fail_cnt
+# END OF runPipeline
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
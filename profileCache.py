@@ -0,0 +1,153 @@
+import os
+import pandas as pd
+import sqlite3
+import threading
+import time
+
+from typing import Iterable
+
+PROFILE_CACHE_PATH = r".\cache\profiles.db"
+
+DAY = 24 * 60 * 60
+
+# Profile fields that change over a career, refetched once older than the max
+# age given to ProfileCache.stale. Every other field (birth date, shusshin,
+# hatsu, real name, ...) never changes once known.
+VOLATILE_FIELDS = ["height", "weight", "heya"]
+
+# Days after which volatile fields are refetched by default
+DEFAULT_MAX_AGE = 60
+
+
+class ProfileCache:
+    """***************************************************************************
+
+    Persistent cache of parsed JSA profiles, one row per jsa_id and field,
+    with the time the field was last fetched and the time its value last
+    changed. Freshness is decided per field, so a basho update only has to
+    fetch the profiles of new rikishi, whose career record still grows, and
+    of rikishi whose volatile fields have gone stale.
+
+    Values are stored as text, as they appear in the profile csv.
+
+    Safe to share between threads.
+    ***************************************************************************"""
+
+    def __init__(self, path: str = PROFILE_CACHE_PATH):
+        dir_ = os.path.dirname(path)
+        if dir_:
+            os.makedirs(dir_, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS profile_fields ("
+            " jsa_id TEXT NOT NULL,"
+            " field TEXT NOT NULL,"
+            " value TEXT,"
+            " fetched_at REAL NOT NULL,"
+            " changed_at REAL NOT NULL,"
+            " PRIMARY KEY (jsa_id, field))")
+        self.conn.commit()
+
+    def _rows(self, jsa_ids: list) -> list:
+        rows = list()
+        with self.lock:
+            # chunked to stay under sqlite's limit on bound parameters
+            for i in range(0, len(jsa_ids), 500):
+                chunk = jsa_ids[i:i + 500]
+                rows.extend(self.conn.execute(
+                    "SELECT jsa_id, field, value, fetched_at FROM profile_fields"
+                    f" WHERE jsa_id IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+        return rows
+
+    def stale(self, jsa_ids: Iterable, fields: list,
+              max_age: float = DEFAULT_MAX_AGE) -> set:
+        """***********************************************************************
+
+        Find the profiles of {jsa_ids} that have to be fetched: profiles not
+        cached or missing any of {fields}, those of new rikishi (is_new) and
+        those with a volatile field fetched more than {max_age} days ago
+
+        ### Return ###
+        * Set of the jsa ids to fetch
+        ***********************************************************************"""
+        jsa_ids = set([_toText(j) for j in jsa_ids])
+        oldest = time.time() - max_age * DAY
+        seen = dict()
+        stale = set()
+        for jsa_id, field, value, fetched_at in self._rows(list(jsa_ids)):
+            seen.setdefault(jsa_id, set()).add(field)
+            if field in VOLATILE_FIELDS and fetched_at < oldest:
+                stale.add(jsa_id)
+            elif field == "is_new" and value not in [None, "0"]:
+                stale.add(jsa_id)
+
+        for jsa_id in jsa_ids:
+            if not set(fields).issubset(seen.get(jsa_id, set())):
+                stale.add(jsa_id)
+        return stale
+
+    def put(self, df: pd.DataFrame) -> int:
+        """***********************************************************************
+
+        Store freshly fetched profiles, one per row of {df} keyed by its jsa_id
+        column. Every field counts as fetched now; its change time only moves
+        if the value differs from the cached one.
+
+        ### Return ###
+        * Number of profiles stored
+        ***********************************************************************"""
+        now = time.time()
+        rows = list()
+        for profile in df.to_dict("records"):
+            jsa_id = _toText(profile.get("jsa_id"))
+            if jsa_id is None:
+                continue
+            for field, value in profile.items():
+                if field != "jsa_id":
+                    rows.append((jsa_id, field, _toText(value), now, now))
+
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO profile_fields VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (jsa_id, field) DO UPDATE SET"
+                " changed_at = CASE WHEN value IS excluded.value THEN changed_at"
+                " ELSE excluded.changed_at END,"
+                " value = excluded.value, fetched_at = excluded.fetched_at", rows)
+            self.conn.commit()
+        return len(set([row[0] for row in rows]))
+
+    def read(self, jsa_ids: Iterable, columns: list) -> pd.DataFrame:
+        """***********************************************************************
+
+        Read the cached profiles of {jsa_ids}
+
+        ### Return ###
+        * Dataframe of {columns}, which start with jsa_id, one row per cached
+          profile
+        ***********************************************************************"""
+        profiles = dict()
+        for jsa_id, field, value, _ in self._rows(list(set([_toText(j) for j in jsa_ids]))):
+            profiles.setdefault(jsa_id, {"jsa_id": jsa_id})[field] = value
+        return pd.DataFrame(data=list(profiles.values()), columns=columns)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+# END OF ProfileCache
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def _toText(value):
+    """Store a csv or numpy value as text, None for a missing one"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
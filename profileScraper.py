@@ -3,16 +3,28 @@ import pandas as pd
 import re
 import sys
 
-from bs4 import BeautifulSoup as bs
 from helpers import *
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as ec
+from jobJournal import MAX_ATTEMPTS, JobJournal, runJob
+from pipeline import runPipeline
+from responseCache import CachedFetcher, ResponseCache, retiredRikishiUrls
+from runMetrics import METRICS
 
 KAKU_URL = "http://sumodb.sumogames.de/Rikishi_stat.aspx?kaku={}"
 PROFILE_URL = 'http://sumodb.sumogames.de/Rikishi.aspx?r={}'
 SAVE_DEST = r".\id.csv"
 
+SYS_DEFAULTS = {
+    "write_option": 'w',
+    "id_file": '',
+    "backend": 'http',
+    "cache": 'n',
+    "parser": HTML_PARSER,
+    "engine": 'serial',
+    "concurrency": 8,
+    "attempts": MAX_ATTEMPTS,
+    "metrics": ''
+}
+
 PROFILE_HDRS = (
     "id",
     "shikona",
@@ -26,14 +38,21 @@ PROFILE_HDRS = (
 )
 
 
-def downloadProfiles(write_opt:str='w', id_file:str = None):
+def downloadProfiles(write_opt:str='w', id_file:str = None, backend:str = 'http',
+                     cache:ResponseCache = None, engine:str = 'serial',
+                     concurrency:int = 8, attempts:int = MAX_ATTEMPTS):
     """***************************************************************************
 
     Downloads profile data from sumodb by parsing through the pages of each
     profile page, accessed with the rikishi's id number as indexed by sumodb.
-    Utilizes a failure count; if 10 pages in a row fail to be read, returns False.
+    Utilizes a failure count; if 10 pages in a row fail to be parsed, the pass
+    ends. Pages that fail to download are left to the fetcher's rate control,
+    which backs off and pauses the host instead.
 
-    Will write contents to id.csv if cancelled or failed midway
+    The ids are tracked in a jobJournal. Each pass writes its profiles to
+    id.csv when it ends, even if cancelled or failed midway, and only then
+    marks them done; ids that failed are retried in further passes until each
+    has had {attempts} attempts.
 
     ### Parameters ###
     * write_opt : file writing option. If 'w' is used, function will write a new
@@ -41,6 +60,12 @@ def downloadProfiles(write_opt:str='w', id_file:str = None):
                 written' id.csv' and will read from it, continuing where it left off.
     * id_file : a file path to a list of ids to read from and use. If not provided
                 then ids are scraped from the historical sumo rikishi list
+    * backend : fetch backend from helpers.FETCH_BACKENDS used to load pages
+    * cache : ResponseCache to answer from before downloading a page
+    * engine : 'serial' to load and parse one page at a time, 'pipeline' to
+                download on {concurrency} threads and parse on a process pool
+                with pipeline.runPipeline
+    * attempts : attempts per id before giving up on it
     ***************************************************************************"""
     id_set = set()
     if id_file:
@@ -54,91 +79,100 @@ def downloadProfiles(write_opt:str='w', id_file:str = None):
         with open(id_file, 'r') as f:
             id_set = set([x.lstrip().rstrip() for x in f.readlines()])
     else:
-        id_set = scrapeIdNums()
+        id_set = scrapeIdNums(backend)
 
     if write_opt == 'a':
         profdf = pd.read_csv(SAVE_DEST)
         finished_ids = set(profdf['id'].unique())
         id_set = id_set.difference(finished_ids)
 
-    with getHeadlessDriver() as driver:
-        waiter = WebDriverWait(driver, timeout=10)
-        prof_data = list()
-        failure_cnt = 0
-        try:
-            for id_ in id_set:
-                if failure_cnt > 10:
-                    print(f"Too many failures, ending")
-                    break
-                try:
-                    url = PROFILE_URL.format(id_)
-                    driver.get(url)
-                    waiter.until(ec.url_to_be(PROFILE_URL.format(id_)))
-                    print(f"=== {id_} : scraping===")
-                    results = scrapeRikishiProfile(driver.page_source, id_)
-                    if results:
+    journal = JobJournal("profiles", max_attempts=attempts)
+    journal.sync(id_set)
+
+    make_fetcher = lambda: getFetcher(backend, timeout=10)
+    with (CachedFetcher(make_fetcher, cache) if cache else make_fetcher()) as fetcher:
+
+        def runPass(ids:list) -> bool:
+            nonlocal write_opt
+            prof_data = list()
+            failure_cnt = 0
+            try:
+                if engine == 'pipeline':
+                    def collect(id_, results) -> bool:
                         prof_data.append(results)
-                        print(f"Success")
-                        failure_cnt = 0
-                    else:
-                        print(f"Failure: {failure_cnt + 1}")
+                        return True
+                    runPipeline(ids, PROFILE_URL, scrapeRikishiProfile, collect,
+                                fetcher, concurrency)
+                    ids = list()
+                for id_ in ids:
+                    if failure_cnt > 10:
+                        print(f"Too many failures, ending")
+                        return False
+                    try:
+                        page_src = fetcher.get(PROFILE_URL.format(id_))
+                        if page_src is None:
+                            # paced by the fetcher's rate controller, not counted
+                            print(f"Timeout Occurred for {id_}")
+                            continue
+                        print(f"=== {id_} : scraping===")
+                        results = scrapeRikishiProfile(page_src, id_)
+                        if results:
+                            prof_data.append(results)
+                            print(f"Success")
+                            failure_cnt = 0
+                        else:
+                            print(f"Failure: {failure_cnt + 1}")
+                            failure_cnt += 1
+                    except AttributeError:
+                        print("Failure, attribute error")
                         failure_cnt += 1
-                except TimeoutException:
-                    print(f"Timeout Occurred for {id_}")
-                    failure_cnt += 1
-                    continue
-                except AttributeError:
-                    print("Failure, attribute error")
-                    failure_cnt += 1
-                    continue
+                        continue
+            finally:
+                with METRICS.stage("write"):
+                    profdf = pd.DataFrame(data=prof_data, columns=PROFILE_HDRS)
+                    profdf.to_csv(SAVE_DEST, index=False, mode=write_opt, header=(write_opt != 'a'))
+                METRICS.count("pages", len(prof_data))
+                for results in prof_data:
+                    journal.done(results["id"])
+                write_opt = 'a'
+            return True
+
+        try:
+            runJob(journal, runPass)
         except Exception as e:
             print(e)
             return False
         finally:
-            profdf = pd.DataFrame(data=prof_data, columns=PROFILE_HDRS)
-            profdf.to_csv(SAVE_DEST, index=False, mode=write_opt, header=(write_opt != 'a'))
+            journal.close()
 
     return True
 # END OF downloadProfiles
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
-def scrapeIdNums() -> list:
+def scrapeIdNums(backend:str = 'http') -> list:
     """***************************************************************************
 
     Parse through sumodb's rikishi page and scrape out the id numbers of all
     historical rikishi from their links
 
     ### Parameters ###
-    * :
+    * backend : fetch backend from helpers.FETCH_BACKENDS used to load pages
 
     ### Return ###
     * The id number of every single rikishi in the database
     ***************************************************************************"""
     possibleIdNums = list()
-    with getHeadlessDriver() as driver:
-        driver_waiter = WebDriverWait(driver, timeout=30)
+    with getFetcher(backend, timeout=30) as fetcher:
         for i in range(10):
             i = i + 1
-            curr_url = KAKU_URL.format(i)
-            driver.get(curr_url)
-            try:
-                driver_waiter.until(ec.url_to_be(curr_url))
-            except TimeoutException as e:
-                print(f"Timeout for page {i}")
-                print(f"Got {driver.current_url}")
-                continue
-            try:
-                driver_waiter.until(
-                    ec.presence_of_element_located
-                        (("css selector", "table.rikishidata"))
-                )
-            except TimeoutException:
+            page_src = fetcher.get(KAKU_URL.format(i), "table.rikishidata")
+            if page_src is None:
                 print(f"Timeout for page {i}")
                 print(f"Couldn't get loaded table data")
                 continue
 
-            soup = bs(driver.page_source, "html.parser")
+            soup = makeSoup(page_src)
 
             table = soup.find("tbody")
             rows = table.find_all("tr")
@@ -156,6 +190,7 @@ def scrapeIdNums() -> list:
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+@METRICS.timed("parse")
 def scrapeRikishiProfile(profile_source:str, id_:int) -> dict:
     """***************************************************************************
 
@@ -170,7 +205,7 @@ def scrapeRikishiProfile(profile_source:str, id_:int) -> dict:
     ### Return ###
     *
     ***************************************************************************"""
-    soup = bs(profile_source, "html.parser")
+    soup = makeSoup(profile_source)
 
     try:
         print(f"Parsing {id_}")
@@ -237,15 +272,41 @@ def scrapeRikishiProfile(profile_source:str, id_:int) -> dict:
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+def argValidation(sys_args: dict, usage: str):
+    assert sys_args["write_option"] in ['w', 'a']\
+        , "Write option must be 'w' or 'a'"
+    assert sys_args["backend"] in FETCH_BACKENDS\
+        , f"Backend must be one of {list(FETCH_BACKENDS)}"
+    assert sys_args["cache"] in ['y', 'n']\
+        , "Cache option must be 'y' or 'n'"
+    assert sys_args["parser"] in PARSER_BACKENDS\
+        , f"Parser must be one of {PARSER_BACKENDS}"
+    assert sys_args["engine"] in ['serial', 'pipeline']\
+        , "Engine must be 'serial' or 'pipeline'"
+    assert not (sys_args["engine"] == 'pipeline' and sys_args["backend"] != 'http')\
+        , "The pipeline engine requires the http backend"
+    sys_args["concurrency"] = int(sys_args["concurrency"])
+    sys_args["attempts"] = int(sys_args["attempts"])
+
+
 def main():
-    write_opt = 'w'
-    file_path = ''
-    if len(sys.argv) > 1 and sys.argv[1] == 'a':
-        write_opt = 'a'
-    if len(sys.argv) > 2:
-        file_path = sys.argv[2]
-
-    downloadProfiles(write_opt, file_path)
+    args = readSysArgs(SYS_DEFAULTS.keys())
+    validateArgs(args, SYS_DEFAULTS, argValidation)
+    setParser(args["parser"])
+
+    cache = None
+    if args["cache"] == 'y':
+        cache = ResponseCache(permanent=retiredRikishiUrls(SAVE_DEST))
+
+    METRICS.reset("profileScraper")
+    try:
+        downloadProfiles(args["write_option"], args["id_file"], args["backend"], cache,
+                         args["engine"], args["concurrency"], args["attempts"])
+    finally:
+        METRICS.finish(args["metrics"])
+        if cache:
+            cache.report()
+            cache.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,271 @@
+import contextlib
+import random
+import threading
+import time
+
+from urllib.parse import urlparse
+
+# Circuit breaker states of a host
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Responses that mean the host is overloaded or rate limiting us
+THROTTLE_STATUSES = [429, 503]
+
+
+class HostState:
+    """***************************************************************************
+
+    Rate control state of a single host: the AIMD concurrency window, the
+    smoothed latency, the backoff after failures and the circuit breaker
+    ***************************************************************************"""
+
+    def __init__(self, start: float):
+        self.limit = start
+        self.in_flight = 0
+        self.srtt = None
+        self.rttvar = None
+        self.best_rtt = None
+        self.consecutive = 0
+        self.retry_at = 0.0
+        self.last_decrease = 0.0
+        self.breaker = CLOSED
+        self.open_until = 0.0
+        self.trips = 0
+        self.counts = {"ok": 0, "failed": 0, "throttled": 0, "slow": 0}
+# END OF HostState
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+class Outcome:
+    """Result of one request, filled in by the caller of RateController.slot"""
+
+    def __init__(self):
+        self.ok = True
+        self.status = None
+        self.retry_after = None
+
+    def failed(self, status: int = None, retry_after: float = None) -> None:
+        self.ok = False
+        self.status = status
+        self.retry_after = retry_after
+
+
+class RateController:
+    """***************************************************************************
+
+    Adaptive per-host request rate control, shared by every thread fetching
+    from a host. Replaces aborting a run after a fixed number of failures.
+
+    * The number of requests in flight to a host is an AIMD window: it grows
+      by one for every window's worth of successes, up to {max_concurrency},
+      and is halved on a failure, a throttling response (429/503) or a
+      response much slower than the fastest one seen.
+    * After a failure the host is not asked again until an exponential backoff
+      with jitter, or its Retry-After, has passed.
+    * After {breaker_failures} failures in a row the circuit breaker opens and
+      requests to the host wait for {breaker_pause} seconds, doubling on every
+      further trip up to {max_pause}, then a single probe request is let
+      through; its success closes the breaker again.
+    * Request timeouts follow the host's smoothed latency, as TCP does,
+      instead of a fixed 10-30s.
+
+    Requests pause rather than fail while a host recovers.
+    ***************************************************************************"""
+
+    def __init__(self, max_concurrency: int = 8, start: int = 2,
+                 base_backoff: float = 1.0, max_backoff: float = 60.0,
+                 breaker_failures: int = 5, breaker_pause: float = 30.0,
+                 max_pause: float = 600.0, slow_factor: float = 4.0,
+                 min_timeout: float = 5.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.start = min(start, self.max_concurrency)
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.breaker_failures = breaker_failures
+        self.breaker_pause = breaker_pause
+        self.max_pause = max_pause
+        self.slow_factor = slow_factor
+        self.min_timeout = min_timeout
+        self.hosts = dict()
+        self.cond = threading.Condition()
+
+    def _host(self, host: str) -> HostState:
+        if host not in self.hosts:
+            self.hosts[host] = HostState(self.start)
+        return self.hosts[host]
+
+    def acquire(self, host: str) -> None:
+        """***********************************************************************
+
+        Wait until a request to {host} may be sent: the window has room, no
+        backoff is running and the breaker is closed, or half open with no
+        probe in flight
+        ***********************************************************************"""
+        with self.cond:
+            state = self._host(host)
+            while True:
+                now = time.monotonic()
+                if state.breaker == OPEN and now >= state.open_until:
+                    state.breaker = HALF_OPEN
+                    print(f"{host}: sending a probe request")
+
+                if state.breaker == OPEN:
+                    wait = state.open_until - now
+                elif state.retry_at > now:
+                    wait = state.retry_at - now
+                elif state.breaker == HALF_OPEN and state.in_flight > 0:
+                    wait = None
+                elif state.in_flight >= int(state.limit):
+                    wait = None
+                else:
+                    state.in_flight += 1
+                    return
+                self.cond.wait(wait)
+
+    def release(self, host: str, ok: bool, latency: float, status: int = None,
+                retry_after: float = None) -> None:
+        """***********************************************************************
+
+        Record the outcome of a request to {host} and adjust its window
+
+        ### Parameters ###
+        * host : host the request went to
+        * ok : the host answered, even if the page itself was missing
+        * latency : seconds the request took
+        * status : http status of a failed request, if there was a response
+        * retry_after : seconds the host asked us to wait
+        ***********************************************************************"""
+        with self.cond:
+            state = self._host(host)
+            state.in_flight -= 1
+            now = time.monotonic()
+            if ok:
+                self._success(host, state, latency, now)
+            else:
+                self._failure(host, state, now, status, retry_after)
+            self.cond.notify_all()
+
+    def _success(self, host: str, state: HostState, latency: float, now: float) -> None:
+        state.counts["ok"] += 1
+        state.consecutive = 0
+        if state.breaker == HALF_OPEN:
+            print(f"{host}: recovered, resuming")
+            state.breaker = CLOSED
+            state.trips = 0
+
+        # smoothed latency and its variation, RFC 6298
+        if state.srtt is None:
+            state.srtt, state.rttvar = latency, latency / 2
+        else:
+            state.rttvar = 0.75 * state.rttvar + 0.25 * abs(state.srtt - latency)
+            state.srtt = 0.875 * state.srtt + 0.125 * latency
+        state.best_rtt = latency if state.best_rtt is None else min(state.best_rtt, latency)
+
+        if latency > self.slow_factor * max(state.best_rtt, 0.25):
+            state.counts["slow"] += 1
+            self._decrease(state, now)
+        else:
+            state.limit = min(self.max_concurrency, state.limit + 1 / state.limit)
+
+    def _failure(self, host: str, state: HostState, now: float, status: int,
+                 retry_after: float) -> None:
+        throttled = status in THROTTLE_STATUSES
+        state.counts["throttled" if throttled else "failed"] += 1
+        state.consecutive += 1
+        self._decrease(state, now)
+
+        backoff = min(self.max_backoff, self.base_backoff * 2 ** (state.consecutive - 1))
+        backoff = random.uniform(backoff / 2, backoff)
+        if retry_after is not None:
+            backoff = max(backoff, min(retry_after, self.max_pause))
+        state.retry_at = max(state.retry_at, now + backoff)
+
+        if state.breaker == HALF_OPEN or state.consecutive >= self.breaker_failures:
+            pause = min(self.max_pause, self.breaker_pause * 2 ** state.trips)
+            state.trips += 1
+            state.breaker = OPEN
+            state.open_until = now + pause
+            print(f"{host}: {state.consecutive} failures in a row, pausing for {pause:.0f}s")
+
+    def _decrease(self, state: HostState, now: float) -> None:
+        """Halve the window, at most once per smoothed round trip"""
+        if now - state.last_decrease < (state.srtt or 0):
+            return
+        state.limit = max(1.0, state.limit / 2)
+        state.last_decrease = now
+
+    def timeout(self, host: str, ceiling: float) -> float:
+        """***********************************************************************
+
+        Timeout for the next request to {host}: four deviations above its
+        smoothed latency, between {min_timeout} and {ceiling}
+        ***********************************************************************"""
+        with self.cond:
+            state = self._host(host)
+            if state.srtt is None:
+                return ceiling
+            return min(ceiling, max(self.min_timeout, state.srtt + 4 * state.rttvar))
+
+    @contextlib.contextmanager
+    def slot(self, url: str):
+        """***********************************************************************
+
+        Hold a request slot for {url} while the request runs. The caller marks
+        failures on the yielded Outcome; an exception counts as a failure.
+
+        Usage ::
+            with rate.slot(url) as outcome:
+                page_src = load(url)
+                if page_src is None:
+                    outcome.failed()
+        ***********************************************************************"""
+        host = urlparse(url).netloc
+        self.acquire(host)
+        outcome = Outcome()
+        strt = time.monotonic()
+        try:
+            yield outcome
+        except BaseException:
+            outcome.failed()
+            raise
+        finally:
+            self.release(host, outcome.ok, time.monotonic() - strt,
+                         outcome.status, outcome.retry_after)
+
+    def report(self) -> None:
+        """Print the window, latency and request counts of every host"""
+        with self.cond:
+            for host, state in self.hosts.items():
+                srtt = f"{state.srtt * 1000:.0f}ms" if state.srtt is not None else "n/a"
+                print(f"{host}: window {state.limit:.1f}, latency {srtt}, "
+                      + ", ".join([f"{k} {v}" for k, v in state.counts.items()]))
+# END OF RateController
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def parseRetryAfter(value: str):
+    """***************************************************************************
+
+    Seconds to wait from a Retry-After header, which is either a number of
+    seconds or an http date
+
+    ### Return ###
+    * Seconds, or None if the header is missing or malformed
+    ***************************************************************************"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        import datetime as dt
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - dt.datetime.now(when.tzinfo)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+# END OF parseRetryAfter
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
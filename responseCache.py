@@ -0,0 +1,205 @@
+import hashlib
+import os
+import pandas as pd
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from typing import Callable, Iterable, List, Tuple, Union
+
+CACHE_PATH = r".\cache\responses.db"
+
+RIKISHI_URL = 'http://sumodb.sumogames.de/Rikishi.aspx?r={}'
+RIKISHI_OPP_URL = 'http://sumodb.sumogames.de/Rikishi_opp.aspx?r={}'
+
+HOUR = 60 * 60
+
+# (url pattern, seconds a cached page stays fresh). First match wins, None never
+# expires. Pages of retired rikishi are never stale and are handled separately
+# through the permanent urls of the cache.
+DEFAULT_TTLS = [
+    (r"sumodb\.sumogames\.de/Rikishi(_opp)?\.aspx", 6 * HOUR),
+    (r"sumodb\.sumogames\.de/Rikishi_stat\.aspx", 24 * HOUR),
+    (r"sumodb\.sumogames\.de/Banzuke\.aspx", 6 * HOUR),
+    (r"sumo\.or\.jp/EnSumoDataRikishi/profile", 12 * HOUR),
+]
+
+DEFAULT_TTL = 1 * HOUR
+
+
+class ResponseCache:
+    """***************************************************************************
+
+    Persistent on-disk cache of downloaded pages, keyed by url. Bodies are stored
+    zlib compressed in a single sqlite file together with the time they were
+    fetched and a sha256 of their content. Freshness is decided per url pattern
+    by {ttls}; urls in {permanent} never expire.
+
+    Safe to share between the threads of the async engine or a DriverPool.
+    ***************************************************************************"""
+
+    def __init__(self, path: str = CACHE_PATH,
+                 ttls: List[Tuple[str, Union[int, None]]] = DEFAULT_TTLS,
+                 permanent: Iterable[str] = ()):
+        dir_ = os.path.dirname(path)
+        if dir_:
+            os.makedirs(dir_, exist_ok=True)
+
+        self.ttls = [(re.compile(patt), ttl) for patt, ttl in ttls]
+        self.permanent = set(permanent)
+        self.counts = {"hit": 0, "miss": 0, "expired": 0, "unchanged": 0}
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " url TEXT PRIMARY KEY,"
+            " fetched_at REAL NOT NULL,"
+            " sha256 TEXT NOT NULL,"
+            " body BLOB NOT NULL)")
+        self.conn.commit()
+
+    def ttl(self, url: str) -> Union[int, None]:
+        """***********************************************************************
+
+        Seconds a cached copy of {url} stays fresh, None if it never expires
+        ***********************************************************************"""
+        if url in self.permanent:
+            return None
+        for patt, ttl in self.ttls:
+            if patt.search(url):
+                return ttl
+        return DEFAULT_TTL
+
+    def get(self, url: str) -> Union[str, None]:
+        """***********************************************************************
+
+        Look up a fresh copy of {url}
+
+        ### Return ###
+        * Cached page source, or None on a miss or an expired entry
+        ***********************************************************************"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT fetched_at, body FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                self.counts["miss"] += 1
+                return None
+
+            ttl = self.ttl(url)
+            if ttl is not None and time.time() - row[0] > ttl:
+                self.counts["expired"] += 1
+                return None
+
+            self.counts["hit"] += 1
+        return zlib.decompress(row[1]).decode("utf-8")
+
+    def put(self, url: str, body: str) -> None:
+        """***********************************************************************
+
+        Store {body} as the latest copy of {url}. A body with the same content
+        hash as the stored one only refreshes its fetch time.
+        ***********************************************************************"""
+        raw = body.encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        with self.lock:
+            updated = self.conn.execute(
+                "UPDATE responses SET fetched_at = ? WHERE url = ? AND sha256 = ?",
+                (time.time(), url, digest)).rowcount
+            if updated:
+                self.counts["unchanged"] += 1
+            else:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                    (url, time.time(), digest, zlib.compress(raw)))
+            self.conn.commit()
+
+    def report(self) -> None:
+        """Print the hit/miss counters of this run"""
+        lookups = self.counts["hit"] + self.counts["miss"] + self.counts["expired"]
+        rate = self.counts["hit"] / lookups * 100 if lookups else 0
+        print(f"Cache: {self.counts['hit']} hits, {self.counts['miss']} misses,"
+              f" {self.counts['expired']} expired ({rate:.1f}% hit rate),"
+              f" {self.counts['unchanged']} refetched pages unchanged")
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.report()
+        self.close()
+# END OF ResponseCache
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+class CachedFetcher:
+    """***************************************************************************
+
+    Fetch backend wrapper that answers from a ResponseCache when it can and only
+    goes to a fetcher on a miss, storing what it downloads. The fetcher is made
+    by {make_fetcher} on the first miss, so a run answered from the cache never
+    starts a browser.
+    ***************************************************************************"""
+
+    def __init__(self, make_fetcher: Callable, cache: ResponseCache):
+        self.make_fetcher = make_fetcher
+        self.cache = cache
+        self.fetcher = None
+        self.lock = threading.Lock()
+
+    def get(self, url: str, ready_selector: str = None) -> Union[str, None]:
+        page_src = self.cache.get(url)
+        if page_src is not None:
+            return page_src
+
+        with self.lock:
+            if self.fetcher is None:
+                self.fetcher = self.make_fetcher()
+        page_src = self.fetcher.get(url, ready_selector)
+        if page_src is not None:
+            self.cache.put(url, page_src)
+        return page_src
+
+    def close(self) -> None:
+        if self.fetcher is not None:
+            self.fetcher.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+# END OF CachedFetcher
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def retiredRikishiUrls(id_file: str = "id.csv") -> set:
+    """***************************************************************************
+
+    Build the set of SumoDB rikishi page urls that can be cached forever, from
+    the ids in {id_file} that have an intai (retirement) basho set
+
+    ### Parameters ###
+    * id_file : profile csv written by profileScraper
+
+    ### Return ###
+    * Set of Rikishi.aspx and Rikishi_opp.aspx urls
+    ***************************************************************************"""
+    if not os.path.isfile(id_file):
+        return set()
+
+    df = pd.read_csv(id_file, dtype={"intai": str})
+    retired = df.loc[df["intai"].fillna('').str.strip() != '', "id"].unique()
+
+    urls = set()
+    for id_ in retired:
+        urls.add(RIKISHI_URL.format(id_))
+        urls.add(RIKISHI_OPP_URL.format(id_))
+    return urls
+# END OF retiredRikishiUrls
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
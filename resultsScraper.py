@@ -2,13 +2,16 @@ import os
 from pathlib import Path
 import pandas as pd
 import re
+import sys
 
-from bs4 import BeautifulSoup as bs
 from bs4.element import Tag
+from crawlEngine import ENGINES, crawl
+from jobJournal import MAX_ATTEMPTS, JobJournal, runJob
+from pipeline import runPipeline
+from responseCache import CachedFetcher, ResponseCache, retiredRikishiUrls
+from runMetrics import METRICS
+from sqliteStore import STORES, SqliteStore, readRows
 from helpers import *
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as ec
 from typing import Union
 
 
@@ -36,6 +39,41 @@ SYS_ARG_DEFAULTS = {
 
 SAVE_DIR = r'.\wrestlerData'
 
+# Retired rikishi stay in a refresh for this many months after their intai, so
+# the results of their last basho are picked up
+REFRESH_MONTHS = 4
+
+SYS_ARGS = {
+    "backend": "http",
+    "engine": "serial",
+    "concurrency": 16,
+    "host_limit": 8,
+    "parsers": None,
+    "store": "csv",
+    "attempts": MAX_ATTEMPTS,
+    "metrics": None
+}
+
+EXPECTED_KEYWORDS = [None, "cache", "refresh"]
+
+EXPECTED_OPTIONS = {
+    None: None,
+    "backend": list(FETCH_BACKENDS),
+    "engine": ENGINES,
+    "concurrency": any,
+    "host_limit": any,
+    "parsers": any,
+    "store": STORES,
+    "attempts": any,
+    "metrics": any,
+    "parser": PARSER_BACKENDS
+}
+
+COMMAND_LINE_USAGE_MSG = "Usage :: python resultsScraper.py [--cache] [--refresh] [-backend <http | selenium>]\
+ [-engine <serial | async | pipeline>] [-concurrency <n>] [-host_limit <n>]\
+ [-parsers <n>] [-store <csv | sqlite>] [-attempts <n>] [-metrics <path>]\
+ [-parser <html.parser | lxml>]"
+
 
 def removeAlpha(s: str):
     match = re.match(r"\d*", s)
@@ -71,17 +109,22 @@ def scrapeRecordStr(record_cell: Tag, rank: Union[str, None]) -> Union[str, None
     return record_str
 
 
-def scrapeRikishi(page_src: str, id_: int, directory: str) -> bool:
+@METRICS.timed("parse")
+def parseRikishi(page_src: str, id_: int) -> Union[pd.DataFrame, None]:
     """***************************************************************************
 
-    Scrapes a rikishi page by their identification number and writes it into its
-    own CSV file
+    Parses the results table of a rikishi page into a dataframe with a row per
+    basho
 
     ### Parameters ###
-    * x : An integer value representing the Id number of a rikishi
+    * page_src : page source of the rikishi's SumoDB page
+    * id_ : An integer value representing the Id number of a rikishi
 
+    ### Return ###
+    * Dataframe with {RESULT_HDRS} columns, or None if the page is improperly
+      formatted
     ***************************************************************************"""
-    soup = bs(page_src, "html.parser")
+    soup = makeSoup(page_src, only_class="rikishi")
     curr_name = ""
     data = []
     try:
@@ -150,28 +193,139 @@ def scrapeRikishi(page_src: str, id_: int, directory: str) -> bool:
             data.append(data_pt)
         # end of FOR
 
-        df = pd.DataFrame(data=data, columns=RESULT_HDRS)
-        df.to_csv(f"{directory}/{id_}.csv",
-                  index=False, mode='x', na_rep='DNE')
     except AttributeError as e:
         print(f"Rikishi page {id_} is improperly formatted or does not exist ")
         print(f"error: {e}")
+        return None
+
+    return pd.DataFrame(data=data, columns=RESULT_HDRS)
+# END OF parseRikishi
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def scrapeRikishi(page_src: str, id_: int, directory: str,
+                  store: SqliteStore = None, refresh: bool = False) -> bool:
+    """***************************************************************************
+
+    Scrapes a rikishi page by their identification number and writes it into its
+    own CSV file, or into {store} if provided
+
+    ### Parameters ###
+    * x : An integer value representing the Id number of a rikishi
+    * refresh : merge into the rikishi's existing results, see refreshRikishi
+
+    ***************************************************************************"""
+    df = parseRikishi(page_src, id_)
+    if df is None:
         return False
+    return writeRikishi(df, id_, directory, store, refresh)
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~END OF scrapeRikishi~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+@METRICS.timed("write", "pages")
+def writeRikishi(df: pd.DataFrame, id_: int, directory: str,
+                 store: SqliteStore = None, refresh: bool = False) -> bool:
+    """***************************************************************************
+
+    Writes the parsed results of a rikishi into its own CSV file, or into
+    {store} if provided, never overwriting results that already exist unless
+    {refresh} is set
 
+    ### Return ###
+    * True if the results were written
+    ***************************************************************************"""
+    if refresh:
+        return refreshRikishi(df, id_, directory, store)
+    if store:
+        return store.putResults(id_, df)
+    try:
+        df.to_csv(f"{directory}/{id_}.csv",
+                  index=False, mode='x', na_rep='DNE')
+    except FileExistsError:
+        print(f"{id_} exists, continuing")
+        return False
     return True
-# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~END OF scrapeRikishi~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# END OF writeRikishi
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def mergeResults(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """***************************************************************************
+
+    Merge freshly scraped results into a rikishi's stored ones. Stored rows
+    are kept up to, but not including, the latest stored basho, which may have
+    been scraped while it was still running; that basho and everything after
+    it come from {new}. Both are in basho order, as on the SumoDB page.
+
+    ### Return ###
+    * Dataframe with {RESULT_HDRS} columns
+    ***************************************************************************"""
+    if old.empty:
+        return new
+    last = old["BASHO"].max()
+    return pd.concat([old[old["BASHO"] < last], new[new["BASHO"] >= last]],
+                     ignore_index=True)
+# END OF mergeResults
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def asText(df: pd.DataFrame) -> pd.DataFrame:
+    """{df} with every value as text and missing values as '', the way the
+    store reads results back"""
+    return df.astype(object).where(df.notna(), '').astype(str).reset_index(drop=True)
 
 
-def idCheck() -> list:
+def refreshRikishi(df: pd.DataFrame, id_: int, directory: str,
+                   store: SqliteStore = None) -> bool:
+    """***************************************************************************
+
+    Merge the freshly parsed results of a rikishi into the existing CSV file,
+    or {store} if provided, with mergeResults. Rikishi without results yet
+    are written as new; unchanged results are not rewritten.
+
+    ### Return ###
+    * True if the results are up to date
+    ***************************************************************************"""
+    if store:
+        old = readRows("results", store.path, [id_], infer_numbers=False)
+        if old.empty and id_ not in store.doneIds("results"):
+            return store.putResults(id_, df)
+        merged = mergeResults(old[RESULT_HDRS], df)
+        if not asText(merged).equals(asText(old[RESULT_HDRS])):
+            store.replace("results", id_, merged)
+        return True
+
+    path = f"{directory}/{id_}.csv"
+    if not os.path.isfile(path):
+        df.to_csv(path, index=False, mode='x', na_rep='DNE')
+        return True
+
+    old = pd.read_csv(path, dtype=str, keep_default_na=False, na_values=['DNE'])
+    old = old.astype(object).where(old.notna(), None)
+    merged = mergeResults(old, df).to_csv(index=False, na_rep='DNE')
+    with open(path, 'r', newline='') as f:
+        if f.read() == merged:
+            return True
+
+    # written aside and swapped in, so a crash never leaves half a file
+    with open(path + ".part", 'w', newline='') as f:
+        f.write(merged)
+    os.replace(path + ".part", path)
+    return True
+# END OF refreshRikishi
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def idCheck(store: SqliteStore = None) -> list:
 
     """***************************************************************************
 
-    Checks the ids that need to be scraped. First checks the {SAVE_DIR} folder
-    for what has already been accomplished, then compares to the id.csv
-    file for what needs to be finished
+    Checks the ids that need to be scraped. First checks the {SAVE_DIR} folder,
+    or {store} if provided, for what has already been accomplished, then
+    compares to the id.csv file for what needs to be finished
 
     ### Parameters ###
-    * :
+    * store : SqliteStore the results are written into
 
     ### Return ###
     * List of ids to do
@@ -180,7 +334,9 @@ def idCheck() -> list:
     df = pd.read_csv("id.csv")
 
     total_ids = set(df['id'].unique())
-    if p.exists():
+    if store:
+        return total_ids.difference(store.doneIds("results"))
+    elif p.exists():
         done_ids = set()
         for f in p.iterdir():
             done_ids.add( int(f.name.replace(".csv", "")) )
@@ -191,56 +347,212 @@ def idCheck() -> list:
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
-def runScraper():
-    running = True
-    while (running):
-        ids = idCheck()
-        with getHeadlessDriver() as driver:
-            waiter = WebDriverWait(driver, timeout=20)
-            fail_cnt = 0
-            succ_cnt = 0
-            for idx, id_ in enumerate(ids):
-                print(f"{idx+1}/{len(ids)}")
-                if fail_cnt >= 10:
-                    print(f"too much failure, qutting")
-                    return -1
-
-                if os.path.isfile(SAVE_DIR+f"\\{id_}.csv"):
-                    print(f"{id_} exists, continuing")
-                    continue
-
-                print(f"scraping {id_}")
-                url = RIKISHI_URL.format(id_)
-                driver.get(url)
-                try:
-                    waiter.until(ec.all_of(
-                        ec.url_to_be(url)
-                        , ec.presence_of_element_located(
-                            ("css selector", ".rikishi"))
-                    ))
-                except TimeoutException:
-                    print(f"Timed Out {id_}")
-                    fail_cnt += 1
-                    continue
-
-                if (not scrapeRikishi(driver.page_source, id_, SAVE_DIR)):
-                    print(f"{id_} failed")
-                    fail_cnt += 1
-                else:
-                    print(f"done {id_}")
-                    fail_cnt = 0
-                    succ_cnt += 1
+def activeIds(id_file: str = "id.csv", months: int = REFRESH_MONTHS) -> set:
+    """***************************************************************************
+
+    Select the rikishi whose results can still change: those without an intai
+    (retirement) basho in {id_file}, and those who retired within the last
+    {months} months
+
+    ### Return ###
+    * Set of ids to refresh
+    ***************************************************************************"""
+    df = pd.read_csv(id_file, dtype={"intai": str})
+    intai = df["intai"].fillna('').str.strip()
+    cutoff = (pd.Timestamp.now() - pd.DateOffset(months=months)).strftime("%Y.%m")
+    return set(df.loc[(intai == '') | (intai >= cutoff), "id"].unique())
+# END OF activeIds
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def scrapeSerial(backend: str, ids: set, cache: ResponseCache = None,
+                 store: SqliteStore = None, refresh: bool = False,
+                 journal: JobJournal = None) -> int:
+    """***************************************************************************
+
+    Scrape {ids} into {SAVE_DIR}, or {store} if provided, one page at a time,
+    answering from {cache} when a fresh copy of the page is stored. With
+    {refresh}, existing results are merged into instead of skipped. The
+    outcome of every id is recorded in {journal} if provided.
+
+    ### Return ###
+    * Number of ids scraped, or -1 if too many pages in a row could not be
+      parsed or written
+    ***************************************************************************"""
+    make_fetcher = lambda: getFetcher(backend, timeout=20)
+    with (CachedFetcher(make_fetcher, cache) if cache else make_fetcher()) as fetcher:
+        fail_cnt = 0
+        succ_cnt = 0
+        for idx, id_ in enumerate(ids):
+            print(f"{idx+1}/{len(ids)}")
+            if fail_cnt >= 10:
+                print(f"too much failure, qutting")
+                return -1
+
+            if not (store or refresh) and os.path.isfile(SAVE_DIR+f"\\{id_}.csv"):
+                print(f"{id_} exists, continuing")
+                if journal:
+                    journal.done(id_)
+                continue
+
+            print(f"scraping {id_}")
+            page_src = fetcher.get(RIKISHI_URL.format(id_), ".rikishi")
+            if page_src is None:
+                # paced by the fetcher's rate controller, not counted
+                print(f"Timed Out {id_}")
+                if journal:
+                    journal.fail(id_, "timed out")
+                continue
+
+            if (not scrapeRikishi(page_src, id_, SAVE_DIR, store, refresh)):
+                print(f"{id_} failed")
+                fail_cnt += 1
+                if journal:
+                    journal.fail(id_, "not written")
+            else:
+                print(f"done {id_}")
+                fail_cnt = 0
+                succ_cnt += 1
+                if journal:
+                    journal.done(id_)
+    return succ_cnt
+# END OF scrapeSerial
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def runScraper(backend: str = "http", engine: str = "serial", concurrency: int = 16,
+               host_limit: int = 8, use_cache: bool = False, parsers: int = None,
+               store_kind: str = "csv", refresh: bool = False,
+               attempts: int = MAX_ATTEMPTS):
+    """***************************************************************************
+
+    Scrape every id left to do from id.csv into {SAVE_DIR}. The serial engine
+    loads one page at a time, the async engine keeps {concurrency} requests in
+    flight with crawlEngine.crawl and the pipeline engine downloads on
+    {concurrency} threads while {parsers} processes parse the pages with
+    pipeline.runPipeline.
+
+    The ids are tracked in a jobJournal: ids that fail are retried in further
+    passes until each has had {attempts} attempts, and a run that was stopped
+    carries on with the ids it did not finish.
+
+    With {refresh}, only the active rikishi of id.csv are scraped and their
+    new basho rows are merged into their existing results.
+
+    ### Parameters ###
+    * backend : fetch backend from helpers.FETCH_BACKENDS used to load pages
+    * engine : one of crawlEngine.ENGINES
+    * concurrency : requests in flight for the async engine
+    * host_limit : requests in flight per host for the async engine
+    * use_cache : answer from the on-disk responseCache, pages of retired
+                rikishi never expire
+    * parsers : parse processes for the pipeline engine, defaults to the cpu
+                count
+    * store_kind : one of sqliteStore.STORES, 'csv' writes a file per rikishi
+                into {SAVE_DIR}, 'sqlite' writes into the single file store
+    * refresh : refetch the active rikishi instead of the missing ones
+    * attempts : attempts per id before giving up on it
+    ***************************************************************************"""
+    cache = None
+    if use_cache:
+        cache = ResponseCache(permanent=retiredRikishiUrls("id.csv"))
+    store = None
+    if store_kind == "sqlite":
+        store = SqliteStore()
+
+    journal = JobJournal("refresh" if refresh else "results", max_attempts=attempts)
+    if refresh:
+        journal.resume(activeIds("id.csv"))
+    else:
+        journal.sync(idCheck(store))
+
+    def runPass(ids: list) -> bool:
+        if engine == "async":
+            make_fetcher = lambda: getFetcher(backend, timeout=20, pool_size=concurrency)
+            with (CachedFetcher(make_fetcher, cache) if cache else make_fetcher()) as fetcher:
+                succ_cnt, _ = crawl(
+                    ids, RIKISHI_URL,
+                    journal.track(lambda id_, page_src: scrapeRikishi(page_src, id_, SAVE_DIR, store, refresh)),
+                    fetcher, concurrency, host_limit, ".rikishi")
+        elif engine == "pipeline":
+            make_fetcher = lambda: getFetcher(backend, timeout=20, pool_size=concurrency)
+            with (CachedFetcher(make_fetcher, cache) if cache else make_fetcher()) as fetcher:
+                succ_cnt, _ = runPipeline(
+                    ids, RIKISHI_URL, parseRikishi,
+                    journal.track(lambda id_, df: writeRikishi(df, id_, SAVE_DIR, store, refresh)),
+                    fetcher, concurrency, parsers, ready_selector=".rikishi")
+        else:
+            succ_cnt = scrapeSerial(backend, ids, cache, store, refresh, journal)
+            if succ_cnt < 0:
+                return False
 
         print(f"Completed {succ_cnt} of {len(ids)}")
         print(f"{len(ids) - succ_cnt} remaining")
-        usr_inp = ''
-        while (usr_inp not in ['y', 'n']):
-            usr_inp = input("Retry? Yes(y), No(n) ")
-        running = usr_inp == 'y'
+        if store:
+            store.flush()
+        return True
+
+    try:
+        status = 0 if runJob(journal, runPass) else -1
+    finally:
+        journal.close()
+        if cache:
+            cache.report()
+            cache.close()
+        if store:
+            store.close()
     print("Closing")
+    return status
+# END OF runScraper
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def handleSysArgs():
+    """***************************************************************************
+
+    Parse and validate the system arguments with the helpers lib, storing the
+    results in {SYS_ARGS}
+
+    ***************************************************************************"""
+    kywrd_args, optns = parseSysArgs(sys.argv)
+    validateSysArgs(kywrd_args, optns, EXPECTED_KEYWORDS,
+                    EXPECTED_OPTIONS, COMMAND_LINE_USAGE_MSG)
+
+    if optns:
+        SYS_ARGS.update(optns)
+    SYS_ARGS["cache"] = bool(kywrd_args) and "cache" in kywrd_args
+    SYS_ARGS["refresh"] = bool(kywrd_args) and "refresh" in kywrd_args
+    if "parser" in SYS_ARGS:
+        setParser(SYS_ARGS["parser"])
+
+    keys = ["concurrency", "host_limit", "attempts"]
+    if SYS_ARGS["parsers"] is not None:
+        keys.append("parsers")
+    for key in keys:
+        try:
+            SYS_ARGS[key] = int(SYS_ARGS[key])
+            assert SYS_ARGS[key] > 0
+        except (ValueError, AssertionError):
+            raise ValueError(
+                f"{key} must be a positive integer. {COMMAND_LINE_USAGE_MSG}")
+
+    if SYS_ARGS["engine"] in ["async", "pipeline"] and SYS_ARGS["backend"] != "http":
+        raise ValueError(
+            f"The {SYS_ARGS['engine']} engine requires the http backend. {COMMAND_LINE_USAGE_MSG}")
+# END OF handleSysArgs
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
 
 def main():
-    runScraper()
+    handleSysArgs()
+    METRICS.reset("resultsScraper")
+    try:
+        runScraper(SYS_ARGS["backend"], SYS_ARGS["engine"],
+                   SYS_ARGS["concurrency"], SYS_ARGS["host_limit"], SYS_ARGS["cache"],
+                   SYS_ARGS["parsers"], SYS_ARGS["store"], SYS_ARGS["refresh"],
+                   SYS_ARGS["attempts"])
+    finally:
+        METRICS.finish(SYS_ARGS["metrics"])
     return
 
 
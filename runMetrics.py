@@ -0,0 +1,172 @@
+import contextlib
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+from typing import Callable, Dict, List
+
+
+class RunMetrics:
+    """***************************************************************************
+
+    Stage timings and counters of one run of a scraper, updater or builder, so
+    a slow run shows whether the time goes to network waits, browser startup
+    and readiness polling, parsing or writing.
+
+    Stages are timed with the stage context manager (or the timed decorator)
+    from any thread; counters such as pages written are raised with count. At
+    the end of the run report prints p50/p95 per stage and the rate of every
+    counter, and write saves the same summary as json.
+
+    The stages used across the project are
+
+    * driver_start : launching a headless firefox
+    * fetch : an http request, from sending it to reading the body
+    * navigate : a browser page load (driver.get)
+    * wait : polling a loaded page until it is ready (WebDriverWait)
+    * parse : turning a page into rows
+    * write : writing the rows of a page
+    * read, transform : the builders' file reads and column derivations
+    ***************************************************************************"""
+
+    def __init__(self, run: str = ""):
+        self.lock = threading.Lock()
+        # runProfiler.RunProfiler profiling each stage, set by --profile
+        self.profiler = None
+        self.reset(run)
+
+    def reset(self, run: str = "") -> None:
+        """Start a new run named {run}, forgetting every timing and count"""
+        with self.lock:
+            self.run = run
+            self.started = time.time()
+            self.clock = time.perf_counter()
+            self.timings = dict()
+            self.counts = dict()
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Add a timing of {seconds} to {stage}"""
+        with self.lock:
+            self.timings.setdefault(stage, list()).append(seconds)
+
+    def count(self, counter: str, n: int = 1) -> None:
+        with self.lock:
+            self.counts[counter] = self.counts.get(counter, 0) + n
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Time the body of the with block as one run of stage {name}, and
+        profile it too when a profiler is attached"""
+        profiling = self.profiler.stage(name) if self.profiler else contextlib.nullcontext()
+        strt = time.perf_counter()
+        try:
+            with profiling:
+                yield
+        finally:
+            self.record(name, time.perf_counter() - strt)
+
+    def timed(self, name: str, counter: str = None) -> Callable:
+        """Decorator timing every call of the function as stage {name}, and
+        raising {counter}, if given, whenever the function returns a truthy
+        value"""
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    result = func(*args, **kwargs)
+                if counter and result:
+                    self.count(counter)
+                return result
+            return wrapper
+        return decorator
+
+    def summary(self) -> dict:
+        """***********************************************************************
+
+        Summarise the run so far
+
+        ### Return ###
+        * dict of the run name, start time, elapsed seconds, per stage count,
+          total, mean, p50, p95 and max seconds, and per counter its count
+          and rate per second
+        ***********************************************************************"""
+        with self.lock:
+            elapsed = time.perf_counter() - self.clock
+            stages = {name: _stats(times) for name, times in self.timings.items()}
+            counts = {name: {"count": n, "per_sec": n / elapsed if elapsed else 0.0}
+                      for name, n in self.counts.items()}
+        return {"run": self.run, "started": self.started, "elapsed": elapsed,
+                "stages": stages, "counts": counts}
+
+    def report(self) -> None:
+        """Print the summary as a table, slowest stage in total first"""
+        summ = self.summary()
+        print(f"=== {summ['run'] or 'run'}: {summ['elapsed']:.1f}s ===")
+        stages = sorted(summ["stages"].items(), key=lambda x: -x[1]["total"])
+        if stages:
+            print(f"{'stage':<14}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for name, s in stages:
+            print(f"{name:<14}{s['count']:>8}{s['total']:>10.1f}{s['p50'] * 1000:>10.1f}"
+                  f"{s['p95'] * 1000:>10.1f}{s['max'] * 1000:>10.1f}")
+        for name, c in summ["counts"].items():
+            print(f"{name}: {c['count']} ({c['per_sec']:.2f}/sec)")
+
+    def write(self, path: str) -> None:
+        """Write the summary to {path} as json"""
+        dir_ = os.path.dirname(path)
+        if dir_:
+            os.makedirs(dir_, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def finish(self, path: str = None) -> None:
+        """End of run: print the report and, if {path} is given, write it,
+        then write out the profiles if the run was profiled"""
+        self.report()
+        if path:
+            self.write(path)
+            print(f"Metrics written to {path}")
+        if self.profiler:
+            self.profiler.finish()
+# END OF RunMetrics
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    """Nearest rank percentile of an already sorted list"""
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def _stats(times: List[float]) -> Dict[str, float]:
+    ordered = sorted(times)
+    return {
+        "count": len(ordered),
+        "total": sum(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": _percentile(ordered, 0.50),
+        "p95": _percentile(ordered, 0.95),
+        "max": ordered[-1],
+    }
+
+
+# Metrics of the running process, shared by every module taking part in a run
+METRICS = RunMetrics()
+
+
+def timedCall(func: Callable, *args):
+    """***************************************************************************
+
+    Call func(*args) and time it, for work run in another process (the parse
+    pool of pipeline.runPipeline) whose METRICS cannot be seen from here
+
+    ### Return ###
+    * Tuple of (result, seconds)
+    ***************************************************************************"""
+    strt = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - strt
+# END OF timedCall
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
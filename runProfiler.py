@@ -0,0 +1,220 @@
+import atexit
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+from pathlib import Path
+from runMetrics import METRICS
+
+PROFILE_DIR = r".\profiles"
+
+# Keywords turning profiling on, accepted by every entry point
+PROFILE_KEYWORDS = ["profile", "tracemalloc"]
+
+# Functions and allocation sites listed in the summary printed at exit
+TOP_N = 20
+
+# Frames kept per allocation; more frames cost memory and time
+TRACEMALLOC_FRAMES = 10
+
+
+class RunProfiler:
+    """***************************************************************************
+
+    Opt in profiling of one run, split by the stages of runMetrics so a slow
+    stage can be looked into on its own.
+
+    * cpu : a cProfile per stage, kept per thread and merged at the end, plus
+            one for the main thread's time outside any stage
+    * memory : tracemalloc snapshots at the start and end of the run
+
+    Everything is written to a directory of its own under {directory}, as
+    <stage>.prof (open with pstats or snakeviz) and start/end.snapshot (open
+    with tracemalloc.Snapshot.load), and the top {top} hotspots are printed
+    when the run finishes.
+
+    Parsing done in the worker processes of pipeline.runPipeline is not seen.
+    ***************************************************************************"""
+
+    def __init__(self, run: str, directory: str = PROFILE_DIR, cpu: bool = True,
+                 memory: bool = False, top: int = TOP_N):
+        self.run = run
+        self.run_dir = os.path.join(directory, f"{run}_{time.strftime('%Y%m%d_%H%M%S')}")
+        self.cpu = cpu
+        self.memory = memory
+        self.top = top
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiles = list()
+        self.main = None
+        self.start_snapshot = None
+        self.finished = False
+
+    def start(self) -> None:
+        os.makedirs(self.run_dir, exist_ok=True)
+        if self.memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.start_snapshot = tracemalloc.take_snapshot()
+        if self.cpu:
+            self.main = cProfile.Profile()
+            self.local.active = self.main
+            self.main.enable()
+        print(f"Profiling {self.run} into {self.run_dir}")
+
+    def _profile(self, name: str) -> cProfile.Profile:
+        """The profile of stage {name} in the calling thread, made on first use"""
+        profiles = getattr(self.local, "profiles", None)
+        if profiles is None:
+            profiles = self.local.profiles = dict()
+        if name not in profiles:
+            profiles[name] = cProfile.Profile()
+            with self.lock:
+                self.profiles.append((name, profiles[name]))
+        return profiles[name]
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """***********************************************************************
+
+        Profile the body of the with block into stage {name}, pausing the
+        profile of the enclosing stage, if any, for the time being
+        ***********************************************************************"""
+        outer = getattr(self.local, "active", None)
+        prof = self._profile(name) if self.cpu and not self.finished else None
+        if prof is None or prof is outer:
+            yield
+            return
+
+        if outer is not None:
+            outer.disable()
+        try:
+            prof.enable()
+        except ValueError:
+            # another profiler is running in this interpreter (python 3.12+)
+            prof = None
+        self.local.active = prof
+        try:
+            yield
+        finally:
+            if prof is not None:
+                prof.disable()
+            self.local.active = outer
+            if outer is not None:
+                outer.enable()
+
+    def _stats(self) -> dict:
+        """Merge the profiles of every thread into pstats.Stats per stage"""
+        stats = dict()
+        with self.lock:
+            profiles = list(self.profiles)
+        if self.main is not None:
+            profiles.append(("main", self.main))
+        for name, prof in profiles:
+            try:
+                if name in stats:
+                    stats[name].add(prof)
+                else:
+                    stats[name] = pstats.Stats(prof)
+            except TypeError:
+                # never enabled, nothing recorded
+                pass
+        return stats
+
+    def finish(self) -> None:
+        """***********************************************************************
+
+        Stop profiling, write the profiles and snapshots to {run_dir} and print
+        the hotspots. Runs once, at the end of the run or at exit.
+        ***********************************************************************"""
+        if self.finished:
+            return
+        self.finished = True
+        if self.main is not None:
+            self.main.disable()
+            self.local.active = None
+
+        print(f"=== profile of {self.run}: {self.run_dir} ===")
+        # memory first, so merging the cpu profiles does not show up in it
+        if self.memory:
+            self._writeMemory()
+        if self.cpu:
+            self._writeCpu()
+
+    def _writeCpu(self) -> None:
+        stats = self._stats()
+        if not stats:
+            print("No cpu profile recorded")
+            return
+
+        combined = None
+        for name, stat in stats.items():
+            stat.dump_stats(os.path.join(self.run_dir, f"{name}.prof"))
+            print(f"{name}: {stat.total_tt:.2f}s profiled")
+            if combined is None:
+                combined = pstats.Stats(stream=io.StringIO())
+            combined.add(stat)
+
+        out = io.StringIO()
+        combined.stream = out
+        combined.sort_stats(pstats.SortKey.TIME).print_stats(self.top)
+        print(f"Top {self.top} functions by own time, all stages:")
+        print(out.getvalue().split("\n\n", 1)[-1].rstrip())
+
+    def _writeMemory(self) -> None:
+        end_snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.start_snapshot.dump(os.path.join(self.run_dir, "start.snapshot"))
+        end_snapshot.dump(os.path.join(self.run_dir, "end.snapshot"))
+
+        print(f"Memory: {current / 2**20:.1f} MiB traced at the end, "
+              f"{peak / 2**20:.1f} MiB peak")
+        print(f"Top {self.top} allocation sites by growth:")
+        for diff in end_snapshot.compare_to(self.start_snapshot, "lineno")[:self.top]:
+            print(f"  {diff}")
+# END OF RunProfiler
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def enableProfiling(run: str, cpu: bool = True, memory: bool = False) -> RunProfiler:
+    """***************************************************************************
+
+    Start profiling the running process, hooking the profiler into the stages
+    of runMetrics.METRICS. Its results are written and printed at exit.
+
+    ### Return ###
+    * The running RunProfiler, or the one already running
+    ***************************************************************************"""
+    if METRICS.profiler is not None:
+        return METRICS.profiler
+    profiler = RunProfiler(run, cpu=cpu, memory=memory)
+    profiler.start()
+    METRICS.profiler = profiler
+    atexit.register(profiler.finish)
+    return profiler
+# END OF enableProfiling
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def profileFromArgs(argv: list) -> RunProfiler:
+    """***************************************************************************
+
+    Enable profiling if {argv} holds --profile (cpu) or --tracemalloc
+    (memory), naming the run after the script
+
+    ### Return ###
+    * The running RunProfiler, or None if profiling was not asked for
+    ***************************************************************************"""
+    flags = set([a.strip().lower() for a in argv[1:]])
+    cpu = "--profile" in flags
+    memory = "--tracemalloc" in flags
+    if not (cpu or memory):
+        return None
+    return enableProfiling(Path(argv[0]).stem, cpu=cpu, memory=memory)
+# END OF profileFromArgs
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -0,0 +1,292 @@
+import contextlib
+import os
+import pandas as pd
+import sqlite3
+import threading
+import time
+
+from helpers import readSysArgs, validateArgs
+
+STORE_PATH = r".\scrapeData.db"
+
+STORES = ["csv", "sqlite"]
+
+# Columns of the per-rikishi files, as written by resultsScraper and
+# matchupScraper, mapped to their column in the store
+RESULT_COLS = {"BASHO": "basho", "SHIKONA": "shikona", "NAME": "name",
+               "RANK": "rank", "RECORD_STR": "record_str", "W": "w", "L": "l",
+               "A": "a", "AWARD": "award", "HEIGHT": "height", "WEIGHT": "weight"}
+BOUT_COLS = {"BASHO": "basho", "DAY": "day", "OPP": "opp", "RESULT": "result",
+             "KIMARITE": "kimarite"}
+
+# Result values are kept as the text that was scraped so an export writes the
+# same files the scraper would have; numbers are inferred when read back
+NUMERIC_RESULT_COLS = ["W", "L", "A", "HEIGHT", "WEIGHT"]
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS results ("
+    " id INTEGER NOT NULL, seq INTEGER NOT NULL, basho TEXT, shikona TEXT,"
+    " name TEXT, rank TEXT, record_str TEXT, w TEXT, l TEXT, a TEXT,"
+    " award TEXT, height TEXT, weight TEXT,"
+    " PRIMARY KEY (id, seq))",
+    "CREATE INDEX IF NOT EXISTS results_basho ON results (basho, id)",
+    "CREATE TABLE IF NOT EXISTS bouts ("
+    " id INTEGER NOT NULL, seq INTEGER NOT NULL, basho TEXT, day INTEGER,"
+    " opp INTEGER, result TEXT, kimarite TEXT,"
+    " PRIMARY KEY (id, seq))",
+    "CREATE INDEX IF NOT EXISTS bouts_key ON bouts (id, basho, day)",
+    "CREATE INDEX IF NOT EXISTS bouts_basho ON bouts (basho, day)",
+    # One row per scraped page, so ids without any rows still count as done
+    "CREATE TABLE IF NOT EXISTS scraped ("
+    " kind TEXT NOT NULL, id INTEGER NOT NULL, rows INTEGER NOT NULL,"
+    " scraped_at REAL NOT NULL,"
+    " PRIMARY KEY (kind, id))",
+]
+
+KINDS = {"results": RESULT_COLS, "bouts": BOUT_COLS}
+
+
+def connect(path: str = STORE_PATH) -> sqlite3.Connection:
+    """Open the store at {path}, creating the tables if needed"""
+    dir_ = os.path.dirname(path)
+    if dir_:
+        os.makedirs(dir_, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    for stmt in SCHEMA:
+        conn.execute(stmt)
+    conn.commit()
+    return conn
+
+
+class SqliteStore:
+    """***************************************************************************
+
+    Single file store for scraped results and bouts, in place of a csv file per
+    rikishi in wrestlerData and matchupData. Pages are buffered and written
+    {batch_size} at a time, each batch in one transaction; a page is either
+    stored completely or not at all.
+
+    Safe to share between the threads of the async and pipeline engines.
+    ***************************************************************************"""
+
+    def __init__(self, path: str = STORE_PATH, batch_size: int = 100):
+        self.path = path
+        self.conn = connect(path)
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = {kind: dict() for kind in KINDS}
+
+    def doneIds(self, kind: str) -> set:
+        """***********************************************************************
+
+        Ids of every page of {kind} ('results' or 'bouts') already stored,
+        including the ones still waiting to be written
+        ***********************************************************************"""
+        with self.lock:
+            done = set([row[0] for row in self.conn.execute(
+                "SELECT id FROM scraped WHERE kind = ?", (kind,))])
+            return done.union(self.pending[kind])
+
+    def put(self, kind: str, id_: int, df: pd.DataFrame) -> bool:
+        """***********************************************************************
+
+        Queue the rows of one page for writing. Like the csv files, a page that
+        is already stored is never overwritten.
+
+        ### Parameters ###
+        * kind : 'results' or 'bouts'
+        * id_ : SumoDB id of the rikishi
+        * df : the parsed page, with the columns of the per-rikishi files
+
+        ### Return ###
+        * True if the page was queued, False if it is already stored
+        ***********************************************************************"""
+        id_ = int(id_)
+        with self.lock:
+            exists = self.conn.execute(
+                "SELECT 1 FROM scraped WHERE kind = ? AND id = ?", (kind, id_)
+            ).fetchone()
+            if exists or id_ in self.pending[kind]:
+                print(f"{id_} exists, continuing")
+                return False
+
+            self.pending[kind][id_] = self._rows(kind, id_, df)
+            if sum([len(p) for p in self.pending.values()]) >= self.batch_size:
+                self._flush()
+        return True
+
+    def replace(self, kind: str, id_: int, df: pd.DataFrame) -> None:
+        """***********************************************************************
+
+        Overwrite every stored row of one page with {df} in a single
+        transaction, for pages that are refreshed after they were first stored
+        ***********************************************************************"""
+        id_ = int(id_)
+        with self.lock:
+            self._flush()
+            with self.conn:
+                self.conn.execute(f"DELETE FROM {kind} WHERE id = ?", (id_,))
+                self.conn.execute(
+                    "DELETE FROM scraped WHERE kind = ? AND id = ?", (kind, id_))
+                self._insert(kind, id_, self._rows(kind, id_, df))
+
+    def putResults(self, id_: int, df: pd.DataFrame) -> bool:
+        return self.put("results", id_, df)
+
+    def putBouts(self, id_: int, df: pd.DataFrame) -> bool:
+        return self.put("bouts", id_, df)
+
+    def _rows(self, kind: str, id_: int, df: pd.DataFrame) -> list:
+        """Rows of {df} as (id, seq, *columns) tuples, NaN as NULL"""
+        cols = list(KINDS[kind])
+        rows = df[cols].astype(object).where(df[cols].notna(), None)
+        rows = rows.itertuples(index=False, name=None)
+        return [(id_, seq, *row) for seq, row in enumerate(rows)]
+
+    def _insert(self, kind: str, id_: int, rows: list) -> None:
+        cols = ", ".join(["id", "seq"] + list(KINDS[kind].values()))
+        marks = ", ".join(["?"] * (len(KINDS[kind]) + 2))
+        self.conn.executemany(f"INSERT INTO {kind} ({cols}) VALUES ({marks})", rows)
+        self.conn.execute("INSERT INTO scraped VALUES (?, ?, ?, ?)",
+                          (kind, id_, len(rows), time.time()))
+
+    def _flush(self) -> None:
+        with self.conn:
+            for kind, pages in self.pending.items():
+                for id_, rows in pages.items():
+                    self._insert(kind, id_, rows)
+                pages.clear()
+
+    def flush(self) -> None:
+        """Write every queued page"""
+        with self.lock:
+            self._flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+# END OF SqliteStore
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def readRows(kind: str, path: str = STORE_PATH, ids: list = None,
+             infer_numbers: bool = True) -> pd.DataFrame:
+    """***************************************************************************
+
+    Read the stored rows of {kind} back with the column names of the
+    per-rikishi files plus ID, in id order and page order within an id
+
+    ### Parameters ###
+    * kind : 'results' or 'bouts'
+    * path : store to read
+    * ids : only read these ids, every id if not provided
+    * infer_numbers : convert the numeric result columns the way read_csv
+                would, otherwise they are left as the scraped text
+
+    ### Return ###
+    * Dataframe of the rows
+    ***************************************************************************"""
+    cols = KINDS[kind]
+    select = ", ".join([f"{col} AS {hdr}" for hdr, col in cols.items()])
+    query = f"SELECT {select}, id AS ID FROM {kind}"
+    params = list()
+    if ids is not None:
+        params = [int(id_) for id_ in ids]
+        query += f" WHERE id IN ({', '.join(['?'] * len(params))})"
+    query += " ORDER BY id, seq"
+
+    with contextlib.closing(connect(path)) as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    if kind == "results" and infer_numbers:
+        for col in NUMERIC_RESULT_COLS:
+            df[col] = pd.to_numeric(df[col].mask(df[col] == ''))
+    return df
+# END OF readRows
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def readResults(path: str = STORE_PATH, ids: list = None) -> pd.DataFrame:
+    return readRows("results", path, ids)
+
+
+def readBouts(path: str = STORE_PATH, ids: list = None) -> pd.DataFrame:
+    return readRows("bouts", path, ids)
+
+
+def exportCsv(kind: str, directory: str, path: str = STORE_PATH) -> int:
+    """***************************************************************************
+
+    Write the stored pages of {kind} out as the per-rikishi csv files the
+    scrapers write without a store, skipping files that already exist
+
+    ### Parameters ###
+    * kind : 'results' (as in wrestlerData) or 'bouts' (as in matchupData)
+    * directory : folder to write into
+    * path : store to read
+
+    ### Return ###
+    * Number of files written
+    ***************************************************************************"""
+    os.makedirs(directory, exist_ok=True)
+    with contextlib.closing(connect(path)) as conn:
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM scraped WHERE kind = ? ORDER BY id", (kind,))]
+
+    hdrs = list(KINDS[kind])
+    written = 0
+    for strt in range(0, len(ids), 500):
+        batch = readRows(kind, path, ids[strt:strt + 500], infer_numbers=False)
+        by_id = dict(list(batch.groupby("ID", sort=False)))
+        for id_ in ids[strt:strt + 500]:
+            dest = os.path.join(directory, f"{id_}.csv")
+            if os.path.isfile(dest):
+                continue
+            df = by_id.get(id_, pd.DataFrame(columns=hdrs + ["ID"]))[hdrs]
+            if kind == "results":
+                df.to_csv(dest, index=False, mode='x', na_rep='DNE')
+            elif df.empty:
+                with open(dest, 'x') as f: f.write(','.join(hdrs))
+            else:
+                df.to_csv(dest, index=False, mode='x')
+            written += 1
+    return written
+# END OF exportCsv
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+SYS_DEFAULTS = {
+    "kind": "results",
+    "directory": "",
+    "path": STORE_PATH
+}
+
+
+def argValidation(sys_args: dict, usage: str):
+    assert sys_args["kind"] in KINDS\
+        , f"Kind must be one of {list(KINDS)}"
+    if not sys_args["directory"]:
+        sys_args["directory"] = "wrestlerData" if sys_args["kind"] == "results" \
+            else "matchupData"
+
+
+def main():
+    """***************************************************************************
+
+    Export the store to per-rikishi csv files
+
+    Usage :: python sqliteStore.py <results | bouts> <directory> <path>
+    ***************************************************************************"""
+    args = readSysArgs(SYS_DEFAULTS.keys())
+    validateArgs(args, SYS_DEFAULTS, argValidation)
+    written = exportCsv(args["kind"], args["directory"], args["path"])
+    print(f"Wrote {written} files into {args['directory']}")
+
+
+if __name__ == "__main__":
+    main()